@@ -7,17 +7,21 @@ import type { ABNSearchResponse } from '@/types/api.types';
 export const abnKeys = {
     all: ['abn'] as const,
     searches: () => [...abnKeys.all, 'search'] as const,
-    search: (query: string) => [...abnKeys.searches(), query] as const,
+    search: (query: string, page = 0) =>
+        [...abnKeys.searches(), query, page] as const,
 };
 
 interface UseABNSearchOptions {
     enabled?: boolean;
+    page?: number;
 }
 
 export function useABNSearch(query: string, options?: UseABNSearchOptions) {
+    const page = options?.page ?? 0;
+
     return useQuery<ABNSearchResponse, APIException>({
-        queryKey: abnKeys.search(query),
-        queryFn: () => searchABN(query),
+        queryKey: abnKeys.search(query, page),
+        queryFn: () => searchABN(query, page),
         enabled: options?.enabled !== false && query.trim().length > 0,
         retry: (failureCount, error) => {
             if (error.statusCode >= 400 && error.statusCode < 500) {
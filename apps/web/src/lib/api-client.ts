@@ -0,0 +1,100 @@
+import { config } from '@/config/env';
+import type { ABNEntity, ABNSearchResponse, APIError } from '@/types/api.types';
+
+/** One row returned by the `search_abn` database function */
+interface SearchRow {
+    abn: string;
+    name: string | null;
+    entity_type_text: string | null;
+    abn_status: string;
+    abn_status_from_date: string;
+    gst_status: string | null;
+    gst_status_from_date: string | null;
+    state_code: string | null;
+    postcode: string | null;
+    rank: number;
+    total_count: number;
+    total_capped: boolean;
+}
+
+export const SEARCH_PAGE_SIZE = 20;
+
+export class APIException extends Error {
+    readonly error: string;
+    readonly statusCode: number;
+
+    constructor({ error, message, statusCode }: APIError) {
+        super(message);
+        this.name = 'APIException';
+        this.error = error;
+        this.statusCode = statusCode;
+    }
+}
+
+const STATUS_LABELS: Record<string, ABNEntity['status']> = {
+    ACT: 'Active',
+    CAN: 'Cancelled',
+};
+
+function toEntity(row: SearchRow): ABNEntity {
+    return {
+        abn: row.abn,
+        name: row.name ?? '',
+        entityType: row.entity_type_text ?? '',
+        status: STATUS_LABELS[row.abn_status] ?? 'Inactive',
+        registrationDate: row.abn_status_from_date,
+        gst: row.gst_status
+            ? {
+                  registered: row.gst_status === 'ACT',
+                  registrationDate: row.gst_status_from_date ?? undefined,
+              }
+            : undefined,
+        address:
+            row.state_code || row.postcode
+                ? { state: row.state_code ?? '', postcode: row.postcode ?? '' }
+                : undefined,
+    };
+}
+
+/**
+ * Ranked, paginated name or ABN search through the `search_abn` database
+ * function. `page` is zero based.
+ */
+export async function searchABN(
+    query: string,
+    page = 0
+): Promise<ABNSearchResponse> {
+    const response = await fetch(
+        `${config.NEXT_PUBLIC_SUPABASE_URL}/rest/v1/rpc/search_abn`,
+        {
+            method: 'POST',
+            headers: {
+                apikey: config.NEXT_PUBLIC_SUPABASE_ANON_KEY,
+                Authorization: `Bearer ${config.NEXT_PUBLIC_SUPABASE_ANON_KEY}`,
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify({
+                search_query: query,
+                page_size: SEARCH_PAGE_SIZE,
+                page_offset: page * SEARCH_PAGE_SIZE,
+            }),
+        }
+    );
+
+    if (!response.ok) {
+        const body = await response.json().catch(() => null);
+        throw new APIException({
+            error: body?.code ?? response.statusText,
+            message: body?.message ?? 'Search request failed',
+            statusCode: response.status,
+        });
+    }
+
+    const rows: SearchRow[] = await response.json();
+    return {
+        results: rows.map(toEntity),
+        query,
+        count: rows[0]?.total_count ?? 0,
+        countCapped: rows[0]?.total_capped ?? false,
+    };
+}
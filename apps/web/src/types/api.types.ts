@@ -17,7 +17,10 @@ export interface ABNEntity {
 export interface ABNSearchResponse {
     results: ABNEntity[];
     query: string;
+    /** Matches that can be paged through, at most 1000 */
     count: number;
+    /** True when there were more matches than `count` */
+    countCapped: boolean;
 }
 
 export interface APIError {
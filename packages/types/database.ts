@@ -47,6 +47,57 @@ export type Database = {
         };
         Relationships: [];
       };
+      abn_search: {
+        Row: {
+          abn: string;
+          abn_status: string;
+          abn_status_from_date: string;
+          entity_type_text: string | null;
+          gst_status: string | null;
+          gst_status_from_date: string | null;
+          name: string | null;
+          other_names: string | null;
+          postcode: string | null;
+          refreshed_at: string | null;
+          search_vector: unknown;
+          state_code: string | null;
+        };
+        Insert: {
+          abn: string;
+          abn_status: string;
+          abn_status_from_date: string;
+          entity_type_text?: string | null;
+          gst_status?: string | null;
+          gst_status_from_date?: string | null;
+          name?: string | null;
+          other_names?: string | null;
+          postcode?: string | null;
+          refreshed_at?: string | null;
+          state_code?: string | null;
+        };
+        Update: {
+          abn?: string;
+          abn_status?: string;
+          abn_status_from_date?: string;
+          entity_type_text?: string | null;
+          gst_status?: string | null;
+          gst_status_from_date?: string | null;
+          name?: string | null;
+          other_names?: string | null;
+          postcode?: string | null;
+          refreshed_at?: string | null;
+          state_code?: string | null;
+        };
+        Relationships: [
+          {
+            foreignKeyName: 'abn_search_abn_fkey';
+            columns: ['abn'];
+            isOneToOne: true;
+            referencedRelation: 'abn_records';
+            referencedColumns: ['abn'];
+          },
+        ];
+      };
       asic_numbers: {
         Row: {
           abn: string;
@@ -102,6 +153,24 @@ export type Database = {
           },
         ];
       };
+      dataset_version: {
+        Row: {
+          id: boolean;
+          loaded_at: string;
+          version: number;
+        };
+        Insert: {
+          id?: boolean;
+          loaded_at?: string;
+          version?: number;
+        };
+        Update: {
+          id?: boolean;
+          loaded_at?: string;
+          version?: number;
+        };
+        Relationships: [];
+      };
       dgr_entries: {
         Row: {
           abn: string;
@@ -273,7 +342,45 @@ export type Database = {
       [_ in never]: never;
     };
     Functions: {
-      [_ in never]: never;
+      bump_dataset_version: {
+        Args: never;
+        Returns: number;
+      };
+      merge_child_rows: {
+        Args: {
+          abns: string[];
+          dgr_entries?: Json;
+          other_entity_names?: Json;
+        };
+        Returns: number;
+      };
+      refresh_abn_search: {
+        Args: { abns?: string[]; source_schema?: string };
+        Returns: number;
+      };
+      search_abn: {
+        Args: {
+          page_offset?: number;
+          page_size?: number;
+          postcode_filter?: string;
+          search_query: string;
+          state_filter?: string;
+        };
+        Returns: {
+          abn: string;
+          abn_status: string;
+          abn_status_from_date: string;
+          entity_type_text: string;
+          gst_status: string;
+          gst_status_from_date: string;
+          name: string;
+          postcode: string;
+          rank: number;
+          state_code: string;
+          total_capped: boolean;
+          total_count: number;
+        }[];
+      };
     };
     Enums: {
       [_ in never]: never;
@@ -0,0 +1,537 @@
+"""
+Ingestion Benchmarks
+
+Measures the ingestion pipeline without the real extract or a live database.
+A synthetic ABN Bulk Extract is generated at any scale, with the same XML
+schema, ZIP layout and mix of individuals, organisations, DGR endorsements
+and other names as the real one. It is then pushed through each stage of
+abn_data.py in turn, and each stage is timed on its own:
+
+    download   download_file() against a local HTTP server with range support
+    unzip      decompressing every XML member
+    parse      process_xml_file(), decompression included
+    batch      build_table_batches()
+    sink       write_batch() on a null sink, or any INGEST_SINK (e.g. postgres)
+
+Records per second, per-batch latency, the resident memory each stage
+reached and the run's peak RSS are reported, and can be compared against a
+stored baseline to flag regressions.
+
+Usage:
+    python abn_bench.py generate data/bench/100000 --records 100000
+    python abn_bench.py run --records 100000 [--sink postgres] [--save-baseline]
+"""
+
+import io
+import os
+import re
+import sys
+import json
+import time
+import random
+import shutil
+import zipfile
+import argparse
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+from functools import partial
+from typing import List, Dict, Optional, Iterator, TextIO
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import abn_data
+from abn_data import AbnRecord
+from ingest_metrics import current_rss_bytes
+
+
+# Entity types of the real register and roughly how common each one is
+ENTITY_TYPES = [
+    ('IND', 'Individual/Sole Trader', 0.58),
+    ('PRV', 'Australian Private Company', 0.20),
+    ('DIT', 'Discretionary Trading Trust', 0.06),
+    ('FPT', 'Family Partnership', 0.05),
+    ('SMF', 'ATO Regulated Self-Managed Superannuation Fund', 0.04),
+    ('DIV', 'Discretionary Investment Trust', 0.03),
+    ('OIE', 'Other Incorporated Entity', 0.02),
+    ('PUB', 'Australian Public Company', 0.01),
+    ('UIE', 'Other Unincorporated Entity', 0.01),
+]
+# Entity types that are companies, and so have an ASIC number
+ASIC_TYPES = {'PRV', 'PUB'}
+
+STATES = [('NSW', 2000, 0.32), ('VIC', 3000, 0.26), ('QLD', 4000, 0.20), ('WA', 6000, 0.10),
+          ('SA', 5000, 0.07), ('TAS', 7000, 0.02), ('ACT', 2600, 0.02), ('NT', 800, 0.01)]
+
+GIVEN_NAMES = ['JAMES', 'JOHN', 'ROBERT', 'MICHAEL', 'DAVID', 'PETER', 'MARK', 'PAUL', 'SARAH', 'JESSICA',
+               'EMMA', 'OLIVIA', 'CHLOE', 'SOPHIE', 'LUCY', 'GRACE', 'WEI', 'MOHAMMED', 'NGUYEN', 'PRIYA']
+FAMILY_NAMES = ['SMITH', 'JONES', 'WILLIAMS', 'BROWN', 'WILSON', 'TAYLOR', 'JOHNSON', 'WHITE', 'MARTIN',
+                'ANDERSON', 'THOMPSON', 'NGUYEN', 'THOMAS', 'WALKER', 'HARRIS', 'LEE', 'RYAN', 'ROBINSON',
+                'KELLY', 'KING', 'CHEN', 'PATEL', 'SINGH', 'WANG']
+NAME_WORDS = ['PACIFIC', 'SOUTHERN', 'COASTAL', 'HARBOUR', 'GOLDEN', 'RIVER', 'SUMMIT', 'EASTERN', 'OUTBACK',
+              'BLUE', 'RED', 'GREEN', 'METRO', 'NATIONAL', 'UNITED', 'ALLIED', 'PREMIER', 'FIRST', 'CITY',
+              'BAY', 'RIDGE', 'VALLEY', 'PARK', 'ISLAND', 'CROSS', 'STAR', 'OAK', 'WATTLE', 'GUM', 'KOALA']
+TRADES = ['CONSTRUCTIONS', 'PLUMBING', 'ELECTRICAL', 'HOLDINGS', 'INVESTMENTS', 'CONSULTING', 'TRANSPORT',
+          'LOGISTICS', 'BAKERY', 'CAFE', 'MEDICAL', 'DENTAL', 'LEGAL', 'ACCOUNTING', 'MOTORS', 'FARMS',
+          'PROPERTY', 'CLEANING', 'LANDSCAPING', 'TECHNOLOGY', 'DESIGN', 'MEDIA', 'FITNESS', 'TRADING']
+OTHER_NAME_TYPES = ['TRD', 'TRD', 'BN', 'OTN']
+
+ABN_WEIGHTS = (10, 1, 3, 5, 7, 9, 11, 13, 15, 17, 19)
+
+# The real extract is split across two archives of ten files each
+ARCHIVE_NAMES = ('public_split_1_10.zip', 'public_split_11_20.zip')
+
+STAGES = ('download', 'unzip', 'parse', 'batch', 'sink')
+
+
+def make_abn(serial: int) -> str:
+    """A valid ABN (mod 89 checksum) whose last nine digits are `serial`"""
+    digits = f"{serial % 10 ** 9:09d}"
+    partial_sum = sum(int(d) * w for d, w in zip(digits, ABN_WEIGHTS[2:]))
+    # (first digit - 1) * 10 + second digit covers 0..89, so every residue has a prefix
+    lead = -partial_sum % 89
+    return f"{lead // 10 + 1}{lead % 10}{digits}"
+
+
+def _pick(rng: random.Random, weighted: List[tuple]):
+    """Pick an entry of a list whose last item is its weight"""
+    point = rng.random()
+    for entry in weighted:
+        point -= entry[-1]
+        if point < 0:
+            return entry
+    return weighted[-1]
+
+
+def _date(rng: random.Random, first_year: int = 1999, last_year: int = 2025) -> str:
+    return f"{rng.randint(first_year, last_year)}{rng.randint(1, 12):02d}{rng.randint(1, 28):02d}"
+
+
+def _business_name(rng: random.Random) -> str:
+    words = rng.sample(NAME_WORDS, rng.choice((1, 1, 2)))
+    return f"{' '.join(words)} {rng.choice(TRADES)}"
+
+
+def synthetic_record(rng: random.Random, serial: int) -> str:
+    """One ABR element, in the layout of the real extract"""
+    entity_ind, entity_text, _ = _pick(rng, ENTITY_TYPES)
+    status = 'CAN' if rng.random() < 0.45 else 'ACT'
+    state, postcode_base, _ = _pick(rng, STATES)
+    address = (f"<BusinessAddress><AddressDetails><State>{state}</State>"
+               f"<Postcode>{postcode_base + rng.randint(0, 199):04d}</Postcode></AddressDetails></BusinessAddress>")
+
+    parts = [f'<ABR recordLastUpdatedDate="{_date(rng, 2015)}" replaced="N">'
+             f'<ABN status="{status}" ABNStatusFromDate="{_date(rng)}">{make_abn(serial)}</ABN>'
+             f'<EntityType><EntityTypeInd>{entity_ind}</EntityTypeInd>'
+             f'<EntityTypeText>{entity_text}</EntityTypeText></EntityType>']
+
+    if entity_ind == 'IND':
+        given = rng.sample(GIVEN_NAMES, rng.choice((1, 2, 2)))
+        parts.append(f'<LegalEntity><IndividualName type="LGL">'
+                     + (f"<NameTitle>{rng.choice(('MR', 'MRS', 'MS', 'DR'))}</NameTitle>" if rng.random() < 0.6 else '')
+                     + ''.join(f"<GivenName>{name}</GivenName>" for name in given)
+                     + f"<FamilyName>{rng.choice(FAMILY_NAMES)}</FamilyName></IndividualName>{address}</LegalEntity>")
+    else:
+        suffix = ' PTY LTD' if entity_ind == 'PRV' else ' LIMITED' if entity_ind == 'PUB' else ''
+        if entity_ind in ('DIT', 'DIV', 'SMF'):
+            suffix = f" {rng.choice(('FAMILY TRUST', 'TRUST', 'SUPER FUND'))}"
+        parts.append(f'<MainEntity><NonIndividualName type="MN"><NonIndividualNameText>'
+                     f"{_business_name(rng)}{suffix}</NonIndividualNameText></NonIndividualName>{address}</MainEntity>")
+        if entity_ind in ASIC_TYPES:
+            parts.append(f'<ASICNumber ASICNumberType="undetermined">{rng.randint(0, 10 ** 9 - 1):09d}</ASICNumber>')
+
+    if rng.random() < 0.4:
+        parts.append(f'<GST status="{status}" GSTStatusFromDate="{_date(rng, 2000)}" />')
+    else:
+        parts.append('<GST status="NON" GSTStatusFromDate="19000101" />')
+
+    if entity_ind != 'IND' and rng.random() < 0.01:
+        for _ in range(rng.choice((1, 1, 2))):
+            parts.append(f'<DGR DGRStatusFromDate="{_date(rng, 2000)}"><NonIndividualName type="DGR">'
+                         f"<NonIndividualNameText>{_business_name(rng)} FUND</NonIndividualNameText>"
+                         f"</NonIndividualName></DGR>")
+
+    other_names = rng.choices((0, 1, 2, 3), weights=(0.6, 0.3, 0.07, 0.03))[0]
+    for _ in range(other_names):
+        parts.append(f'<OtherEntity><NonIndividualName type="{rng.choice(OTHER_NAME_TYPES)}">'
+                     f"<NonIndividualNameText>{_business_name(rng)}</NonIndividualNameText>"
+                     f"</NonIndividualName></OtherEntity>")
+
+    parts.append('</ABR>\n')
+    return ''.join(parts)
+
+
+def write_synthetic_xml(f: TextIO, count: int, rng: random.Random, first_serial: int = 0) -> None:
+    """Write an ABR transfer file of `count` records"""
+    f.write('<?xml version="1.0" encoding="UTF-8"?>\n<Transfer>\n')
+    for serial in range(first_serial, first_serial + count):
+        f.write(synthetic_record(rng, serial))
+    f.write('</Transfer>\n')
+
+
+def generate_extract(out_dir: str, records: int, files: int = 4, seed: int = 1) -> List[str]:
+    """
+    Write a synthetic extract of `records` records to out_dir, split across
+    `files` XML members of the two archives, leaving an archive empty if
+    there are fewer files than archives. An extract already generated with
+    the same settings is reused.
+    """
+    meta_path = os.path.join(out_dir, 'meta.json')
+    meta = {'records': records, 'files': files, 'seed': seed}
+    archives = [os.path.join(out_dir, name) for name in ARCHIVE_NAMES]
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            if json.load(f) == meta and all(os.path.exists(path) for path in archives):
+                print(f"Using existing synthetic extract in {out_dir}")
+                return archives
+
+    os.makedirs(out_dir, exist_ok=True)
+    for path in archives:
+        if os.path.exists(path):
+            os.remove(path)
+    print(f"Generating {records:,} synthetic records in {out_dir}...")
+    start = time.monotonic()
+    rng = random.Random(seed)
+    per_file = -(-records // files)
+    serial = 0
+    for index in range(files):
+        archive = archives[index * len(archives) // files]
+        count = min(per_file, records - serial)
+        with zipfile.ZipFile(archive, 'a', compression=zipfile.ZIP_DEFLATED) as zf:
+            with zf.open(f"20251112_Public{index + 1:02d}.xml", 'w', force_zip64=True) as member:
+                with io.TextIOWrapper(member, encoding='utf-8') as f:
+                    write_synthetic_xml(f, count, rng, serial)
+        serial += count
+    # With fewer files than archives, the rest are left empty, so every archive can still be downloaded
+    for archive in archives:
+        if not os.path.exists(archive):
+            zipfile.ZipFile(archive, 'w').close()
+
+    with open(meta_path, 'w') as f:
+        json.dump(meta, f)
+    print(f"Generated {records:,} records in {time.monotonic() - start:.1f}s")
+    return archives
+
+
+class _RangeRequestHandler(SimpleHTTPRequestHandler):
+    """Static file server with the single byte-range support download_file() uses"""
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def send_head(self):
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return None
+
+        size = os.path.getsize(path)
+        start, end = 0, size - 1
+        match = re.fullmatch(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        if match:
+            start = int(match.group(1))
+            end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+            self.send_response(206)
+            self.send_header('Content-Range', f"bytes {start}-{end}/{size}")
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', 'application/zip')
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+
+        f = open(path, 'rb')
+        f.seek(start)
+        self.remaining = end - start + 1
+        return f
+
+    def copyfile(self, source, outputfile) -> None:
+        while self.remaining:
+            chunk = source.read(min(self.remaining, 1024 * 1024))
+            if not chunk:
+                break
+            outputfile.write(chunk)
+            self.remaining -= len(chunk)
+
+
+class LocalServer:
+    """Serves a directory over HTTP on a free local port, in a background thread"""
+
+    def __init__(self, directory: str):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), partial(_RangeRequestHandler, directory=directory))
+        self.thread = threading.Thread(target=self.server.serve_forever, name='bench-http', daemon=True)
+
+    def url(self, filename: str) -> str:
+        host, port = self.server.server_address
+        return f"http://{host}:{port}/{filename}"
+
+    def __enter__(self) -> 'LocalServer':
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class NullSink:
+    """Accepts batches and throws them away, to time everything but the database"""
+
+    name = 'null'
+
+    def write_batch(self, batch: List[AbnRecord]) -> None:
+        pass
+
+    def delete_abns(self, abns: List[str]) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+def peak_rss_mb() -> Optional[float]:
+    """Peak resident set size of this process so far, where the platform reports it"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in kilobytes on Linux, and in bytes on macOS
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+class StageTimer:
+    """
+    Total time, per-step latencies and throughput of one pipeline stage, and
+    the highest RSS sampled after each of its steps. ru_maxrss would report
+    the peak of every earlier stage too. Where the current RSS cannot be read
+    (macOS), the sample falls back to that process peak.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.seconds = 0.0
+        self.latencies: List[float] = []
+        self.records = 0
+        self.bytes = 0
+        self.peak_rss_mb = None
+
+    def add(self, seconds: float, records: int = 0, size: int = 0) -> None:
+        self.seconds += seconds
+        self.latencies.append(seconds)
+        self.records += records
+        self.bytes += size
+        rss = current_rss_bytes()
+        if rss is not None:
+            self.peak_rss_mb = max(self.peak_rss_mb or 0.0, rss / (1024 * 1024))
+
+    def percentile(self, fraction: float) -> float:
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+    def summary(self) -> Dict:
+        seconds = max(self.seconds, 1e-9)
+        return {
+            'seconds': round(self.seconds, 4),
+            'records_per_sec': round(self.records / seconds) if self.records else None,
+            'mb_per_sec': round(self.bytes / seconds / 1e6, 1) if self.bytes else None,
+            'p50_ms': round(self.percentile(0.5) * 1000, 2),
+            'p95_ms': round(self.percentile(0.95) * 1000, 2),
+            'max_ms': round(max(self.latencies, default=0.0) * 1000, 2),
+            'peak_rss_mb': round(self.peak_rss_mb, 1) if self.peak_rss_mb else None,
+        }
+
+
+def _timed_batches(records: Iterator[AbnRecord], batch_size: int, timer: StageTimer) -> Iterator[List[AbnRecord]]:
+    """Group records into batches, charging the time spent producing each to `timer`"""
+    batches = abn_data.iter_batches(records, batch_size)
+    while True:
+        start = time.perf_counter()
+        batch = next(batches, None)
+        if batch is None:
+            return
+        timer.add(time.perf_counter() - start, len(batch))
+        yield batch
+
+
+def run_benchmark(data_dir: str, sink_name: str = 'null', batch_size: int = abn_data.BATCH_SIZE) -> Dict:
+    """Run every stage over a generated extract and return the results"""
+    timers = {stage: StageTimer(stage) for stage in STAGES}
+    archives = [os.path.join(data_dir, name) for name in ARCHIVE_NAMES]
+
+    # Download, over several range connections like the real extract
+    raw_dir = tempfile.mkdtemp(prefix='abn-bench-')
+    try:
+        with LocalServer(data_dir) as server:
+            for archive in archives:
+                start = time.perf_counter()
+                if not abn_data.download_file(server.url(os.path.basename(archive)), raw_dir):
+                    raise RuntimeError(f"Download of {archive} failed")
+                timers['download'].add(time.perf_counter() - start, size=os.path.getsize(archive))
+
+        sources = abn_data.find_xml_members(raw_dir)
+
+        # Unzip: decompression alone, nothing is parsed
+        for source in sources:
+            start = time.perf_counter()
+            size = 0
+            with abn_data.open_xml_source(source) as f:
+                while True:
+                    chunk = f.read(1024 * 1024)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+            timers['unzip'].add(time.perf_counter() - start, size=size)
+
+        # Parse, batch and sink, one batch at a time so each stage is timed alone
+        sink = NullSink() if sink_name == 'null' else abn_data.create_sink(sink_name, concurrency=1)
+        try:
+            records = (record for source in sources
+                       for record in abn_data.process_xml_file(source, dev_mode=False, progress=False))
+            for batch in _timed_batches(records, batch_size, timers['parse']):
+                start = time.perf_counter()
+                abn_data.build_table_batches(batch)
+                timers['batch'].add(time.perf_counter() - start, len(batch))
+
+                start = time.perf_counter()
+                sink.write_batch(batch)
+                timers['sink'].add(time.perf_counter() - start, len(batch))
+        finally:
+            sink.close()
+    finally:
+        shutil.rmtree(raw_dir, ignore_errors=True)
+
+    parsed = timers['parse'].records
+    # Decompression is already part of parse, so unzip and download are left out
+    pipeline_seconds = sum(timers[stage].seconds for stage in ('parse', 'batch', 'sink'))
+    return {
+        'records': parsed,
+        'sink': sink_name,
+        'parser': 'lxml' if abn_data.XML_PARSER == 'lxml' or (
+            abn_data.XML_PARSER == 'auto' and abn_data.lxml_etree is not None) else 'stdlib',
+        'batch_size': batch_size,
+        'records_per_sec': round(parsed / max(pipeline_seconds, 1e-9)),
+        'peak_rss_mb': round(peak_rss_mb(), 1) if resource else None,
+        'stages': {stage: timer.summary() for stage, timer in timers.items()},
+    }
+
+
+def print_results(results: Dict) -> None:
+    print("\n" + "=" * 78)
+    print(f"{results['records']:,} records, {results['parser']} parser, {results['sink']} sink, "
+          f"batches of {results['batch_size']:,}")
+    print("=" * 78)
+    print(f"{'Stage':<10}{'Seconds':>10}{'Records/s':>12}{'MB/s':>9}{'p50 ms':>10}{'p95 ms':>10}"
+          f"{'max ms':>10}{'RSS MB':>9}")
+    for stage, summary in results['stages'].items():
+        cells = [summary['records_per_sec'], summary['mb_per_sec'], summary['p50_ms'], summary['p95_ms'],
+                 summary['max_ms'], summary['peak_rss_mb']]
+        formatted = [f"{value:,}" if isinstance(value, int) else f"{value:,.1f}" if value is not None else '-'
+                     for value in cells]
+        print(f"{stage:<10}{summary['seconds']:>10.2f}{formatted[0]:>12}{formatted[1]:>9}{formatted[2]:>10}"
+              f"{formatted[3]:>10}{formatted[4]:>10}{formatted[5]:>9}")
+    print("-" * 78)
+    rss = f"{results['peak_rss_mb']:,.1f} MB" if results['peak_rss_mb'] else 'n/a'
+    print(f"Pipeline (parse, batch and sink): {results['records_per_sec']:,} records/s, peak RSS {rss}")
+
+
+def scenario_key(results: Dict) -> str:
+    """Baselines are kept per scale, sink and parser"""
+    return f"{results['records']}-{results['sink']}-{results['parser']}"
+
+
+# Stages that took less than this in the baseline are too quick to compare
+MIN_STAGE_SECONDS = 0.05
+
+
+def find_regressions(results: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Metrics that are worse than the baseline by more than `tolerance` (a fraction)"""
+    regressions = []
+
+    def check(label: str, current, previous, higher_is_better: bool) -> None:
+        if not current or not previous:
+            return
+        change = current / previous - 1
+        if (higher_is_better and change < -tolerance) or (not higher_is_better and change > tolerance):
+            regressions.append(f"{label}: {previous:,} -> {current:,} ({change:+.0%})")
+
+    check('pipeline records/s', results['records_per_sec'], baseline.get('records_per_sec'), True)
+    check('peak RSS MB', results['peak_rss_mb'], baseline.get('peak_rss_mb'), False)
+    for stage, summary in results['stages'].items():
+        previous = baseline.get('stages', {}).get(stage, {})
+        if previous.get('seconds', 0) < MIN_STAGE_SECONDS:
+            continue
+        check(f"{stage} records/s", summary['records_per_sec'], previous.get('records_per_sec'), True)
+        check(f"{stage} MB/s", summary['mb_per_sec'], previous.get('mb_per_sec'), True)
+        check(f"{stage} p95 ms", summary['p95_ms'], previous.get('p95_ms'), False)
+    return regressions
+
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Generate synthetic ABR data and benchmark the ingestion pipeline")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    generate = commands.add_parser('generate', help="write a synthetic extract")
+    generate.add_argument('out')
+    generate.add_argument('--records', type=int, default=100000)
+    generate.add_argument('--files', type=int, default=4, help="XML files to split the records across")
+    generate.add_argument('--seed', type=int, default=1)
+
+    run = commands.add_parser('run', help="benchmark each ingestion stage")
+    run.add_argument('--records', type=int, default=100000)
+    run.add_argument('--files', type=int, default=4)
+    run.add_argument('--seed', type=int, default=1)
+    run.add_argument('--data-dir', help="where the synthetic extract is kept (default data/bench/<records>)")
+    run.add_argument('--sink', default='null', help="null, or an INGEST_SINK value such as postgres")
+    run.add_argument('--batch-size', type=int, default=abn_data.BATCH_SIZE)
+    run.add_argument('--baseline', default=os.path.join(os.getcwd(), 'data', 'bench', 'baseline.json'))
+    run.add_argument('--save-baseline', action='store_true', help="store these results as the baseline")
+    run.add_argument('--tolerance', type=float, default=0.2,
+                     help="fraction a metric may be worse than its baseline before it is flagged")
+    run.add_argument('--output', help="also write the results to this JSON file")
+
+    args = parser.parse_args()
+
+    if args.command == 'generate':
+        generate_extract(args.out, args.records, args.files, args.seed)
+        return
+
+    data_dir = args.data_dir or os.path.join(os.getcwd(), 'data', 'bench', str(args.records))
+    generate_extract(data_dir, args.records, args.files, args.seed)
+    results = run_benchmark(data_dir, args.sink, args.batch_size)
+    print_results(results)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baselines = json.load(f)
+    key = scenario_key(results)
+
+    if args.save_baseline:
+        baselines[key] = results
+        os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+        with open(args.baseline, 'w') as f:
+            json.dump(baselines, f, indent=2)
+        print(f"\nSaved baseline {key} to {args.baseline}")
+    elif key in baselines:
+        regressions = find_regressions(results, baselines[key], args.tolerance)
+        if regressions:
+            print(f"\nRegressions against baseline {key} (tolerance {args.tolerance:.0%}):")
+            for regression in regressions:
+                print(f"  • {regression}")
+            sys.exit(1)
+        print(f"\nNo regressions against baseline {key}")
+    else:
+        print(f"\nNo baseline for {key} in {args.baseline}, run with --save-baseline to store one")
+
+
+if __name__ == '__main__':
+    main()
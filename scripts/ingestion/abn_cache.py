@@ -0,0 +1,225 @@
+"""
+ABN Read Cache
+
+In-process cache for services that look up ABNs and run name searches
+against the database. Lookups are skewed towards a few thousand large
+companies and common name prefixes, and the data only changes when an
+ingestion run completes, so most reads can be answered from memory.
+
+Entries are keyed on the normalized ABN or query text, evicted least
+recently used beyond CACHE_MAX_ENTRIES, and expire after CACHE_TTL_SECONDS.
+Every completed ingestion run bumps public.dataset_version; readers check it
+at most every CACHE_VERSION_CHECK_SECONDS and drop every entry once it
+changes.
+
+Usage:
+    from abn_cache import AbnReader
+
+    reader = AbnReader()                       # DATABASE_URL
+    reader.lookup(['51824753556', '53 004 085 616'])
+    reader.search('acme pty', page=0)
+    reader.stats()
+
+abn_verify.py reads through an AbnReader unless given --index or --no-cache.
+"""
+
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Optional, Iterable, Callable, Hashable, Union
+
+import numpy as np
+
+import abn_data
+from abn_verify import PostgresLookup, abn_keys
+from ingest_metrics import METRICS
+
+
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "100000"))
+CACHE_TTL_SECONDS = float(os.getenv("CACHE_TTL_SECONDS", "3600"))
+CACHE_VERSION_CHECK_SECONDS = float(os.getenv("CACHE_VERSION_CHECK_SECONDS", "10"))
+
+# Stands in for a missing entry, since None (an unknown ABN) is cached too
+MISSING = object()
+
+
+class LruTtlCache:
+    """
+    Thread-safe LRU cache with a time to live, tagged with the dataset version
+    its entries were read from. Setting a different version clears it.
+    """
+
+    def __init__(self, name: str, max_entries: int = CACHE_MAX_ENTRIES, ttl_seconds: float = CACHE_TTL_SECONDS):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.entries: 'OrderedDict[Hashable, tuple]' = OrderedDict()
+        self.version = None
+        self.lock = threading.Lock()
+        self.counts = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0, 'invalidations': 0}
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, key: Hashable):
+        """The cached value, or MISSING"""
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] <= now:
+                del self.entries[key]
+                self.counts['expirations'] += 1
+                entry = None
+            if entry is None:
+                self.counts['misses'] += 1
+                METRICS.inc('cache_requests_total', cache=self.name, result='miss')
+                return MISSING
+            self.entries.move_to_end(key)
+            self.counts['hits'] += 1
+        METRICS.inc('cache_requests_total', cache=self.name, result='hit')
+        return entry[1]
+
+    def put(self, key: Hashable, value, version=None) -> None:
+        """Cache a value, unless it was read from a dataset version that has since been replaced"""
+        with self.lock:
+            if version != self.version:
+                return
+            self.entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self.entries.move_to_end(key)
+            evicted = len(self.entries) - self.max_entries
+            for _ in range(max(evicted, 0)):
+                self.entries.popitem(last=False)
+            if evicted > 0:
+                self.counts['evictions'] += evicted
+            METRICS.set('cache_entries', len(self.entries), cache=self.name)
+
+    def set_version(self, version) -> None:
+        """Drop every entry if they were read from another dataset version"""
+        with self.lock:
+            if version == self.version:
+                return
+            if self.version is not None:
+                self.counts['invalidations'] += 1
+            self.version = version
+            self.entries.clear()
+            METRICS.set('cache_entries', 0, cache=self.name)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            METRICS.set('cache_entries', 0, cache=self.name)
+
+    def stats(self) -> Dict:
+        with self.lock:
+            requests = self.counts['hits'] + self.counts['misses']
+            return {**self.counts, 'entries': len(self.entries), 'version': self.version,
+                    'hit_rate': round(self.counts['hits'] / requests, 4) if requests else None}
+
+
+class DatasetVersion:
+    """
+    The loaded dataset's version, read with `fetch` at most every
+    `check_seconds`, so a burst of cached reads costs no round trips.
+    """
+
+    def __init__(self, fetch: Callable[[], int], check_seconds: float = CACHE_VERSION_CHECK_SECONDS):
+        self.fetch = fetch
+        self.check_seconds = check_seconds
+        self.version = None
+        self.checked_at = float('-inf')
+        self.lock = threading.Lock()
+
+    def current(self) -> int:
+        with self.lock:
+            now = time.monotonic()
+            if now - self.checked_at >= self.check_seconds:
+                self.version = self.fetch()
+                self.checked_at = now
+            return self.version
+
+
+def normalize_query(query: str) -> str:
+    """
+    Search text as a cache key. search_abn ignores case and the spacing
+    between words, so queries that differ only in those share an entry.
+    """
+    return ' '.join(query.lower().split())
+
+
+class AbnReader:
+    """
+    Cached ABN lookups and name searches against Postgres. Both caches are
+    cleared whenever an ingestion run publishes a new dataset version.
+    Results are shared between callers, so treat them as read-only.
+    """
+
+    name = 'postgres (cached)'
+
+    SEARCH_QUERY = "SELECT * FROM public.search_abn(%s, %s, %s, %s, %s)"
+
+    def __init__(self, dsn: str = None, max_entries: int = CACHE_MAX_ENTRIES,
+                 ttl_seconds: float = CACHE_TTL_SECONDS, check_seconds: float = CACHE_VERSION_CHECK_SECONDS):
+        self.source = PostgresLookup(dsn or abn_data.DATABASE_URL)
+        # psycopg2 connections serialize their queries anyway; the lock keeps cursors apart
+        self.lock = threading.Lock()
+        self.lookups = LruTtlCache('lookup', max_entries, ttl_seconds)
+        self.searches = LruTtlCache('search', max_entries, ttl_seconds)
+        self.version = DatasetVersion(self._fetch_version, check_seconds)
+
+    def _fetch_version(self) -> int:
+        with self.lock, self.source.conn.cursor() as cursor:
+            cursor.execute("SELECT version FROM public.dataset_version")
+            row = cursor.fetchone()
+        return row[0] if row else 0
+
+    def _current_version(self) -> int:
+        version = self.version.current()
+        self.lookups.set_version(version)
+        self.searches.set_version(version)
+        return version
+
+    def lookup(self, abns: Union[Iterable[str], np.ndarray]) -> List[Optional[Dict]]:
+        """
+        ABN status, name, GST and ASIC details for each ABN, None where it is
+        invalid or not found. Takes ABN strings, or the int64 keys abn_keys
+        makes of them, so it can stand in for a PostgresLookup. Only ABNs
+        missing from the cache are queried, all in one go.
+        """
+        version = self._current_version()
+        if isinstance(abns, np.ndarray):
+            keys = abns.tolist()
+        else:
+            keys = abn_keys([str(abn) for abn in abns]).tolist()
+        results = [None if key < 0 else self.lookups.get(key) for key in keys]
+
+        missing = sorted({key for key, result in zip(keys, results) if result is MISSING})
+        if missing:
+            with self.lock:
+                found = self.source.lookup(np.array(missing, dtype=np.int64))
+            fetched = dict(zip(missing, found))
+            for key, record in fetched.items():
+                self.lookups.put(key, record, version)
+            results = [fetched[key] if result is MISSING else result for key, result in zip(keys, results)]
+        return results
+
+    def search(self, query: str, page: int = 0, page_size: int = 20, state: Optional[str] = None,
+               postcode: Optional[str] = None) -> List[Dict]:
+        """One page of search_abn results; `page` is zero based"""
+        version = self._current_version()
+        key = (normalize_query(query), state, postcode, page_size, page)
+        rows = self.searches.get(key)
+        if rows is MISSING:
+            with self.lock, self.source.conn.cursor() as cursor:
+                cursor.execute(self.SEARCH_QUERY, (key[0], state, postcode, page_size, page * page_size))
+                columns = [column.name for column in cursor.description]
+                rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+            self.searches.put(key, rows, version)
+        return rows
+
+    def stats(self) -> Dict[str, Dict]:
+        """Hits, misses, evictions and size of each cache"""
+        return {'lookup': self.lookups.stats(), 'search': self.searches.stats()}
+
+    def close(self) -> None:
+        self.source.close()
@@ -4,47 +4,122 @@ ABN Bulk Extract Data Ingestion Script
 Processes and uploads ABN data from local files to Supabase
 """
 
+import io
+import argparse
 import os
 import sys
+import json
+import shutil
+import hashlib
+import itertools
+import random
+import time
+import queue
+import threading
 import zipfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
 import xml.etree.ElementTree as ET
-from typing import List, Dict, Optional
+from array import array
+from contextlib import contextmanager
+from typing import List, Dict, Optional, Iterable, Iterator, Union, BinaryIO
 from pathlib import Path
+import numpy as np
 from supabase import create_client, Client
 from dotenv import load_dotenv
 import requests
 from urllib.parse import urlparse
 
+try:
+    from lxml import etree as lxml_etree
+except ImportError:
+    lxml_etree = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
 # Load environment variables from root .env file
 # TODO: dynamically load in either .env or .env.local based on existence
 root_dir = Path(__file__).parent.parent.parent
 env_path = root_dir / '.env.local'
 load_dotenv(dotenv_path=env_path)
 
+# Reads its settings from the environment, so it is imported once that is loaded
+from ingest_metrics import METRICS, MetricsReporter, log_event
+
 # Configuration
 SUPABASE_URL = os.getenv("SUPABASE_URL") or os.getenv("NEXT_PUBLIC_SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_KEY")
 DEV_MODE = os.getenv("DEV_MODE", "true").lower() == "true"
 SAMPLE_SIZE = int(os.getenv("SAMPLE_SIZE", "100000"))
+BATCH_SIZE = int(os.getenv("BATCH_SIZE", "1000"))
+# XML parser backend: 'auto' (lxml when installed), 'lxml' or 'stdlib'
+XML_PARSER = os.getenv("XML_PARSER", "auto").lower()
+# Number of parsed batches allowed to wait for upload before parsing blocks
+PREFETCH_BATCHES = int(os.getenv("PREFETCH_BATCHES", "4"))
+# Number of processes parsing XML files in parallel (1 = parse serially)
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "1"))
+# Number of batches being written to Supabase at the same time
+UPLOAD_CONCURRENCY = int(os.getenv("UPLOAD_CONCURRENCY", "4"))
+# Batches are also cut by estimated payload size, adapted between these bounds
+# so that each batch write takes about BATCH_TARGET_SECONDS
+BATCH_MAX_BYTES = int(os.getenv("BATCH_MAX_BYTES", str(8 * 1024 * 1024)))
+BATCH_MIN_BYTES = int(os.getenv("BATCH_MIN_BYTES", str(64 * 1024)))
+BATCH_TARGET_SECONDS = float(os.getenv("BATCH_TARGET_SECONDS", "5"))
+# Retries of a failed batch write, with jittered exponential backoff from BATCH_BACKOFF_SECONDS
+BATCH_RETRIES = int(os.getenv("BATCH_RETRIES", "3"))
+BATCH_BACKOFF_SECONDS = float(os.getenv("BATCH_BACKOFF_SECONDS", "0.5"))
+# Records that cannot be written even on their own, and how many a run may set aside
+DEAD_LETTER_PATH = os.getenv("DEAD_LETTER_PATH") or os.path.join(os.getcwd(), 'data', 'dead_letter.jsonl')
+DEAD_LETTER_LIMIT = int(os.getenv("DEAD_LETTER_LIMIT", "1000"))
+# Where parsed records are written: 'supabase' (REST upserts), 'postgres' (COPY bulk load)
+# or 'parquet' (columnar export), or a comma-separated list such as 'postgres,parquet'
+INGEST_SINK = os.getenv("INGEST_SINK", "supabase").lower()
+INGEST_SINKS = [name.strip() for name in INGEST_SINK.split(',')]
+# Direct Postgres connection string, used by the 'postgres' sink
+DATABASE_URL = os.getenv("DATABASE_URL")
+# Parquet export location, rows per row group and rows per part file
+EXPORT_DIR = os.getenv("EXPORT_DIR") or os.path.join(os.getcwd(), 'data', 'export')
+PARQUET_ROW_GROUP_ROWS = int(os.getenv("PARQUET_ROW_GROUP_ROWS", "131072"))
+PARQUET_PART_ROWS = int(os.getenv("PARQUET_PART_ROWS", "5000000"))
+# Only upload records that changed since the last run
+DELTA_MODE = os.getenv("DELTA_MODE", "false").lower() == "true"
+# How changes are detected: 'date' (recordLastUpdatedDate) or 'hash' (record content fingerprint)
+DELTA_STRATEGY = os.getenv("DELTA_STRATEGY", "date").lower()
+# Local change-detection index (defaults to data/manifest.npz or data/fingerprints)
+MANIFEST_PATH = os.getenv("MANIFEST_PATH")
+# Largest share of the index a hash run may delete as vanished; more points at a broken extract
+VANISHED_MAX_FRACTION = float(os.getenv("VANISHED_MAX_FRACTION", "0.01"))
+
+# Parallel range connections per downloaded file
+DOWNLOAD_CONNECTIONS = int(os.getenv("DOWNLOAD_CONNECTIONS", "4"))
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+# How many bytes each range writes between persisting its resume offset
+DOWNLOAD_STATE_INTERVAL = 16 * 1024 * 1024
 
 ABN_DOWNLOAD_URLS = [
     "https://data.gov.au/data/dataset/5bd7fcab-e315-42cb-8daf-50b7efc2027e/resource/0ae4d427-6fa8-4d40-8e76-c6909b5a071b/download/public_split_1_10.zip",
     "https://data.gov.au/data/dataset/5bd7fcab-e315-42cb-8daf-50b7efc2027e/resource/635fcb95-7864-4509-9fa7-a62a6e32b62d/download/public_split_11_20.zip"
 ]
+# Comma-separated override, e.g. to point at a local mirror
+if os.getenv("ABN_DOWNLOAD_URLS"):
+    ABN_DOWNLOAD_URLS = [url.strip() for url in os.getenv("ABN_DOWNLOAD_URLS").split(',') if url.strip()]
 
 
-def setup_directories(base_dir: str) -> tuple[str, str]:
+def setup_directories(base_dir: str) -> str:
     """Create necessary directories for data processing"""
     raw_dir = os.path.join(base_dir, 'data', 'raw')
-    extract_dir = os.path.join(base_dir, 'data', 'extracted')
 
     os.makedirs(raw_dir, exist_ok=True)
-    os.makedirs(extract_dir, exist_ok=True)
 
     print(f"Created directory: {raw_dir}")
-    print(f"Created directory: {extract_dir}")
 
-    return raw_dir, extract_dir
+    return raw_dir
 
 
 def cleanup_directory(dir_path: str) -> None:
@@ -64,39 +139,208 @@ def cleanup_directory(dir_path: str) -> None:
         print(f"Directory does not exist: {dir_path}")
 
 
-def download_file(url: str, destination: str) -> bool:
-    """Download a file from URL to destination with progress indicator"""
+class DownloadProgress:
+    """Byte counter shared by a file's range connections, printed every 10%"""
+
+    def __init__(self, total: int, already: int = 0):
+        self.total = total
+        self.downloaded = already
+        self.lock = threading.Lock()
+        self.next_report = (int(already / total * 10) + 1) / 10 if total else 1.0
+
+    def add(self, n: int) -> None:
+        METRICS.inc('download_bytes_total', n)
+        with self.lock:
+            self.downloaded += n
+            if self.total and self.downloaded / self.total >= self.next_report:
+                fraction = self.downloaded / self.total
+                print(f"Progress: {self.downloaded:,}/{self.total:,} bytes ({fraction:.0%})")
+                self.next_report = (int(fraction * 10) + 1) / 10
+
+
+def probe_download(url: str) -> tuple[int, bool]:
+    """(content length, supports range requests) for a download URL"""
+    response = requests.head(url, allow_redirects=True, timeout=30)
+    response.raise_for_status()
+    size = int(response.headers.get('content-length', 0))
+    ranges = response.headers.get('accept-ranges', '').lower() == 'bytes'
+    return size, ranges and size > 0
+
+
+def verify_zip(filepath: str) -> bool:
+    """Check a ZIP archive's integrity against each member's CRC-32"""
+    try:
+        with zipfile.ZipFile(filepath) as archive:
+            bad_member = archive.testzip()
+        if bad_member:
+            print(f"Checksum mismatch in {os.path.basename(filepath)}: {bad_member}")
+            return False
+        return True
+    except zipfile.BadZipFile as e:
+        print(f"Corrupt archive {os.path.basename(filepath)}: {e}")
+        return False
+
+
+def download_segment(url: str, part_path: str, segment: List[int], state: Dict, state_path: str,
+                     state_lock: threading.Lock, progress: DownloadProgress, retries: int = 3) -> None:
+    """
+    Fetch one byte range of a file into place, resuming from its recorded
+    offset. segment[2] only ever counts bytes that are flushed and fsynced,
+    since the shared state file is written by every range's thread.
+    """
+    start, end = segment[0], segment[1]
+
+    for attempt in range(retries + 1):
+        # Anything past the durable offset is fetched again
+        written = segment[2]
+        offset = start + written
+        if offset > end:
+            return
+        try:
+            headers = {'Range': f"bytes={offset}-{end}"}
+            with requests.get(url, headers=headers, stream=True, timeout=60) as response:
+                response.raise_for_status()
+                if response.status_code != 206:
+                    raise IOError(f"Server ignored range request for bytes {offset}-{end}")
+
+                with open(part_path, 'r+b') as f:
+                    f.seek(offset)
+                    unsaved = 0
+                    for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                        f.write(chunk)
+                        written += len(chunk)
+                        unsaved += len(chunk)
+                        progress.add(len(chunk))
+
+                        # Record the offset only once the bytes behind it are on disk
+                        if unsaved >= DOWNLOAD_STATE_INTERVAL:
+                            _sync(f)
+                            segment[2] = written
+                            save_download_state(state, state_path, state_lock)
+                            unsaved = 0
+                    _sync(f)
+                    segment[2] = written
+                save_download_state(state, state_path, state_lock)
+            return
+        except (requests.RequestException, IOError) as e:
+            if attempt == retries:
+                raise
+            print(f"Retrying bytes {start + segment[2]}-{end} of {os.path.basename(part_path)}: {e}")
+            METRICS.inc('retries_total', stage='download')
+            time.sleep(2 ** attempt)
+
+
+def _sync(f) -> None:
+    """Push a file's buffered writes through to the disk"""
+    f.flush()
+    os.fsync(f.fileno())
+
+
+def save_download_state(state: Dict, state_path: str, lock: threading.Lock) -> None:
+    """Persist per-segment progress so an interrupted download can resume"""
+    with lock:
+        tmp_path = f"{state_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+            # Durable before it replaces the last good state
+            _sync(f)
+        os.replace(tmp_path, state_path)
+
+
+def download_file(url: str, destination: str, connections: int = DOWNLOAD_CONNECTIONS) -> bool:
+    """
+    Download a file from URL to destination. Large files are split into byte
+    ranges fetched over several connections, partial downloads resume from
+    their last recorded offset, and the result is size and CRC checked
+    before it is used.
+    """
     try:
         filename = os.path.basename(urlparse(url).path)
         filepath = os.path.join(destination, filename)
-
-        # Skip if file already exists
+        part_path = f"{filepath}.part"
+        state_path = f"{filepath}.part.json"
+
+        try:
+            total_size, supports_ranges = probe_download(url)
+        except requests.RequestException as e:
+            # Offline re-runs can still use a complete, verified archive
+            if os.path.exists(filepath) and verify_zip(filepath):
+                print(f"Could not reach {url} ({e}), using existing {filename}")
+                return True
+            raise
+
+        # Skip if a complete copy already exists. Without a content length, only its checksums can tell
         if os.path.exists(filepath):
             file_size = os.path.getsize(filepath)
-            print(f"File already exists: {filename} ({file_size:,} bytes)")
-            return True
+            if (file_size == total_size or not total_size) and verify_zip(filepath):
+                print(f"File already exists: {filename} ({file_size:,} bytes)")
+                return True
+            expected = f"{total_size:,}" if total_size else "unknown"
+            print(f"Existing {filename} is incomplete or corrupt ({file_size:,}/{expected} bytes), re-downloading")
+            os.remove(filepath)
 
         print(f"\nDownloading: {filename}")
         print(f"From: {url}")
 
-        response = requests.get(url, stream=True)
-        response.raise_for_status()
-
-        total_size = int(response.headers.get('content-length', 0))
-        block_size = 8192
-        downloaded = 0
-
-        with open(filepath, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=block_size):
-                if chunk:
-                    f.write(chunk)
-                    downloaded += len(chunk)
-
-                    if total_size > 0:
-                        percent = (downloaded / total_size) * 100
-                        print(f"\rProgress: {downloaded:,}/{total_size:,} bytes ({percent:.1f}%)", end='')
-
-        print(f"\nCompleted: {filename} ({downloaded:,} bytes)")
+        if supports_ranges:
+            state = None
+            if os.path.exists(part_path) and os.path.exists(state_path):
+                with open(state_path) as f:
+                    state = json.load(f)
+                if state.get('url') != url or state.get('size') != total_size:
+                    state = None
+
+            if state is None:
+                # Split the file into one byte range per connection
+                segment_size = -(-total_size // connections)
+                state = {
+                    'url': url,
+                    'size': total_size,
+                    'segments': [[start, min(start + segment_size, total_size) - 1, 0]
+                                 for start in range(0, total_size, segment_size)]
+                }
+                with open(part_path, 'wb') as f:
+                    f.truncate(total_size)
+            else:
+                done = sum(segment[2] for segment in state['segments'])
+                print(f"Resuming {filename} from {done:,}/{total_size:,} bytes")
+
+            state_lock = threading.Lock()
+            save_download_state(state, state_path, state_lock)
+            progress = DownloadProgress(total_size, sum(segment[2] for segment in state['segments']))
+
+            with ThreadPoolExecutor(max_workers=len(state['segments']), thread_name_prefix='range') as pool:
+                futures = [
+                    pool.submit(download_segment, url, part_path, segment, state, state_path, state_lock, progress)
+                    for segment in state['segments']
+                ]
+                for future in futures:
+                    future.result()
+        else:
+            # No range support, so the whole file comes down one stream
+            progress = DownloadProgress(total_size)
+            with requests.get(url, stream=True, timeout=60) as response:
+                response.raise_for_status()
+                with open(part_path, 'wb') as f:
+                    for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                        f.write(chunk)
+                        progress.add(len(chunk))
+
+        downloaded = os.path.getsize(part_path)
+        if total_size and downloaded != total_size:
+            print(f"\nSize mismatch for {filename}: {downloaded:,}/{total_size:,} bytes")
+            return False
+        if not verify_zip(part_path):
+            os.remove(part_path)
+            if os.path.exists(state_path):
+                os.remove(state_path)
+            return False
+
+        os.replace(part_path, filepath)
+        if os.path.exists(state_path):
+            os.remove(state_path)
+
+        print(f"Completed: {filename} ({downloaded:,} bytes)")
         return True
 
     except Exception as e:
@@ -104,20 +348,116 @@ def download_file(url: str, destination: str) -> bool:
         return False
 
 
-def extract_zip(zip_path: str, extract_to: str) -> bool:
-    """Extract ZIP file"""
-    try:
-        print(f"Extracting {zip_path}...")
-        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-            zip_ref.extractall(extract_to)
-        print(f"Extracted to: {extract_to}")
-        return True
-    except Exception as e:
-        print(f"Error extracting {zip_path}: {e}")
-        return False
+def download_all(urls: List[str], destination: str, connections: int = DOWNLOAD_CONNECTIONS) -> bool:
+    """Download every URL at once, each over its own set of range connections"""
+    with ThreadPoolExecutor(max_workers=max(len(urls), 1), thread_name_prefix='download') as pool:
+        results = list(pool.map(lambda url: download_file(url, destination, connections), urls))
+
+    for url, ok in zip(urls, results):
+        if not ok:
+            print(f"Failed to download {url}")
+    return all(results)
+
+
+class AbnRecord:
+    """
+    A parsed ABR record, held as ready-made table rows. Each row is a tuple in
+    TABLE_COLUMNS order with the ABN first, so sinks can write rows as they are
+    without rebuilding a dict per row. A missing 0..1 row is None, and 0..n
+    rows are a tuple of rows, or None if there are none.
+    """
+
+    __slots__ = ('abn_record', 'main_entity', 'legal_entity', 'asic_number', 'gst_registration',
+                 'dgr_entries', 'other_entity_names', 'business_address', 'position')
+
+    # Table fed by each row slot
+    TABLES = {
+        'abn_record': 'abn_records',
+        'main_entity': 'main_entity',
+        'legal_entity': 'legal_entity',
+        'asic_number': 'asic_numbers',
+        'gst_registration': 'gst_registrations',
+        'dgr_entries': 'dgr_entries',
+        'other_entity_names': 'other_entity_names',
+        'business_address': 'business_addresses',
+    }
+
+    def __init__(self, abn_record: tuple, main_entity: Optional[tuple] = None,
+                 legal_entity: Optional[tuple] = None, asic_number: Optional[tuple] = None,
+                 gst_registration: Optional[tuple] = None, dgr_entries: Optional[tuple] = None,
+                 other_entity_names: Optional[tuple] = None, business_address: Optional[tuple] = None,
+                 position: Optional[tuple] = None):
+        self.abn_record = abn_record
+        self.main_entity = main_entity
+        self.legal_entity = legal_entity
+        self.asic_number = asic_number
+        self.gst_registration = gst_registration
+        self.dgr_entries = dgr_entries
+        self.other_entity_names = other_entity_names
+        self.business_address = business_address
+        # (source name, element position) of the record, used for checkpoints
+        self.position = position
+
+    def __reduce__(self):
+        # Pickled as a flat tuple when records cross from parse workers to the parent
+        return AbnRecord, tuple(getattr(self, slot) for slot in AbnRecord.__slots__)
+
+    @property
+    def abn(self) -> str:
+        return self.abn_record[0]
+
+    @property
+    def record_last_updated_date(self) -> Optional[str]:
+        return self.abn_record[1]
+
+    @classmethod
+    def from_dict(cls, record: Dict) -> 'AbnRecord':
+        """Build a record from the nested dict form produced by parse_xml_record"""
+        abn = record['abn_record']['abn']
+
+        def row(slot: str, data: Optional[Dict]) -> Optional[tuple]:
+            if not data:
+                return None
+            return (abn,) + tuple(data[column] for column in TABLE_COLUMNS[cls.TABLES[slot]][1:])
+
+        def rows(slot: str, entries: Optional[List[Dict]]) -> Optional[tuple]:
+            if not entries:
+                return None
+            return tuple(row(slot, entry) for entry in entries)
+
+        return cls(
+            tuple(record['abn_record'][column] for column in TABLE_COLUMNS['abn_records']),
+            row('main_entity', record['main_entity']),
+            row('legal_entity', record['legal_entity']),
+            (abn, record['asic_number']) if record['asic_number'] else None,
+            row('gst_registration', record['gst_registration']),
+            rows('dgr_entries', record['dgr_entries']),
+            rows('other_entity_names', record['other_entity_names']),
+            row('business_address', record['business_address'])
+        )
+
+    def to_dict(self) -> Dict:
+        """The nested dict form of the record, as produced by parse_xml_record"""
+
+        def data(slot: str, row: Optional[tuple]) -> Optional[Dict]:
+            if row is None:
+                return None
+            return dict(zip(TABLE_COLUMNS[self.TABLES[slot]][1:], row[1:]))
 
+        return {
+            'abn_record': dict(zip(TABLE_COLUMNS['abn_records'], self.abn_record)),
+            'main_entity': data('main_entity', self.main_entity),
+            'legal_entity': data('legal_entity', self.legal_entity),
+            'asic_number': self.asic_number[1] if self.asic_number else None,
+            'gst_registration': data('gst_registration', self.gst_registration),
+            'dgr_entries': [data('dgr_entries', row) for row in self.dgr_entries] if self.dgr_entries else None,
+            'other_entity_names': ([data('other_entity_names', row) for row in self.other_entity_names]
+                                   if self.other_entity_names else None),
+            'business_address': data('business_address', self.business_address)
+        }
 
-def parse_xml_record(record: ET.Element) -> Optional[Dict]:
+
+def parse_xml_record(record: ET.Element) -> Optional[AbnRecord]:
     """Parse a single ABN XML record into normalized structure"""
     try:
         # Core ABN Record
@@ -258,7 +598,7 @@ def parse_xml_record(record: ET.Element) -> Optional[Dict]:
                 other_entities.append(other_entry)
 
         # Return normalized structure
-        return {
+        return AbnRecord.from_dict({
             'abn_record': {
                 'abn': abn,
                 'record_last_updated_date': record_last_updated,
@@ -274,7 +614,7 @@ def parse_xml_record(record: ET.Element) -> Optional[Dict]:
             'dgr_entries': dgr_entries if dgr_entries else None,
             'other_entity_names': other_entities if other_entities else None,
             'business_address': business_address_data
-        }
+        })
 
     except Exception as e:
         print(f"Error parsing record: {e}")
@@ -283,120 +623,1844 @@ def parse_xml_record(record: ET.Element) -> Optional[Dict]:
         return None
 
 
-def process_xml_file(file_path: str, current_count: int = 0, dev_mode: bool = True, sample_size: int = 100000) -> List[
-    Dict]:
-    """Process XML file and extract business records"""
-    print(f"\nProcessing XML file: {file_path}")
-    records = []
+# Codes, dates and states repeat across millions of records, so one copy of each is shared
+_shared_values: Dict[Optional[str], Optional[str]] = {}
+
+
+def _shared(value: Optional[str]) -> Optional[str]:
+    """The shared copy of a low-cardinality field value"""
+    return _shared_values.setdefault(value, value)
+
+
+def _first_child_text(elem, tag: str) -> Optional[str]:
+    """Text of the first direct child with the given tag"""
+    for child in elem:
+        if child.tag == tag:
+            return child.text
+    return None
+
+
+def _parse_non_individual_name(elem) -> tuple[Optional[str], Optional[str]]:
+    """(type, text) of a NonIndividualName element"""
+    return _shared(elem.get('type')), _first_child_text(elem, 'NonIndividualNameText')
+
 
+def _parse_address(entity) -> tuple[bool, Optional[tuple]]:
+    """(has BusinessAddress, (state code, postcode)) for a MainEntity or LegalEntity"""
+    for child in entity:
+        if child.tag == 'BusinessAddress':
+            for details in child:
+                if details.tag == 'AddressDetails':
+                    return True, (_shared(_first_child_text(details, 'State')),
+                                  _shared(_first_child_text(details, 'Postcode')))
+            return True, None
+    return False, None
+
+
+def parse_xml_record_fast(record) -> Optional[AbnRecord]:
+    """
+    Single-pass equivalent of parse_xml_record. Walks each record's children
+    once instead of running a find()/findall() scan per field, and fills the
+    record's table rows directly.
+    """
     try:
-        context = ET.iterparse(file_path, events=('end',))
-        count = 0
-
-        for event, elem in context:
-            # Process full ABR blocks
-            if elem.tag.endswith('ABR'):
-                record = parse_xml_record(elem)
-                if record:
-                    records.append(record)
-                    count += 1
-
-                    # Progress update so we know records are being processed
-                    if count % 10000 == 0:
-                        print(f"Processed {count:,} valid records...")
-
-                # Clear the element to free memory
-                # TODO: is there a better way to free memory?
-                elem.clear()
-
-            # In dev mode, stop early if we have enough samples
-            if dev_mode and (current_count + count) >= sample_size:
-                print(f"Reached sample size of {sample_size:,} records, stopping early.")
-                break
+        abn_elem = entity_type_elem = main_entity = legal_entity = None
+        asic_elem = gst_elem = None
+        dgr_elems = []
+        other_elems = []
+
+        for child in record:
+            tag = child.tag
+            if tag == 'ABN':
+                if abn_elem is None:
+                    abn_elem = child
+            elif tag == 'EntityType':
+                if entity_type_elem is None:
+                    entity_type_elem = child
+            elif tag == 'MainEntity':
+                if main_entity is None:
+                    main_entity = child
+            elif tag == 'LegalEntity':
+                if legal_entity is None:
+                    legal_entity = child
+            elif tag == 'ASICNumber':
+                if asic_elem is None:
+                    asic_elem = child
+            elif tag == 'GST':
+                if gst_elem is None:
+                    gst_elem = child
+            elif tag == 'DGR':
+                dgr_elems.append(child)
+            elif tag == 'OtherEntity':
+                other_elems.append(child)
 
-    except Exception as e:
-        print(f"Error processing XML file: {e}")
+        if abn_elem is None:
+            return None
+
+        abn = ''.join(abn_elem.text.split()) if abn_elem.text else None
+        if not abn or len(abn) != 11:
+            return None
+
+        entity_type_ind = None
+        entity_type_text = None
+        if entity_type_elem is not None:
+            entity_type_ind = _shared(_first_child_text(entity_type_elem, 'EntityTypeInd'))
+            entity_type_text = _shared(_first_child_text(entity_type_elem, 'EntityTypeText'))
+
+        main_entity_row = None
+        has_address = False
+        address = None
+        if main_entity is not None:
+            for child in main_entity:
+                if child.tag == 'NonIndividualName':
+                    main_entity_row = (abn,) + _parse_non_individual_name(child)
+                    break
+            has_address, address = _parse_address(main_entity)
+
+        legal_entity_row = None
+        if legal_entity is not None:
+            for child in legal_entity:
+                if child.tag == 'IndividualName':
+                    title = family_name = None
+                    given_names = []
+                    seen_title = seen_family = False
+                    for part in child:
+                        if part.tag == 'NameTitle' and not seen_title:
+                            title, seen_title = _shared(part.text), True
+                        elif part.tag == 'GivenName':
+                            given_names.append(part.text)
+                        elif part.tag == 'FamilyName' and not seen_family:
+                            family_name, seen_family = part.text, True
+                    legal_entity_row = (
+                        abn,
+                        _shared(child.get('type')),
+                        title,
+                        given_names[0] if len(given_names) > 0 else None,
+                        given_names[1] if len(given_names) > 1 else None,
+                        family_name
+                    )
+                    break
+            # BusinessAddress falls back to the LegalEntity one
+            if not has_address:
+                has_address, address = _parse_address(legal_entity)
+
+        gst_row = None
+        if gst_elem is not None:
+            gst_row = (abn, _shared(gst_elem.get('status')), _shared(gst_elem.get('GSTStatusFromDate')))
+
+        dgr_rows = []
+        for dgr_elem in dgr_elems:
+            name = (None, None)
+            for child in dgr_elem:
+                if child.tag == 'NonIndividualName':
+                    name = _parse_non_individual_name(child)
+                    break
+            dgr_rows.append((abn, _shared(dgr_elem.get('DGRStatusFromDate')), _shared(dgr_elem.get('status'))) + name)
+
+        other_rows = []
+        for other_elem in other_elems:
+            for child in other_elem:
+                if child.tag == 'NonIndividualName':
+                    other_rows.append((abn,) + _parse_non_individual_name(child))
+                    break
 
-    return records
+        asic_number = asic_elem.text if asic_elem is not None else None
 
+        return AbnRecord(
+            (abn, _shared(record.get('recordLastUpdatedDate')), _shared(abn_elem.get('status')),
+             _shared(abn_elem.get('ABNStatusFromDate')), entity_type_ind, entity_type_text),
+            main_entity_row,
+            legal_entity_row,
+            (abn, asic_number) if asic_number else None,
+            gst_row,
+            tuple(dgr_rows) if dgr_rows else None,
+            tuple(other_rows) if other_rows else None,
+            (abn,) + address if address else None
+        )
 
-def upload_to_supabase(records: List[Dict], batch_size: int = 1000) -> bool:
-    """Upload records to Supabase in batches using normalized schema"""
+    except Exception as e:
+        print(f"Error parsing record: {e}")
+        return None
+
+
+def iter_abr_records(source, skip: int = 0) -> Iterator[Optional[AbnRecord]]:
+    """
+    Parse each ABR element in an XML file or file object, freeing it once parsed.
+    The first `skip` elements are discarded without being parsed.
+    """
+    if XML_PARSER == 'lxml' and lxml_etree is None:
+        raise RuntimeError("XML_PARSER=lxml, but lxml is not installed (pip install lxml)")
+    if XML_PARSER == 'lxml' or (XML_PARSER == 'auto' and lxml_etree is not None):
+        # Tag filtering happens in C, so only ABR elements reach Python
+        context = lxml_etree.iterparse(source, events=('end',), tag='ABR', huge_tree=True)
+        for _, elem in context:
+            if skip:
+                skip -= 1
+            else:
+                yield parse_xml_record_fast(elem)
+
+            # Free the record and the already-processed siblings before it
+            elem.clear(keep_tail=True)
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+        return
+
+    context = ET.iterparse(source, events=('start', 'end'))
+    _, root = next(context)
+    for event, elem in context:
+        # Process full ABR blocks
+        if event != 'end' or not elem.tag.endswith('ABR'):
+            continue
+
+        if skip:
+            skip -= 1
+        else:
+            yield parse_xml_record(elem)
+
+        # Drop the processed record from the root so memory stays flat
+        root.clear()
+
+
+# An XML file on disk, or a (zip_path, member_name) pair read straight from its archive
+XmlSource = Union[str, tuple]
+
+
+def describe_source(source: XmlSource) -> str:
+    """Short display name for an XML source"""
+    if isinstance(source, tuple):
+        zip_path, member = source
+        return f"{os.path.basename(zip_path)}:{member}"
+    return source
+
+
+@contextmanager
+def open_xml_source(source: XmlSource) -> Iterator[BinaryIO]:
+    """Open an XML file, or decompress a ZIP member on the fly without extracting it"""
+    if isinstance(source, tuple):
+        zip_path, member = source
+        with zipfile.ZipFile(zip_path) as archive, archive.open(member) as f:
+            yield f
+    else:
+        with open(source, 'rb') as f:
+            yield f
+
+
+def find_xml_members(raw_dir: str) -> List[tuple]:
+    """List the XML members of every downloaded ZIP archive in a stable order"""
+    sources = []
+    for filename in sorted(os.listdir(raw_dir)):
+        if filename.endswith('.zip'):
+            zip_path = os.path.join(raw_dir, filename)
+            with zipfile.ZipFile(zip_path) as archive:
+                members = [name for name in archive.namelist() if name.endswith('.xml')]
+            sources.extend((zip_path, member) for member in sorted(members))
+    return sources
+
+
+def process_xml_file(source: XmlSource, current_count: int = 0, dev_mode: bool = True,
+                     sample_size: int = 100000, progress: bool = True, skip: int = 0,
+                     completed: Optional[set] = None) -> Iterator[AbnRecord]:
+    """
+    Stream business records from an XML file or ZIP member one at a time.
+    Each record is tagged with its source and element position, and the
+    first `skip` elements are passed over unparsed. Errors reading the
+    archive or the XML are raised, after the records before them. The name
+    of a source read without error, to its end or the sample size, is added
+    to `completed`.
+    """
+    name = describe_source(source)
+    if progress:
+        print(f"\nProcessing XML file: {name}")
+        if skip:
+            print(f"Skipping {skip:,} already committed records")
+
+    count = 0
+    counted = 0
     try:
-        supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-        print(f"\nUploading {len(records):,} records in batches of {batch_size}...")
+        with open_xml_source(source) as f:
+            for position, record in enumerate(iter_abr_records(f, skip), start=skip):
+                if not record:
+                    METRICS.inc('records_invalid_total')
+                    continue
+
+                record.position = (name, position)
+                yield record
+                count += 1
+
+                # Counted in blocks, progress is reported by the metrics reporter
+                if count - counted >= 1000:
+                    METRICS.inc('records_parsed_total', count - counted)
+                    counted = count
+
+                # In dev mode, stop early if we have enough samples
+                if dev_mode and (current_count + count) >= sample_size:
+                    print(f"Reached sample size of {sample_size:,} records, stopping early.")
+                    break
+
+        if completed is not None:
+            completed.add(name)
+
+    except Exception as e:
+        # A CRC or inflate error in the archive, or truncated XML, fails the run rather than end the file early
+        print(f"Error processing XML file {name}: {e}")
+        raise
+    finally:
+        METRICS.inc('records_parsed_total', count - counted)
+
 
-        for i in range(0, len(records), batch_size):
-            batch = records[i:i + batch_size]
+# Set in each parse worker process by _init_parse_worker
+_worker_queue = None
+_worker_stop = None
 
+
+def _init_parse_worker(record_queue, stop_event) -> None:
+    """Give a parse worker process its handles to the shared record queue"""
+    global _worker_queue, _worker_stop
+    _worker_queue = record_queue
+    _worker_stop = stop_event
+    # Unsent chunks are only left behind once the parent has stopped reading
+    record_queue.cancel_join_thread()
+
+
+def _put_until_stopped(record_queue, stop_event, item) -> bool:
+    """Put onto a bounded queue, giving up if the run is being stopped"""
+    while not stop_event.is_set():
+        try:
+            record_queue.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def parse_file_worker(source: XmlSource, chunk_size: int, skip: int = 0) -> int:
+    """
+    Parse one XML source in a worker process, streaming record chunks to the
+    parent. Metrics recorded here stay in this process, so each chunk carries
+    the number of invalid records skipped since the last one.
+    """
+    count = 0
+    invalid = METRICS.total('records_invalid_total')
+    try:
+        records = process_xml_file(source, dev_mode=False, progress=False, skip=skip)
+        for chunk in iter_batches(records, chunk_size):
+            skipped = METRICS.total('records_invalid_total') - invalid
+            invalid += skipped
+            if not _put_until_stopped(_worker_queue, _worker_stop, ('records', source, (chunk, skipped))):
+                break
+            count += len(chunk)
+    except BaseException as e:
+        # The parent fails the run rather than carry on without the rest of this file
+        _put_until_stopped(_worker_queue, _worker_stop, ('failed', source, f"{type(e).__name__}: {e}"))
+        raise
+    skipped = METRICS.total('records_invalid_total') - invalid
+    _put_until_stopped(_worker_queue, _worker_stop, ('done', source, (count, skipped)))
+    return count
+
+
+def parse_files_parallel(sources: List[XmlSource], workers: int, current_count: int = 0,
+                         dev_mode: bool = True, sample_size: int = 100000,
+                         chunk_size: int = BATCH_SIZE, skips: Optional[Dict[str, int]] = None,
+                         completed: Optional[set] = None) -> Iterator[AbnRecord]:
+    """
+    Parse XML files (or ZIP members, each opened by its own worker) across a
+    pool of worker processes and merge their records into a single stream. Workers block once workers * PREFETCH_BATCHES chunks
+    are waiting, so parsing never runs far ahead of the upload stage.
+    `skips` maps a source's display name to the number of leading elements to pass over.
+    Each source a worker has read to its end is added to `completed` by name.
+    """
+    skips = skips or {}
+    # Forking from the batch producer thread could copy a lock another thread holds, such as the metrics lock
+    ctx = multiprocessing.get_context('spawn')
+    record_queue = ctx.Queue(maxsize=workers * PREFETCH_BATCHES)
+    stop_event = ctx.Event()
+    file_counts: Dict[XmlSource, int] = {}
+    total = 0
+
+    print(f"\nParsing {len(sources)} XML files with {workers} workers")
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_init_parse_worker,
+                             initargs=(record_queue, stop_event)) as pool:
+        futures = [pool.submit(parse_file_worker, source, chunk_size, skips.get(describe_source(source), 0))
+                   for source in sources]
+
+        try:
+            while len(file_counts) < len(sources):
+                try:
+                    kind, source, payload = record_queue.get(timeout=1)
+                except queue.Empty:
+                    # A worker that died outright, e.g. killed for memory, never reports back
+                    for future in futures:
+                        if future.done() and future.exception():
+                            raise RuntimeError(f"Parse worker failed: {future.exception()}")
+                    continue
+
+                if kind == 'failed':
+                    raise RuntimeError(f"Parse worker failed on {describe_source(source)}: {payload}")
+                if kind == 'done':
+                    file_counts[source], skipped = payload
+                    METRICS.inc('records_invalid_total', skipped)
+                    if completed is not None:
+                        completed.add(describe_source(source))
+                    print(f"Finished {describe_source(source)}: {file_counts[source]:,} records "
+                          f"({len(file_counts)}/{len(sources)} files)")
+                    continue
+
+                chunk, skipped = payload
+                METRICS.inc('records_invalid_total', skipped)
+                for index, record in enumerate(chunk):
+                    if dev_mode and (current_count + total) >= sample_size:
+                        METRICS.inc('records_parsed_total', index)
+                        print(f"Reached sample size of {sample_size:,} records, stopping early.")
+                        return
+                    yield record
+                    total += 1
+
+                # Counted here, as workers' metrics stay in their own processes
+                METRICS.inc('records_parsed_total', len(chunk))
+
+        finally:
+            stop_event.set()
+            for future in futures:
+                future.cancel()
+            # Keep draining so workers blocked on a full queue can exit
+            while not all(f.done() for f in futures):
+                try:
+                    record_queue.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+
+    print(f"Parsed {total:,} records from {len(sources)} files")
+
+
+def iter_batches(records: Iterable[AbnRecord], batch_size: int) -> Iterator[List[AbnRecord]]:
+    """Group a stream of records into lists of at most batch_size"""
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def record_bytes(record: AbnRecord) -> int:
+    """Rough size of a record's rows once written, counting each value and a little per field"""
+    size = 0
+    for slot in AbnRecord.TABLES:
+        rows = getattr(record, slot)
+        if rows is None:
+            continue
+        for row in (rows if slot in ('dgr_entries', 'other_entity_names') else (rows,)):
+            size += 16 * len(row) + sum(len(value) for value in row if value)
+    return size
+
+
+class BatchSizer:
+    """
+    Byte budget for each batch, adapted to the sink. Measured throughput sets
+    the budget so a batch takes about `target_seconds` to write, up to a
+    ceiling. Every failed write halves the ceiling, and each successful write
+    grows it back by `recovery`, so a sink that just failed is not handed
+    full-size batches again straight away. The budget stays within
+    min_bytes..max_bytes.
+    """
+
+    def __init__(self, max_bytes: int = BATCH_MAX_BYTES, min_bytes: int = BATCH_MIN_BYTES,
+                 target_seconds: float = BATCH_TARGET_SECONDS, recovery: float = 1.1):
+        self.max_bytes = max_bytes
+        self.min_bytes = min(min_bytes, max_bytes)
+        self.target_seconds = target_seconds
+        self.recovery = recovery
+        self.budget = max_bytes
+        self.ceiling = max_bytes
+        self.throughput = None
+        self.lock = threading.Lock()
+
+    def _set_budget(self, budget: float) -> None:
+        self.budget = int(min(max(budget, self.min_bytes), self.max_bytes))
+        METRICS.set('batch_budget_bytes', self.budget)
+
+    def succeeded(self, batch: List[AbnRecord], seconds: float) -> None:
+        """Fold a successful write into the throughput estimate"""
+        rate = sum(map(record_bytes, batch)) / max(seconds, 1e-3)
+        with self.lock:
+            # Smoothed, so one quick or slow batch does not swing the budget
+            self.throughput = rate if self.throughput is None else 0.8 * self.throughput + 0.2 * rate
+            self.ceiling = min(self.ceiling * self.recovery, self.max_bytes)
+            self._set_budget(min(self.throughput * self.target_seconds, self.ceiling))
+
+    def failed(self) -> None:
+        with self.lock:
+            self.ceiling = max(self.budget / 2, self.min_bytes)
+            self._set_budget(self.ceiling)
+
+
+def iter_sized_batches(records: Iterable[AbnRecord], batch_size: int,
+                       sizer: BatchSizer) -> Iterator[List[AbnRecord]]:
+    """Group records into batches of at most batch_size records and about sizer.budget bytes"""
+    batch = []
+    size = 0
+    for record in records:
+        batch.append(record)
+        size += record_bytes(record)
+        if len(batch) >= batch_size or size >= sizer.budget:
+            yield batch
+            batch = []
+            size = 0
+    if batch:
+        yield batch
+
+
+def stream_batches(records: Iterable[AbnRecord], batch_size: int,
+                   max_pending: int = PREFETCH_BATCHES, sizer: Optional[BatchSizer] = None) -> Iterator[List[AbnRecord]]:
+    """
+    Build batches on a background thread so parsing overlaps with uploading.
+    At most max_pending batches are buffered; once the queue is full the
+    parser blocks until the consumer catches up. With a sizer, batches are
+    also cut at its byte budget.
+    """
+    pending: queue.Queue = queue.Queue(maxsize=max_pending)
+    stop = threading.Event()
+    done = object()
+
+    def put(item) -> bool:
+        while not stop.is_set():
             try:
-                # Prepare batch data for all tables
-                abn_batch = []
-                main_entity_batch = []
-                legal_entity_batch = []
-                asic_batch = []
-                gst_batch = []
-                dgr_batch = []
-                other_names_batch = []
-                address_batch = []
-
-                abns_in_batch = [r['abn_record']['abn'] for r in batch]
-
-                # Collect all data for batch
-                for record in batch:
-                    abn = record['abn_record']['abn']
-                    abn_batch.append({**record['abn_record']})
-
-                    if record['main_entity']:
-                        main_entity_batch.append({'abn': abn, **record['main_entity']})
-                    if record['legal_entity']:
-                        legal_entity_batch.append({'abn': abn, **record['legal_entity']})
-                    if record['asic_number']:
-                        asic_batch.append({'abn': abn, 'asic_number': record['asic_number']})
-                    if record['gst_registration']:
-                        gst_batch.append({'abn': abn, **record['gst_registration']})
-                    if record['dgr_entries']:
-                        dgr_batch.extend([{'abn': abn, **e} for e in record['dgr_entries']])
-                    if record['other_entity_names']:
-                        other_names_batch.extend([{'abn': abn, **e} for e in record['other_entity_names']])
-                    if record['business_address']:
-                        address_batch.append({'abn': abn, **record['business_address']})
-
-                # Execute batch operations
-                supabase.table('abn_records').upsert(abn_batch, on_conflict='abn').execute()
-
-                if main_entity_batch:
-                    supabase.table('main_entity').upsert(main_entity_batch, on_conflict='abn').execute()
-                if legal_entity_batch:
-                    supabase.table('legal_entity').upsert(legal_entity_batch, on_conflict='abn').execute()
-                if asic_batch:
-                    supabase.table('asic_numbers').upsert(asic_batch, on_conflict='abn').execute()
-                if gst_batch:
-                    supabase.table('gst_registrations').upsert(gst_batch, on_conflict='abn').execute()
-                if address_batch:
-                    supabase.table('business_addresses').upsert(address_batch, on_conflict='abn').execute()
-
-                # Delete old entries in batch
-                supabase.table('dgr_entries').delete().in_('abn', abns_in_batch).execute()
-                supabase.table('other_entity_names').delete().in_('abn', abns_in_batch).execute()
-
-                if dgr_batch:
-                    supabase.table('dgr_entries').insert(dgr_batch).execute()
-                if other_names_batch:
-                    supabase.table('other_entity_names').insert(other_names_batch).execute()
-
-                print(f"Uploaded {min(i + batch_size, len(records)):,}/{len(records):,} records")
+                pending.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce() -> None:
+        try:
+            batches = iter_sized_batches(records, batch_size, sizer) if sizer else iter_batches(records, batch_size)
+            for batch in batches:
+                if not put(batch):
+                    return
+            put(done)
+        except BaseException as e:
+            put(e)
+
+    producer = threading.Thread(target=produce, name='batch-producer', daemon=True)
+    producer.start()
+
+    try:
+        while True:
+            item = pending.get()
+            if item is done:
+                break
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        producer.join()
+        # Shut down the upstream parser (and any worker processes) if we stopped early
+        if hasattr(records, 'close'):
+            records.close()
+
+
+def _date_key(value: Optional[str]) -> int:
+    """Pack a yyyymmdd (or yyyy-mm-dd) date string into an int, 0 when missing"""
+    return int(value.replace('-', '')) if value else 0
+
+
+def record_fingerprint(record: AbnRecord) -> int:
+    """Stable 64-bit hash of a normalized record"""
+    payload = json.dumps(record.to_dict(), sort_keys=True, separators=(',', ':')).encode()
+    return int.from_bytes(hashlib.blake2b(payload, digest_size=8).digest(), 'little')
+
+
+class AbnValueIndex:
+    """
+    Compact per-ABN value map used by delta ingestion. ABNs are packed as
+    int64 in a sorted numpy array alongside a parallel array of values, so a
+    whole chunk of records is checked with one vectorised binary search.
+    """
+
+    value_dtype = np.uint32
+
+    def __init__(self, abns: Optional[np.ndarray] = None, values: Optional[np.ndarray] = None):
+        self.abns = abns if abns is not None else np.empty(0, dtype=np.int64)
+        self.values = values if values is not None else np.empty(0, dtype=self.value_dtype)
+        self.pending_abns: List[np.ndarray] = []
+        self.pending_values: List[np.ndarray] = []
+        self.inserted = 0
+        self.changed = 0
+        self.skipped = 0
+
+    def __len__(self) -> int:
+        return len(self.abns)
+
+    @classmethod
+    def from_pairs(cls, abns: np.ndarray, values: np.ndarray):
+        """Build an index from unsorted ABN/value arrays"""
+        order = np.argsort(abns, kind='stable')
+        return cls(abns[order], values[order])
+
+    def record_values(self, chunk: List[AbnRecord]) -> np.ndarray:
+        """The value compared for each record in a chunk"""
+        raise NotImplementedError
+
+    def lookup(self, abns: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Positions of each ABN in the index and whether it is present"""
+        if not len(self.abns):
+            return np.zeros(len(abns), dtype=np.int64), np.zeros(len(abns), dtype=bool)
+        idx = np.minimum(np.searchsorted(self.abns, abns), len(self.abns) - 1)
+        return idx, self.abns[idx] == abns
+
+    def changed_mask(self, abns: np.ndarray, values: np.ndarray) -> np.ndarray:
+        """True for each ABN that is new or whose value differs"""
+        idx, known = self.lookup(abns)
+        self.inserted += int((~known).sum())
+        if not len(self.abns):
+            return ~known
+        return ~known | (self.values[idx] != values)
+
+    def note(self, abns: np.ndarray, values: np.ndarray) -> None:
+        """Remember new values; they are merged in when the index is saved"""
+        self.pending_abns.append(abns)
+        self.pending_values.append(values)
+
+    def merge_pending(self) -> None:
+        """Fold noted values into the sorted arrays, newest value winning"""
+        if not self.pending_abns:
+            return
+        abns = np.concatenate(self.pending_abns[::-1] + [self.abns])
+        values = np.concatenate(self.pending_values[::-1] + [self.values])
+        # np.unique keeps the first occurrence, which is the most recently noted
+        self.abns, first = np.unique(abns, return_index=True)
+        self.values = values[first]
+        self.pending_abns.clear()
+        self.pending_values.clear()
+
+    def forget(self, abns: np.ndarray) -> None:
+        """Drop ABNs, including values noted this run, so the next run writes them again"""
+        self.merge_pending()
+        keep = ~np.isin(self.abns, abns)
+        self.abns = np.asarray(self.abns[keep])
+        self.values = np.asarray(self.values[keep])
+
+
+class UpdateManifest(AbnValueIndex):
+    """ABN -> recordLastUpdatedDate (yyyymmdd uint32), about 12 bytes per ABN"""
+
+    value_dtype = np.uint32
+
+    @classmethod
+    def load(cls, path: str) -> 'UpdateManifest':
+        """Load a manifest saved by save()"""
+        with np.load(path) as data:
+            return cls(data['abns'], data['dates'])
+
+    @classmethod
+    def from_database(cls, page_size: int = 100000) -> 'UpdateManifest':
+        """Read the current ABN -> last updated date map out of abn_records"""
+        abns = array('q')
+        dates = array('I')
+
+        if DATABASE_URL:
+            import psycopg2
+
+            with psycopg2.connect(DATABASE_URL) as conn:
+                # Server-side cursor so 20M rows are never held in memory at once
+                with conn.cursor(name='manifest') as cursor:
+                    cursor.itersize = page_size
+                    cursor.execute("SELECT abn, to_char(record_last_updated_date, 'YYYYMMDD') FROM public.abn_records")
+                    for abn, date in cursor:
+                        abns.append(int(abn))
+                        dates.append(_date_key(date))
+        else:
+            supabase = get_supabase_client()
+            last_abn = ''
+            while True:
+                # Keyset pagination; PostgREST caps each response at 1000 rows
+                rows = (supabase.table('abn_records').select('abn,record_last_updated_date')
+                        .gt('abn', last_abn).order('abn').limit(1000).execute().data)
+                if not rows:
+                    break
+                for row in rows:
+                    abns.append(int(row['abn']))
+                    dates.append(_date_key(row['record_last_updated_date']))
+                last_abn = rows[-1]['abn']
+
+        return cls.from_pairs(np.frombuffer(abns, dtype=np.int64), np.frombuffer(dates, dtype=np.uint32))
+
+    def record_values(self, chunk: List[AbnRecord]) -> np.ndarray:
+        return np.fromiter((_date_key(r.record_last_updated_date) for r in chunk),
+                           dtype=np.uint32, count=len(chunk))
+
+    def save(self, path: str) -> None:
+        """Write the manifest atomically so a crash never leaves a torn file"""
+        self.merge_pending()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, abns=self.abns, dates=self.values)
+        os.replace(tmp_path, path)
+
+
+class FingerprintIndex(AbnValueIndex):
+    """
+    ABN -> 64-bit content hash of the normalized record, about 16 bytes per
+    ABN. Stored as two raw .npy files that are memory-mapped on load, so a
+    20M ABN index opens almost instantly. Tracks which ABNs were seen during
+    the run so vanished ABNs can be deleted afterwards.
+    """
+
+    value_dtype = np.uint64
+
+    def __init__(self, abns: Optional[np.ndarray] = None, values: Optional[np.ndarray] = None):
+        super().__init__(abns, values)
+        self.seen = np.zeros(len(self.abns), dtype=bool)
+
+    @classmethod
+    def load(cls, path: str) -> 'FingerprintIndex':
+        """Memory-map an index directory saved by save()"""
+        return cls(np.load(os.path.join(path, 'abns.npy'), mmap_mode='r'),
+                   np.load(os.path.join(path, 'hashes.npy'), mmap_mode='r'))
+
+    def record_values(self, chunk: List[AbnRecord]) -> np.ndarray:
+        return np.fromiter((record_fingerprint(r) for r in chunk), dtype=np.uint64, count=len(chunk))
+
+    def changed_mask(self, abns: np.ndarray, values: np.ndarray) -> np.ndarray:
+        idx, known = self.lookup(abns)
+        self.seen[idx[known]] = True
+        return super().changed_mask(abns, values)
+
+    def vanished(self) -> np.ndarray:
+        """ABNs in the index that did not appear in this run"""
+        return np.asarray(self.abns[~self.seen])
+
+    def drop(self, abns: np.ndarray) -> None:
+        """Remove ABNs from the index"""
+        keep = ~np.isin(self.abns, abns)
+        self.abns = np.asarray(self.abns[keep])
+        self.values = np.asarray(self.values[keep])
+        self.seen = self.seen[keep]
+
+    def save(self, path: str) -> None:
+        """Write the index to a fresh directory, then swap it into place"""
+        self.merge_pending()
+        # Copy out of the memory-mapped files before they are replaced
+        self.abns = np.array(self.abns)
+        self.values = np.array(self.values)
+        tmp_path = f"{path}.tmp"
+        os.makedirs(tmp_path, exist_ok=True)
+        np.save(os.path.join(tmp_path, 'abns.npy'), self.abns)
+        np.save(os.path.join(tmp_path, 'hashes.npy'), self.values)
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.replace(tmp_path, path)
+
+
+def filter_changed_records(records: Iterable[AbnRecord], index: AbnValueIndex,
+                           chunk_size: int = BATCH_SIZE) -> Iterator[AbnRecord]:
+    """Drop records whose value in the index is unchanged"""
+    for chunk in iter_batches(records, chunk_size):
+        abns = np.fromiter((int(r.abn) for r in chunk), dtype=np.int64, count=len(chunk))
+        values = index.record_values(chunk)
+
+        changed = index.changed_mask(abns, values)
+        index.note(abns[changed], values[changed])
+        n_changed = int(changed.sum())
+        index.changed += n_changed
+        index.skipped += len(chunk) - n_changed
+
+        for record, is_changed in zip(chunk, changed):
+            if is_changed:
+                yield record
+
+
+def load_delta_index(path: str, strategy: str = 'date') -> AbnValueIndex:
+    """
+    Load the change-detection index for a delta run. The date manifest falls
+    back to reading the database; a missing fingerprint index starts empty,
+    so the first run upserts everything and builds it.
+    """
+    if strategy == 'hash':
+        if os.path.exists(path):
+            index = FingerprintIndex.load(path)
+            print(f"Loaded fingerprint index of {len(index):,} ABNs from {path}")
+        else:
+            print(f"No fingerprint index at {path}, every record will be upserted")
+            index = FingerprintIndex()
+    elif os.path.exists(path):
+        index = UpdateManifest.load(path)
+        print(f"Loaded manifest of {len(index):,} ABNs from {path}")
+    else:
+        print(f"No manifest at {path}, reading last updated dates from the database...")
+        index = UpdateManifest.from_database()
+        print(f"Read {len(index):,} ABNs from the database")
+    return index
+
+
+# 0..1 child tables upserted on the ABN once the parent abn_records row exists
+UPSERT_TABLES = ('main_entity', 'legal_entity', 'asic_numbers', 'gst_registrations', 'business_addresses')
+# 0..n child tables whose rows are replaced for each ABN in a batch, by
+# writing only the rows that differ from what is stored
+REPLACED_TABLES = ('dgr_entries', 'other_entity_names')
+
+# Columns written to each table, in COPY order
+TABLE_COLUMNS: Dict[str, tuple] = {
+    'abn_records': ('abn', 'record_last_updated_date', 'abn_status', 'abn_status_from_date',
+                    'entity_type_ind', 'entity_type_text'),
+    'main_entity': ('abn', 'type', 'text'),
+    'legal_entity': ('abn', 'type', 'title', 'given_name_1', 'given_name_2', 'family_name'),
+    'asic_numbers': ('abn', 'asic_number'),
+    'gst_registrations': ('abn', 'status', 'status_from_date'),
+    'dgr_entries': ('abn', 'status_from_date', 'status', 'type', 'text'),
+    'other_entity_names': ('abn', 'type', 'text'),
+    'business_addresses': ('abn', 'state_code', 'postcode'),
+}
+
+_supabase_client: Optional[Client] = None
+
+
+class RunCheckpoint:
+    """
+    Durable record of how far a run has got. For every XML source it keeps the
+    number of leading ABR elements whose records are committed to the sink, so
+    a resumed run can pass straight over them. Checkpoints are tied to the
+    exact archives they were taken against.
+    """
+
+    def __init__(self, path: str, archives: Dict[str, int]):
+        self.path = path
+        self.archives = archives
+        self.offsets: Dict[str, int] = {}
+        self.uploaded = 0
+        self.batches = 0
+
+    @classmethod
+    def load(cls, path: str, archives: Dict[str, int]) -> Optional['RunCheckpoint']:
+        """Load a checkpoint, or None if there is none for these archives"""
+        if not os.path.exists(path):
+            return None
+
+        with open(path) as f:
+            state = json.load(f)
+        if state.get('archives') != archives:
+            print("Checkpoint was taken against different archives, starting over")
+            return None
+
+        checkpoint = cls(path, archives)
+        checkpoint.offsets = state['offsets']
+        checkpoint.uploaded = state['uploaded']
+        checkpoint.batches = state['batches']
+        return checkpoint
 
+    @staticmethod
+    def archive_sizes(raw_dir: str) -> Dict[str, int]:
+        """Identify a set of downloaded archives by name and size"""
+        return {
+            name: os.path.getsize(os.path.join(raw_dir, name))
+            for name in sorted(os.listdir(raw_dir)) if name.endswith('.zip')
+        }
+
+    def offset(self, source: str) -> int:
+        """Number of leading elements of a source that are already committed"""
+        return self.offsets.get(source, 0)
+
+    def commit(self, positions: Dict[str, int], uploaded: int) -> None:
+        """Advance past a committed batch and persist the new position"""
+        for source, position in positions.items():
+            self.offsets[source] = max(self.offsets.get(source, 0), position + 1)
+        self.uploaded += uploaded
+        self.batches += 1
+        self.save()
+
+    def save(self) -> None:
+        """Write the checkpoint atomically so a crash never leaves it half written"""
+        state = {
+            'archives': self.archives,
+            'offsets': self.offsets,
+            'uploaded': self.uploaded,
+            'batches': self.batches
+        }
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def discard(self) -> None:
+        """Remove the checkpoint once the run it tracks has finished"""
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def batch_positions(batch: List[AbnRecord]) -> Dict[str, int]:
+    """Furthest element position reached in each source by a batch"""
+    positions: Dict[str, int] = {}
+    for record in batch:
+        if record.position is not None:
+            source, position = record.position
+            if position > positions.get(source, -1):
+                positions[source] = position
+    return positions
+
+
+def skip_committed(records: Iterable[AbnRecord], checkpoint: RunCheckpoint) -> Iterator[AbnRecord]:
+    """Drop records a previous run already committed"""
+    for record in records:
+        source, position = record.position
+        if position >= checkpoint.offset(source):
+            yield record
+
+
+def get_supabase_client() -> Client:
+    """Return the shared Supabase client, creating it on first use"""
+    global _supabase_client
+    if _supabase_client is None:
+        # One client for the whole run so its HTTP connection pool is reused
+        _supabase_client = create_client(SUPABASE_URL, SUPABASE_KEY)
+    return _supabase_client
+
+
+def build_table_batches(batch: List[AbnRecord]) -> Dict[str, List[tuple]]:
+    """Collect the rows for each table from a batch of parsed records"""
+    start = time.perf_counter()
+    tables: Dict[str, List[tuple]] = {name: [] for name in TABLE_COLUMNS}
+    abn_records = tables['abn_records']
+    main_entity = tables['main_entity']
+    legal_entity = tables['legal_entity']
+    asic_numbers = tables['asic_numbers']
+    gst_registrations = tables['gst_registrations']
+    dgr_entries = tables['dgr_entries']
+    other_entity_names = tables['other_entity_names']
+    business_addresses = tables['business_addresses']
+
+    # Rows are shared with the records, nothing is copied
+    for record in batch:
+        abn_records.append(record.abn_record)
+        if record.main_entity:
+            main_entity.append(record.main_entity)
+        if record.legal_entity:
+            legal_entity.append(record.legal_entity)
+        if record.asic_number:
+            asic_numbers.append(record.asic_number)
+        if record.gst_registration:
+            gst_registrations.append(record.gst_registration)
+        if record.dgr_entries:
+            dgr_entries.extend(record.dgr_entries)
+        if record.other_entity_names:
+            other_entity_names.extend(record.other_entity_names)
+        if record.business_address:
+            business_addresses.append(record.business_address)
+
+    METRICS.observe('batch_build_seconds', time.perf_counter() - start)
+    return tables
+
+
+def row_dicts(table: str, rows: List[tuple]) -> List[Dict]:
+    """JSON-ready dicts for a table's rows"""
+    columns = TABLE_COLUMNS[table]
+    return [dict(zip(columns, row)) for row in rows]
+
+
+class SupabaseSink:
+    """Writes batches through the Supabase REST API (PostgREST upserts)"""
+
+    name = 'supabase'
+
+    def __init__(self, concurrency: int = UPLOAD_CONCURRENCY):
+        self.supabase = get_supabase_client()
+        self.child_pool = ThreadPoolExecutor(
+            max_workers=concurrency * (len(UPSERT_TABLES) + 1),
+            thread_name_prefix='table'
+        )
+
+    def upsert_rows(self, table: str, rows: List[tuple]) -> None:
+        """Upsert 0..1 rows per ABN into a table keyed on abn"""
+        with METRICS.timer('table_write_seconds', table=table):
+            self.supabase.table(table).upsert(row_dicts(table, rows), on_conflict='abn').execute()
+
+    def merge_child_rows(self, abns: List[str], tables: Dict[str, List[tuple]]) -> None:
+        """Replace the 0..n child rows for a set of ABNs, writing only the rows that differ"""
+        params = {table: row_dicts(table, tables[table]) for table in REPLACED_TABLES}
+        with METRICS.timer('table_write_seconds', table='+'.join(REPLACED_TABLES)):
+            self.supabase.rpc('merge_child_rows', {'abns': abns, **params}).execute()
+
+    def write_batch(self, batch: List[AbnRecord]) -> None:
+        """Write one batch: the parent upsert first, then every child table in parallel"""
+        tables = build_table_batches(batch)
+        abns_in_batch = [row[0] for row in tables['abn_records']]
+
+        # Child rows reference abn_records, so the parent upsert must commit first
+        self.upsert_rows('abn_records', tables['abn_records'])
+
+        futures = [
+            self.child_pool.submit(self.upsert_rows, table, tables[table])
+            for table in UPSERT_TABLES if tables[table]
+        ]
+        futures.append(self.child_pool.submit(self.merge_child_rows, abns_in_batch, tables))
+
+        for future in futures:
+            future.result()
+
+        # Search rows are rebuilt from the tables once every write has landed
+        with METRICS.timer('table_write_seconds', table='abn_search'):
+            self.supabase.rpc('refresh_abn_search', {'abns': abns_in_batch}).execute()
+
+    def delete_abns(self, abns: List[str], chunk_size: int = 500) -> None:
+        """Delete ABNs; child rows go with them via ON DELETE CASCADE"""
+        for i in range(0, len(abns), chunk_size):
+            self.supabase.table('abn_records').delete().in_('abn', abns[i:i + chunk_size]).execute()
+
+    def bump_dataset_version(self) -> int:
+        """Mark the load as complete, so readers drop what they cached; returns the new version"""
+        return self.supabase.rpc('bump_dataset_version', {}).execute().data
+
+    def close(self) -> None:
+        self.child_pool.shutdown()
+
+
+def _copy_text_value(value) -> str:
+    """Encode a value for COPY ... FROM STDIN in text format"""
+    if value is None:
+        return '\\N'
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+
+def _quote_ident(name: str, cursor) -> str:
+    """Quote a role, constraint or column name read from the catalog"""
+    from psycopg2.extensions import quote_ident
+    return quote_ident(name, cursor)
+
+
+class PostgresCopySink:
+    """
+    Bulk loads batches straight into Postgres. Each batch is streamed into
+    per-connection temp staging tables with COPY, then merged into the
+    normalized tables with set-based INSERT ... ON CONFLICT, and the
+    batch's search rows are refreshed, all in one transaction per batch.
+    """
+
+    name = 'postgres'
+
+    def __init__(self, dsn: str = None, concurrency: int = UPLOAD_CONCURRENCY):
+        from psycopg2.pool import ThreadedConnectionPool
+
+        # Keep every connection open; the pool closes idle ones above minconn
+        self.pool = ThreadedConnectionPool(concurrency, concurrency, dsn or DATABASE_URL)
+
+    def _create_staging_tables(self, cursor) -> None:
+        for table, columns in TABLE_COLUMNS.items():
+            cursor.execute(
+                f"CREATE TEMP TABLE IF NOT EXISTS stage_{table} ON COMMIT DELETE ROWS AS "
+                f"SELECT {', '.join(columns)} FROM public.{table} WITH NO DATA"
+            )
+
+    def _copy_rows(self, cursor, target: str, columns: tuple, rows: List[tuple], suffix: str = '') -> None:
+        """COPY rows into a table, appending `suffix` (extra tab-separated values) to each line"""
+        line_end = suffix + '\n'
+        buffer = io.StringIO()
+        for row in rows:
+            buffer.write('\t'.join(map(_copy_text_value, row)))
+            buffer.write(line_end)
+        buffer.seek(0)
+        cursor.copy_expert(f"COPY {target} ({', '.join(columns)}) FROM STDIN", buffer)
+
+    @staticmethod
+    def _merge_sql(table: str) -> str:
+        columns = TABLE_COLUMNS[table]
+        column_list = ', '.join(columns)
+        if table in REPLACED_TABLES:
+            # Same diff as merge_child_rows(): only rows that differ are
+            # deleted or inserted, matching duplicates copy for copy
+            key = f"JSONB_BUILD_ARRAY({', '.join(column for column in columns if column != 'abn')})"
+            return (
+                f"WITH incoming AS (SELECT {column_list}, {key} AS key, "
+                f"ROW_NUMBER() OVER (PARTITION BY abn, {key}) AS copy FROM stage_{table}), "
+                f"stored AS (SELECT id, abn, {key} AS key, "
+                f"ROW_NUMBER() OVER (PARTITION BY abn, {key} ORDER BY id) AS copy FROM public.{table} "
+                f"WHERE abn IN (SELECT abn FROM stage_abn_records)), "
+                f"removed AS (DELETE FROM public.{table} t USING stored s WHERE t.id = s.id AND NOT EXISTS ("
+                f"SELECT 1 FROM incoming i WHERE i.abn = s.abn AND i.key = s.key AND i.copy = s.copy)) "
+                f"INSERT INTO public.{table} ({column_list}) SELECT {column_list} FROM incoming i "
+                f"WHERE NOT EXISTS (SELECT 1 FROM stored s WHERE s.abn = i.abn AND s.key = i.key AND s.copy = i.copy)"
+            )
+        updates = ', '.join(f"{column} = EXCLUDED.{column}" for column in columns if column != 'abn')
+        return (
+            f"INSERT INTO public.{table} ({column_list}) SELECT {column_list} FROM stage_{table} "
+            f"ON CONFLICT (abn) DO UPDATE SET {updates}"
+        )
+
+    def write_batch(self, batch: List[AbnRecord]) -> None:
+        tables = build_table_batches(batch)
+        conn = self.pool.getconn()
+        try:
+            with conn.cursor() as cursor:
+                self._create_staging_tables(cursor)
+
+                # Each table's COPY and merge together make up its write time
+                elapsed = dict.fromkeys(tables, 0.0)
+                for table, rows in tables.items():
+                    if rows:
+                        start = time.perf_counter()
+                        self._copy_rows(cursor, f"stage_{table}", TABLE_COLUMNS[table], rows)
+                        elapsed[table] += time.perf_counter() - start
+
+                # Parent rows first so child foreign keys resolve
+                for table in ('abn_records',) + UPSERT_TABLES + REPLACED_TABLES:
+                    if tables[table] or table in REPLACED_TABLES:
+                        start = time.perf_counter()
+                        cursor.execute(self._merge_sql(table))
+                        elapsed[table] += time.perf_counter() - start
+
+                for table, seconds in elapsed.items():
+                    METRICS.observe('table_write_seconds', seconds, table=table)
+
+                with METRICS.timer('table_write_seconds', table='abn_search'):
+                    cursor.execute("SELECT public.refresh_abn_search(ARRAY(SELECT abn::text FROM stage_abn_records))")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self.pool.putconn(conn)
+
+    def delete_abns(self, abns: List[str]) -> None:
+        """Delete ABNs; child rows go with them via ON DELETE CASCADE"""
+        conn = self.pool.getconn()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("DELETE FROM public.abn_records WHERE abn = ANY(%s)", (abns,))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self.pool.putconn(conn)
+
+    def bump_dataset_version(self) -> int:
+        """Mark the load as complete, so readers drop what they cached; returns the new version"""
+        conn = self.pool.getconn()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT public.bump_dataset_version()")
+                version = cursor.fetchone()[0]
+            conn.commit()
+            return version
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self.pool.putconn(conn)
+
+    def close(self) -> None:
+        self.pool.closeall()
+
+
+# Tables replaced by a bulk rebuild, parents first
+REBUILD_TABLES = ('abn_records',) + UPSERT_TABLES + REPLACED_TABLES + ('abn_search',)
+
+
+class PostgresRebuildSink(PostgresCopySink):
+    """
+    Bulk rebuild for full reloads. Every batch is COPYed straight into
+    unlogged shadow tables in their own schema, with no indexes, constraints
+    or triggers to maintain. finish() then builds the indexes, search rows
+    and constraints once, and swaps the shadow tables in for the live ones
+    in a single transaction, so readers never see a partial load.
+    """
+
+    name = 'postgres (rebuild)'
+    schema = 'ingest_rebuild'
+
+    def __init__(self, dsn: str = None, concurrency: int = UPLOAD_CONCURRENCY, create: bool = True):
+        super().__init__(dsn, concurrency)
+        self.concurrency = concurrency
+        # When an ABN is loaded more than once the latest batch wins, as with upserts
+        self.sequence = itertools.count()
+        # Sharded workers load into the shadow tables their coordinator created
+        if create:
+            self._run(self._create_shadow_tables)
+
+    def _run(self, step, *args):
+        """Run one step in its own transaction on a pooled connection"""
+        conn = self.pool.getconn()
+        try:
+            with conn.cursor() as cursor:
+                # Catalog definitions come back schema-qualified
+                cursor.execute("SET LOCAL search_path = pg_catalog")
+                result = step(cursor, *args)
+            conn.commit()
+            return result
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self.pool.putconn(conn)
+
+    def _create_shadow_tables(self, cursor) -> None:
+        # Anything left over from a failed rebuild is thrown away
+        cursor.execute(f"DROP SCHEMA IF EXISTS {self.schema} CASCADE")
+        cursor.execute(f"CREATE SCHEMA {self.schema}")
+        for table in REBUILD_TABLES:
+            cursor.execute(f"CREATE UNLOGGED TABLE {self.schema}.{table} "
+                           f"(LIKE public.{table} INCLUDING DEFAULTS INCLUDING GENERATED)")
+            if table in TABLE_COLUMNS:
+                cursor.execute(f"ALTER TABLE {self.schema}.{table} ADD COLUMN load_seq BIGINT NOT NULL")
+
+    def write_batch(self, batch: List[AbnRecord]) -> None:
+        tables = build_table_batches(batch)
+        suffix = f"\t{next(self.sequence)}"
+
+        def copy(cursor) -> None:
+            for table, rows in tables.items():
+                if rows:
+                    self._copy_rows(cursor, f"{self.schema}.{table}", TABLE_COLUMNS[table] + ('load_seq',),
+                                    rows, suffix)
+
+        self._run(copy)
+
+    def delete_abns(self, abns: List[str]) -> None:
+        """A rebuild only holds what was loaded, so there is nothing to delete"""
+
+    def _constraint_sql(self, cursor, table: str, types: str) -> List[str]:
+        """ALTER TABLE statements recreating the live table's constraints of the given types on its shadow"""
+        cursor.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE conrelid = %s::regclass AND contype = ANY(%s) ORDER BY contype <> 'p', conname",
+            (f"public.{table}", list(types))
+        )
+        return [
+            f"ALTER TABLE {self.schema}.{table} ADD CONSTRAINT {_quote_ident(name, cursor)} "
+            + definition.replace("REFERENCES public.", f"REFERENCES {self.schema}.")
+            for name, definition in cursor.fetchall()
+        ]
+
+    def _index_sql(self, cursor, table: str) -> List[str]:
+        """CREATE INDEX statements for the live table's indexes that do not back a constraint"""
+        cursor.execute(
+            "SELECT pg_get_indexdef(i.indexrelid) FROM pg_index i "
+            "WHERE i.indrelid = %s::regclass AND NOT EXISTS ("
+            "  SELECT 1 FROM pg_constraint c WHERE c.conindid = i.indexrelid AND c.conrelid = i.indrelid)",
+            (f"public.{table}",)
+        )
+        return [definition.replace(f" ON public.{table} USING ", f" ON {self.schema}.{table} USING ", 1)
+                for definition, in cursor.fetchall()]
+
+    def _finish_table(self, cursor, table: str, deduplicate: bool) -> float:
+        """Drop superseded rows, make the table durable and build its indexes"""
+        start = time.monotonic()
+        shadow = f"{self.schema}.{table}"
+        if deduplicate:
+            cursor.execute(f"DELETE FROM {shadow} t USING {self.schema}.latest_load l "
+                           f"WHERE t.abn = l.abn AND t.load_seq < l.load_seq")
+        cursor.execute(f"ALTER TABLE {shadow} DROP COLUMN load_seq")
+        cursor.execute(f"ALTER TABLE {shadow} SET LOGGED")
+        for statement in self._constraint_sql(cursor, table, 'puc') + self._index_sql(cursor, table):
+            cursor.execute(statement)
+        return time.monotonic() - start
+
+    def _find_duplicates(self, cursor) -> tuple[int, int]:
+        """Count the loaded ABNs and note the latest batch of any loaded more than once"""
+        cursor.execute(f"CREATE TABLE {self.schema}.latest_load AS "
+                       f"SELECT abn, MAX(load_seq) AS load_seq, COUNT(*) AS copies "
+                       f"FROM {self.schema}.abn_records GROUP BY abn HAVING COUNT(*) > 1")
+        cursor.execute(f"SELECT (SELECT COUNT(*) FROM {self.schema}.abn_records), "
+                       f"COALESCE(SUM(copies - 1), 0) FROM {self.schema}.latest_load")
+        return cursor.fetchone()
+
+    def _build_search(self, cursor) -> int:
+        """Fill the shadow search table from the finished shadow tables"""
+        shadow = f"{self.schema}.abn_search"
+        for statement in self._constraint_sql(cursor, 'abn_search', 'puc'):
+            cursor.execute(statement)
+        cursor.execute("SELECT public.refresh_abn_search(NULL, %s)", (self.schema,))
+        refreshed = cursor.fetchone()[0]
+        cursor.execute(f"ALTER TABLE {shadow} SET LOGGED")
+        for statement in self._index_sql(cursor, 'abn_search'):
+            cursor.execute(statement)
+        return refreshed
+
+    def _add_foreign_keys(self, cursor) -> None:
+        # Each one is validated with a single pass over its table
+        for table in REBUILD_TABLES:
+            for statement in self._constraint_sql(cursor, table, 'f'):
+                cursor.execute(statement)
+
+    def _copy_table_settings(self, cursor) -> None:
+        """Give the shadow tables the live tables' triggers, row level security, policies, grants and comments"""
+        for table in REBUILD_TABLES:
+            live = f"public.{table}"
+            shadow = f"{self.schema}.{table}"
+
+            cursor.execute("SELECT pg_get_triggerdef(oid) FROM pg_trigger WHERE tgrelid = %s::regclass "
+                           "AND NOT tgisinternal", (live,))
+            for definition, in cursor.fetchall():
+                cursor.execute(definition.replace(f" ON {live} ", f" ON {shadow} ", 1))
+
+            cursor.execute("SELECT relrowsecurity, relforcerowsecurity, obj_description(oid, 'pg_class') "
+                           "FROM pg_class WHERE oid = %s::regclass", (live,))
+            row_security, force_row_security, comment = cursor.fetchone()
+            if row_security:
+                cursor.execute(f"ALTER TABLE {shadow} ENABLE ROW LEVEL SECURITY")
+            if force_row_security:
+                cursor.execute(f"ALTER TABLE {shadow} FORCE ROW LEVEL SECURITY")
+            if comment is not None:
+                cursor.execute(f"COMMENT ON TABLE {shadow} IS %s", (comment,))
+
+            cursor.execute("SELECT policyname, permissive, roles::text[], cmd, qual, with_check FROM pg_policies "
+                           "WHERE schemaname = 'public' AND tablename = %s", (table,))
+            for name, permissive, roles, command, using, check in cursor.fetchall():
+                grantees = ', '.join('PUBLIC' if role == 'public' else _quote_ident(role, cursor) for role in roles)
+                statement = (f"CREATE POLICY {_quote_ident(name, cursor)} ON {shadow} AS {permissive} "
+                             f"FOR {command} TO {grantees}")
+                if using is not None:
+                    statement += f" USING ({using})"
+                if check is not None:
+                    statement += f" WITH CHECK ({check})"
+                cursor.execute(statement)
+
+            cursor.execute("SELECT CASE WHEN a.grantee = 0 THEN 'PUBLIC' ELSE pg_get_userbyid(a.grantee) END, "
+                           "a.privilege_type, a.is_grantable FROM pg_class c, aclexplode(c.relacl) a "
+                           "WHERE c.oid = %s::regclass AND a.grantee <> c.relowner", (live,))
+            for grantee, privilege, grantable in cursor.fetchall():
+                role = grantee if grantee == 'PUBLIC' else _quote_ident(grantee, cursor)
+                cursor.execute(f"GRANT {privilege} ON {shadow} TO {role}"
+                               + (" WITH GRANT OPTION" if grantable else ""))
+
+    def _swap(self, cursor) -> None:
+        """Move the live tables out and the shadow tables in, all in one transaction"""
+        # Fail rather than stall every reader behind a long-running query
+        cursor.execute("SET LOCAL lock_timeout = '30s'")
+        cursor.execute(f"LOCK TABLE {', '.join(f'public.{table}' for table in REBUILD_TABLES)} "
+                       f"IN ACCESS EXCLUSIVE MODE")
+
+        # Serial columns share the live sequences, which would otherwise move and be dropped with the old tables
+        cursor.execute(
+            "SELECT s.relname, t.relname, a.attname FROM pg_depend d "
+            "JOIN pg_class s ON s.oid = d.objid AND s.relkind = 'S' "
+            "JOIN pg_class t ON t.oid = d.refobjid "
+            "JOIN pg_attribute a ON a.attrelid = d.refobjid AND a.attnum = d.refobjsubid "
+            "WHERE d.deptype = 'a' AND d.refobjid = ANY(%s::regclass[])",
+            ([f"public.{table}" for table in REBUILD_TABLES],)
+        )
+        sequences = cursor.fetchall()
+        for sequence, _, _ in sequences:
+            cursor.execute(f"ALTER SEQUENCE public.{_quote_ident(sequence, cursor)} OWNED BY NONE")
+
+        cursor.execute("CREATE SCHEMA ingest_retired")
+        for table in REBUILD_TABLES:
+            cursor.execute(f"ALTER TABLE public.{table} SET SCHEMA ingest_retired")
+        for table in REBUILD_TABLES:
+            cursor.execute(f"ALTER TABLE {self.schema}.{table} SET SCHEMA public")
+        for sequence, table, column in sequences:
+            cursor.execute(f"ALTER SEQUENCE public.{_quote_ident(sequence, cursor)} "
+                           f"OWNED BY public.{table}.{_quote_ident(column, cursor)}")
+        # Named and without CASCADE, so anything else built on the old tables fails the swap instead of going with them
+        cursor.execute(f"DROP TABLE {', '.join(f'ingest_retired.{table}' for table in REBUILD_TABLES)}")
+        cursor.execute("DROP SCHEMA ingest_retired")
+        cursor.execute(f"DROP SCHEMA {self.schema}")
+        # Supabase's REST API caches the schema
+        cursor.execute("NOTIFY pgrst, 'reload schema'")
+
+    def finish(self) -> None:
+        """Finish the shadow tables and swap them in for the live ones"""
+        start = time.monotonic()
+        print("\nFinishing the rebuild...")
+
+        loaded, duplicates = self._run(self._find_duplicates)
+        if not loaded:
+            raise RuntimeError("The rebuild loaded no ABNs, keeping the live tables")
+        print(f"Loaded {loaded:,} ABN rows, {duplicates:,} superseded by a later copy")
+
+        # Tables are finished side by side, each on its own connection
+        tables = list(TABLE_COLUMNS)
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='rebuild') as pool:
+            durations = pool.map(lambda table: self._run(self._finish_table, table, duplicates > 0), tables)
+            for table, seconds in zip(tables, durations):
+                print(f"Indexed {table} in {seconds:.1f}s")
+        self._run(lambda cursor: cursor.execute(f"DROP TABLE {self.schema}.latest_load"))
+
+        print(f"Built {self._run(self._build_search):,} search rows")
+        self._run(self._add_foreign_keys)
+        print("Validated foreign keys")
+        self._run(self._copy_table_settings)
+        self._run(self._swap)
+        print(f"Swapped the rebuilt tables in after {time.monotonic() - start:.0f}s")
+
+
+# Columns stored as Arrow dates in Parquet exports; everything else is a string
+DATE_COLUMNS = ('record_last_updated_date', 'abn_status_from_date', 'status_from_date')
+
+
+def parquet_schema(table: str):
+    """Arrow schema for one normalized table"""
+    return pa.schema([
+        (column, pa.date32() if column in DATE_COLUMNS else pa.string())
+        for column in TABLE_COLUMNS[table]
+    ])
+
+
+class ParquetSink:
+    """
+    Writes every normalized table as compressed Parquet under
+    <export_dir>/<table>/part-NNNNN.parquet. Rows are buffered per table and
+    written one row group at a time, and each table rolls over to a new part
+    file every `part_rows` rows. Part files are written under a .tmp name
+    and renamed once complete.
+    """
+
+    name = 'parquet'
+
+    def __init__(self, export_dir: str = None, row_group_rows: int = PARQUET_ROW_GROUP_ROWS,
+                 part_rows: int = PARQUET_PART_ROWS):
+        self.export_dir = export_dir or EXPORT_DIR
+        self.row_group_rows = row_group_rows
+        self.part_rows = part_rows
+        # Each batch's rows are converted, dates checked, before any of them are buffered
+        self.buffers: Dict[str, List] = {table: [] for table in TABLE_COLUMNS}
+        self.buffered_rows = {table: 0 for table in TABLE_COLUMNS}
+        self.locks = {table: threading.Lock() for table in TABLE_COLUMNS}
+        self.writers: Dict[str, tuple] = {}
+        self.parts = {table: 0 for table in TABLE_COLUMNS}
+        self.part_row_counts = {table: 0 for table in TABLE_COLUMNS}
+
+        # Each run writes a complete snapshot, so the previous one is replaced
+        for table in TABLE_COLUMNS:
+            table_dir = os.path.join(self.export_dir, table)
+            shutil.rmtree(table_dir, ignore_errors=True)
+            os.makedirs(table_dir)
+
+    def _to_arrow(self, table: str, rows: List[tuple]):
+        columns = list(zip(*rows))
+        arrays = []
+        for column, values in zip(TABLE_COLUMNS[table], columns):
+            array = pa.array(values, type=pa.string())
+            if column in DATE_COLUMNS:
+                dates = pc.strptime(array, format='%Y%m%d', unit='s', error_is_null=True)
+                # A date that does not parse would reload as NULL, so it fails the batch as it would in Postgres
+                malformed = pc.and_(pc.is_null(dates), pc.is_valid(array))
+                if pc.any(malformed).as_py():
+                    abn = columns[0][pc.index(malformed, True).as_py()]
+                    value = array.filter(malformed)[0].as_py()
+                    raise ValueError(f"Malformed {table}.{column} {value!r} for ABN {abn}")
+                array = dates.cast(pa.date32())
+            arrays.append(array)
+        return pa.Table.from_arrays(arrays, schema=parquet_schema(table))
+
+    def _close_part(self, table: str) -> None:
+        writer, tmp_path = self.writers.pop(table)
+        writer.close()
+        os.replace(tmp_path, tmp_path[:-len('.tmp')])
+        self.parts[table] += 1
+        self.part_row_counts[table] = 0
+
+    def _write_row_group(self, table: str, chunks: List) -> None:
+        if table not in self.writers:
+            path = os.path.join(self.export_dir, table, f"part-{self.parts[table]:05d}.parquet.tmp")
+            writer = pq.ParquetWriter(path, parquet_schema(table), compression='zstd')
+            self.writers[table] = (writer, path)
+
+        writer, _ = self.writers[table]
+        rows = pa.concat_tables(chunks)
+        writer.write_table(rows, row_group_size=rows.num_rows)
+        self.part_row_counts[table] += rows.num_rows
+        if self.part_row_counts[table] >= self.part_rows:
+            self._close_part(table)
+
+    def write_batch(self, batch: List[AbnRecord]) -> None:
+        # Converted up front, so a batch that fails leaves nothing behind to be duplicated by its retry
+        tables = {table: self._to_arrow(table, rows) for table, rows in build_table_batches(batch).items() if rows}
+        for table, rows in tables.items():
+            with self.locks[table]:
+                self.buffers[table].append(rows)
+                self.buffered_rows[table] += rows.num_rows
+                if self.buffered_rows[table] >= self.row_group_rows:
+                    chunks, self.buffers[table], self.buffered_rows[table] = self.buffers[table], [], 0
+                    self._write_row_group(table, chunks)
+
+    def delete_abns(self, abns: List[str]) -> None:
+        """Exports are rebuilt in full every run, so there is nothing to delete"""
+
+    def bump_dataset_version(self) -> None:
+        """Exports are not read through the database, so there is no version to bump"""
+
+    def close(self) -> None:
+        for table in TABLE_COLUMNS:
+            with self.locks[table]:
+                if self.buffers[table]:
+                    self._write_row_group(table, self.buffers[table])
+                    self.buffers[table], self.buffered_rows[table] = [], 0
+                if table in self.writers:
+                    self._close_part(table)
+
+
+class TeeSink:
+    """
+    Writes every batch to several sinks, e.g. Postgres plus a Parquet export.
+    upload_records writes to each sink through its own BatchWriter, so a
+    failed write is only retried on the sink it failed on.
+    """
+
+    def __init__(self, sinks: List):
+        self.sinks = sinks
+        self.name = '+'.join(sink.name for sink in sinks)
+
+    def write_batch(self, batch: List[AbnRecord]) -> None:
+        for sink in self.sinks:
+            sink.write_batch(batch)
+
+    def delete_abns(self, abns: List[str]) -> None:
+        for sink in self.sinks:
+            sink.delete_abns(abns)
+
+    def finish(self) -> None:
+        for sink in self.sinks:
+            if hasattr(sink, 'finish'):
+                sink.finish()
+
+    def bump_dataset_version(self) -> Optional[int]:
+        versions = [sink.bump_dataset_version() for sink in self.sinks]
+        return next((version for version in versions if version is not None), None)
+
+    def close(self) -> None:
+        for sink in self.sinks:
+            sink.close()
+
+
+def load_parquet_export(export_dir: str, dsn: str = None) -> int:
+    """
+    Bulk load a Parquet export into empty normalized tables with COPY,
+    streaming one row group at a time. Returns the number of rows loaded.
+    """
+    import psycopg2
+
+    conn = psycopg2.connect(dsn or DATABASE_URL)
+    loaded = 0
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT EXISTS (SELECT 1 FROM public.abn_records)")
+            if cursor.fetchone()[0]:
+                raise RuntimeError("abn_records is not empty; reset the database before loading an export")
+
+            # Parent rows first so child foreign keys resolve
+            for table in ('abn_records',) + UPSERT_TABLES + REPLACED_TABLES:
+                table_dir = os.path.join(export_dir, table)
+                parts = sorted(name for name in os.listdir(table_dir) if name.endswith('.parquet'))
+                columns = ', '.join(TABLE_COLUMNS[table])
+                table_rows = 0
+
+                for part in parts:
+                    parquet_file = pq.ParquetFile(os.path.join(table_dir, part))
+                    for group in range(parquet_file.num_row_groups):
+                        row_group = parquet_file.read_row_group(group)
+                        buffer = io.BytesIO()
+                        pa_csv.write_csv(row_group, buffer, pa_csv.WriteOptions(include_header=False))
+                        buffer.seek(0)
+                        cursor.copy_expert(f"COPY public.{table} ({columns}) FROM STDIN WITH (FORMAT csv)", buffer)
+                        table_rows += row_group.num_rows
+
+                print(f"Loaded {table_rows:,} rows into {table}")
+                loaded += table_rows
+
+            cursor.execute("SELECT public.refresh_abn_search()")
+            print(f"Refreshed {cursor.fetchone()[0]:,} search rows")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    return loaded
+
+
+def refresh_search_index(dsn: str = None, chunk_size: int = 50000) -> int:
+    """
+    Rebuild the abn_search row of every loaded ABN, `chunk_size` ABNs per
+    transaction so a full extract never holds one open for every row.
+    Returns the number of rows refreshed.
+    """
+    import psycopg2
+
+    conn = psycopg2.connect(dsn or DATABASE_URL)
+    refreshed = 0
+    last = ''
+    try:
+        with conn.cursor() as cursor:
+            while True:
+                cursor.execute("SELECT abn FROM public.abn_records WHERE abn > %s ORDER BY abn LIMIT %s",
+                               (last, chunk_size))
+                abns = [row[0] for row in cursor.fetchall()]
+                if not abns:
+                    break
+                cursor.execute("SELECT public.refresh_abn_search(%s)", (abns,))
+                refreshed += cursor.fetchone()[0]
+                conn.commit()
+                last = abns[-1]
+                print(f"Refreshed {refreshed:,} search rows")
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    return refreshed
+
+
+def create_sink(name: str = INGEST_SINK, concurrency: int = UPLOAD_CONCURRENCY, rebuild: bool = False):
+    """
+    Build the configured output sink, or a TeeSink for a comma-separated list.
+    With `rebuild`, the Postgres sink loads shadow tables to be swapped in by finish().
+    """
+    if ',' in name:
+        return TeeSink([create_sink(part.strip(), concurrency, rebuild) for part in name.split(',')])
+    if name == 'postgres':
+        if rebuild:
+            return PostgresRebuildSink(concurrency=concurrency)
+        return PostgresCopySink(concurrency=concurrency)
+    if name == 'supabase':
+        return SupabaseSink(concurrency=concurrency)
+    if name == 'parquet':
+        return ParquetSink()
+    raise ValueError(f"Unknown sink: {name} (expected 'supabase', 'postgres' or 'parquet')")
+
+
+class DeadLetterFile:
+    """
+    Records that could not be written even on their own, appended to a JSON
+    lines file with the error, so one bad record does not end a run. More
+    than `limit` of them in a run points at something other than the data,
+    and fails it.
+    """
+
+    def __init__(self, path: str = DEAD_LETTER_PATH, limit: int = DEAD_LETTER_LIMIT):
+        self.path = path
+        self.limit = limit
+        self.abns: List[str] = []
+        self.lock = threading.Lock()
+        # Records set aside before a resumed run still count
+        if os.path.exists(path):
+            with open(path) as f:
+                self.abns = [json.loads(line)['abn'] for line in f if line.strip()]
+
+    def __len__(self) -> int:
+        return len(self.abns)
+
+    def add(self, record: AbnRecord, sink_name: str, error: Exception) -> None:
+        with self.lock:
+            if len(self.abns) >= self.limit:
+                raise RuntimeError(f"More than {self.limit:,} records failed to write, last error: {error}")
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(self.path, 'a') as f:
+                f.write(json.dumps({'abn': record.abn, 'position': record.position, 'sink': sink_name,
+                                    'error': str(error), 'record': record.to_dict()}) + '\n')
+            self.abns.append(record.abn)
+        METRICS.inc('records_dead_lettered_total')
+        print(f"Set aside ABN {record.abn} in {self.path}: {error}")
+
+
+class BatchWriter:
+    """
+    Writes batches to a sink, riding out failures. Each write is retried
+    with jittered exponential backoff. A batch that still fails is split in
+    half, both halves are written, and any half that fails is split again,
+    down to single records that go to the dead-letter file. Failed writes
+    with no successful write in between point at the sink rather than the
+    data, so after `max_consecutive_failures` of them the batch fails.
+    """
+
+    def __init__(self, sink, sizer: Optional[BatchSizer] = None, dead_letters: Optional[DeadLetterFile] = None,
+                 retries: int = BATCH_RETRIES, backoff_seconds: float = BATCH_BACKOFF_SECONDS,
+                 max_consecutive_failures: int = 4):
+        self.sink = sink
+        self.sizer = sizer
+        self.dead_letters = dead_letters
+        self.retries = retries
+        self.backoff_seconds = backoff_seconds
+        self.max_consecutive_failures = max_consecutive_failures
+        self.consecutive_failures = 0
+        self.lock = threading.Lock()
+
+    def _attempt(self, batch: List[AbnRecord], shrink: bool = True) -> Optional[Exception]:
+        """
+        Write a batch, retrying with backoff; the last error if every try
+        failed. Once the retries run out, the batch budget shrinks, unless
+        `shrink` is off because the caller cannot yet tell a failing sink
+        from a bad record.
+        """
+        error = None
+        for attempt in range(self.retries + 1):
+            start = time.perf_counter()
+            try:
+                with METRICS.timer('batch_write_seconds', sink=self.sink.name):
+                    self.sink.write_batch(batch)
             except Exception as e:
-                print(f"Batch failed at record {i}: {e}")
-                return False
+                error = e
+                if attempt == self.retries:
+                    if self.sizer and shrink:
+                        self.sizer.failed()
+                    break
+                # Full jitter, so concurrent batches do not retry in lockstep
+                delay = random.uniform(0, min(self.backoff_seconds * 2 ** attempt, 30))
+                print(f"Retrying batch of {len(batch):,} records in {delay:.1f}s: {e}")
+                METRICS.inc('retries_total', stage='upload')
+                time.sleep(delay)
+                continue
+
+            if self.sizer:
+                self.sizer.succeeded(batch, time.perf_counter() - start)
+            with self.lock:
+                self.consecutive_failures = 0
+            return None
 
-        print(f"Successfully uploaded {len(records):,} records")
-        return True
+        with self.lock:
+            self.consecutive_failures += 1
+            if self.consecutive_failures > self.max_consecutive_failures:
+                raise error
+        return error
+
+    def write(self, batch: List[AbnRecord], error: Optional[Exception] = None) -> int:
+        """Write a batch, or what can be written of it; returns the number of records written"""
+        if error is None:
+            error = self._attempt(batch)
+            if error is None:
+                return len(batch)
+        if self.dead_letters is None:
+            raise error
+
+        if len(batch) == 1:
+            self.dead_letters.add(batch[0], self.sink.name, error)
+            return 0
+
+        # Both halves are tried before either is split further, so a success
+        # in one separates a bad record from a failing sink. Only the sink's
+        # faults shrink the batch budget.
+        middle = len(batch) // 2
+        halves = [batch[:middle], batch[middle:]]
+        errors = [self._attempt(half, shrink=False) for half in halves]
+        if self.sizer and all(errors):
+            self.sizer.failed()
+        return sum(len(half) if half_error is None else self.write(half, half_error)
+                   for half, half_error in zip(halves, errors))
+
+
+def upload_records(records: Iterable[AbnRecord], sink=None, batch_size: int = BATCH_SIZE,
+                   concurrency: int = UPLOAD_CONCURRENCY, checkpoint: Optional[RunCheckpoint] = None,
+                   sizer: Optional[BatchSizer] = None,
+                   dead_letters: Optional[DeadLetterFile] = None) -> Optional[int]:
+    """
+    Upload a stream of records to the sink in batches using normalized schema.
+    Up to `concurrency` batches are in flight at once. With a sizer, batches
+    are also cut by payload size, and failed writes are retried and split as
+    BatchWriter describes, setting aside unwritable records in `dead_letters`.
+    With a checkpoint, the position of every batch is recorded once it and
+    all batches before it have been written.
+    Returns the number of records uploaded, or None if the upload failed.
+    """
+    try:
+        sink = sink or create_sink(concurrency=concurrency)
+        # A sink that took a batch never sees it again because another sink of the tee failed
+        parts = sink.sinks if isinstance(sink, TeeSink) else [sink]
+        writers = [BatchWriter(part, sizer, dead_letters) for part in parts]
+
+        def write(batch: List[AbnRecord]) -> int:
+            return min([writer.write(batch) for writer in writers])
+
+        budget = f", up to {sizer.budget / 1e6:,.1f} MB" if sizer else ''
+        print(f"\nUploading records to {sink.name} in batches of {batch_size}{budget} ({concurrency} in flight)...")
+        uploaded = 0
+        submitted = 0
+        failed = False
+        in_flight: Dict[Future, tuple[int, int, int]] = {}
+        # Batches finish out of order, so only a contiguous run of them can be checkpointed
+        positions_by_sequence: Dict[int, Dict[str, int]] = {}
+        finished: Dict[int, tuple[Dict[str, int], int]] = {}
+        next_commit = 0
+
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='batch') as batch_pool:
+
+            def collect(futures) -> None:
+                nonlocal uploaded, failed, next_commit
+                for future in futures:
+                    sequence, start, size = in_flight.pop(future)
+                    METRICS.set('batches_in_flight', len(in_flight))
+                    try:
+                        written = future.result()
+                        uploaded += written
+                        METRICS.inc('records_uploaded_total', written)
+                    except Exception as e:
+                        print(f"Batch failed at record {start}: {e}")
+                        METRICS.inc('batches_failed_total')
+                        log_event('batch_failed', sink=sink.name, start=start, size=size, error=str(e))
+                        failed = True
+                        continue
+
+                    if checkpoint is not None:
+                        finished[sequence] = positions_by_sequence.pop(sequence), written
+                        while next_commit in finished:
+                            checkpoint.commit(*finished.pop(next_commit))
+                            next_commit += 1
+
+            for sequence, batch in enumerate(stream_batches(records, batch_size, sizer=sizer)):
+                if checkpoint is not None:
+                    positions_by_sequence[sequence] = batch_positions(batch)
+                future = batch_pool.submit(write, batch)
+                in_flight[future] = (sequence, submitted, len(batch))
+                METRICS.set('batches_in_flight', len(in_flight))
+                submitted += len(batch)
+
+                # Wait for a slot before pulling the next batch off the parser
+                if len(in_flight) >= concurrency:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    collect(done)
+                if failed:
+                    break
+
+            collect(wait(in_flight).done)
+
+        if failed:
+            return None
+
+        print(f"Successfully uploaded {uploaded:,} records")
+        return uploaded
 
     except Exception as e:
-        print(f"Supabase error: {e}")
-        return False
+        print(f"Upload error: {e}")
+        return None
+
+
+def replay_dead_letters(path: str = DEAD_LETTER_PATH, sink=None) -> Optional[int]:
+    """
+    Write the records set aside in a dead-letter file again. Records that
+    still fail go to a fresh file at the same path; if the replay itself
+    fails, the original file is put back. Returns the number of records
+    written, or None if the replay failed.
+    """
+    with open(path) as f:
+        entries = [json.loads(line) for line in f if line.strip()]
+    records = []
+    for entry in entries:
+        record = AbnRecord.from_dict(entry['record'])
+        record.position = tuple(entry['position']) if entry['position'] else None
+        records.append(record)
+    print(f"Replaying {len(records):,} records from {path}")
+
+    # Kept aside until the replay succeeds, so a failed one loses nothing
+    replayed_path = f"{path}.replayed"
+    os.replace(path, replayed_path)
+    uploaded = None
+    try:
+        uploaded = upload_records(records, sink, sizer=BatchSizer(), dead_letters=DeadLetterFile(path))
+    finally:
+        if uploaded is None:
+            if os.path.exists(path):
+                os.remove(path)
+            os.replace(replayed_path, path)
+        else:
+            os.remove(replayed_path)
+    return uploaded
 
 
 def validate_environment():
@@ -422,20 +2486,73 @@ def validate_environment():
     else:
         print(f"Using .env from: {env_path}")
 
-    # Check Supabase credentials
-    if not SUPABASE_URL:
-        errors.append("SUPABASE_URL not set in .env")
-        print("SUPABASE_URL not set")
+    # Check the output sink
+    unknown_sinks = [name for name in INGEST_SINKS if name not in ('supabase', 'postgres', 'parquet')]
+    if unknown_sinks:
+        errors.append(f"INGEST_SINK must be 'supabase', 'postgres', 'parquet' or a comma-separated list "
+                      f"(found '{INGEST_SINK}')")
     else:
-        print(f"SUPABASE_URL: {SUPABASE_URL}")
+        print(f"Sink: {INGEST_SINK}")
 
-    if not SUPABASE_KEY:
-        errors.append("SUPABASE_SERVICE_KEY not set in .env")
-        print("SUPABASE_SERVICE_KEY not set")
-        print("  (Note: Use service_role key, not anon key)")
+    # Check Supabase credentials
+    if 'supabase' in INGEST_SINKS:
+        if not SUPABASE_URL:
+            errors.append("SUPABASE_URL not set in .env")
+            print("SUPABASE_URL not set")
+        else:
+            print(f"SUPABASE_URL: {SUPABASE_URL}")
+
+        if not SUPABASE_KEY:
+            errors.append("SUPABASE_SERVICE_KEY not set in .env")
+            print("SUPABASE_SERVICE_KEY not set")
+            print("  (Note: Use service_role key, not anon key)")
+        else:
+            masked = f"{SUPABASE_KEY[:10]}...{SUPABASE_KEY[-5:]}"
+            print(f"✓ SUPABASE_SERVICE_KEY: {masked}")
+
+    # Check Postgres connection for the COPY sink
+    if 'postgres' in INGEST_SINKS:
+        if not DATABASE_URL:
+            errors.append("DATABASE_URL not set in .env")
+            print("DATABASE_URL not set")
+        else:
+            print("DATABASE_URL set")
+
+        try:
+            import psycopg2
+            print("psycopg2 installed")
+        except ImportError:
+            errors.append("psycopg2 not installed")
+            print("psycopg2 not installed")
+            print("  Run: pip install -r scripts/ingestion/requirements.txt")
+
+    # Check the XML parser
+    if XML_PARSER not in ('auto', 'lxml', 'stdlib'):
+        errors.append(f"XML_PARSER must be 'auto', 'lxml' or 'stdlib' (found '{XML_PARSER}')")
+    elif XML_PARSER == 'lxml' and lxml_etree is None:
+        errors.append("lxml not installed (required by XML_PARSER=lxml)")
+        print("lxml not installed")
+        print("  Run: pip install lxml, or set XML_PARSER=auto to fall back to the standard library")
     else:
-        masked = f"{SUPABASE_KEY[:10]}...{SUPABASE_KEY[-5:]}"
-        print(f"✓ SUPABASE_SERVICE_KEY: {masked}")
+        print(f"XML parser: {'lxml' if XML_PARSER != 'stdlib' and lxml_etree is not None else 'stdlib'}")
+
+    # Check pyarrow for the Parquet export
+    if 'parquet' in INGEST_SINKS:
+        if pa is None:
+            errors.append("pyarrow not installed (required by the parquet sink)")
+            print("pyarrow not installed")
+            print("  Run: pip install pyarrow")
+        else:
+            print(f"Parquet export: {EXPORT_DIR}")
+        if DELTA_MODE:
+            warnings.append("DELTA_MODE is on, so the Parquet export will only contain changed records")
+
+    # Check delta ingestion settings
+    if DELTA_MODE:
+        if DELTA_STRATEGY not in ('date', 'hash'):
+            errors.append(f"DELTA_STRATEGY must be 'date' or 'hash' (found '{DELTA_STRATEGY}')")
+        else:
+            print(f"Delta mode: {DELTA_STRATEGY}")
 
     # Check dependencies
     try:
@@ -471,11 +2588,84 @@ def validate_environment():
         return True
 
 
-def main():
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(description="Download, normalize and ingest the ABN Bulk Extract")
+    parser.add_argument('--resume', action='store_true',
+                        help="continue a failed run from its last checkpoint instead of starting over")
+    parser.add_argument('--load-parquet', metavar='DIR',
+                        help="bulk load a Parquet export into empty tables through DATABASE_URL, then exit")
+    parser.add_argument('--refresh-search', action='store_true',
+                        help="rebuild the search row of every loaded ABN through DATABASE_URL, then exit")
+    parser.add_argument('--rebuild', action='store_true',
+                        help="load a full extract into shadow tables and swap them in at the end (postgres sink)")
+    parser.add_argument('--sample-rebuild', action='store_true',
+                        help="allow --rebuild with DEV_MODE on, replacing the live tables with the sample")
+    parser.add_argument('--swap-with-dead-letters', action='store_true',
+                        help="swap a rebuild in even if records were set aside, to be replayed afterwards")
+    parser.add_argument('--replay-dead-letters', metavar='PATH', nargs='?', const=DEAD_LETTER_PATH,
+                        help="write the records set aside in a dead-letter file (default DEAD_LETTER_PATH) again, "
+                             "then exit")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None):
     """Main execution function"""
+    args = parse_args(argv)
     cwd = os.getcwd()
+
+    if args.load_parquet:
+        if not DATABASE_URL or pa is None:
+            print("Loading a Parquet export requires DATABASE_URL and pyarrow")
+            sys.exit(1)
+        start = time.monotonic()
+        loaded = load_parquet_export(args.load_parquet)
+        print(f"Loaded {loaded:,} rows from {args.load_parquet} in {time.monotonic() - start:.0f}s")
+        return
+    if args.refresh_search:
+        if not DATABASE_URL:
+            print("Refreshing the search rows requires DATABASE_URL")
+            sys.exit(1)
+        start = time.monotonic()
+        refreshed = refresh_search_index()
+        print(f"Refreshed {refreshed:,} search rows in {time.monotonic() - start:.0f}s")
+        return
+    if args.replay_dead_letters:
+        if 'parquet' in INGEST_SINKS:
+            print("Dead letters are replayed into the database, so set INGEST_SINK to postgres or supabase alone")
+            sys.exit(1)
+        if not os.path.exists(args.replay_dead_letters):
+            print(f"No dead-letter file at {args.replay_dead_letters}")
+            return
+        sink = create_sink()
+        try:
+            uploaded = replay_dead_letters(args.replay_dead_letters, sink)
+            if uploaded is None:
+                print(f"Failed to replay {args.replay_dead_letters}, it has been kept as it was")
+                sys.exit(1)
+            version = sink.bump_dataset_version()
+            if version is not None:
+                log_event('dataset_version', version=version)
+        finally:
+            sink.close()
+        # The file only comes back if a record was set aside again
+        if os.path.exists(args.replay_dead_letters):
+            print(f"Some records still failed, and were set aside again in {args.replay_dead_letters}")
+            sys.exit(1)
+        return
+    if args.rebuild and ('postgres' not in INGEST_SINKS or 'supabase' in INGEST_SINKS):
+        print("A rebuild writes through DATABASE_URL, so it needs INGEST_SINK=postgres (optionally with parquet)")
+        sys.exit(1)
+    if args.rebuild and DEV_MODE and not args.sample_rebuild:
+        print(f"DEV_MODE is on, so a rebuild would replace the live tables with a {SAMPLE_SIZE:,} record sample. "
+              f"Set DEV_MODE=false, or add --sample-rebuild if that is what you want")
+        sys.exit(1)
     raw_dir = None
-    extract_dir = None
+    completed = False
+    sink = None
+    delta_index = None
+    reporter = None
+    run_start = time.monotonic()
 
     try:
         print("=" * 60)
@@ -491,76 +2681,212 @@ def main():
             sys.exit(1)
 
         # Setup directories
-        raw_dir, extract_dir = setup_directories(cwd)
+        raw_dir = setup_directories(cwd)
+
+        # Progress, JSON snapshots and Prometheus metrics from here on
+        reporter = MetricsReporter().start()
+        log_event('run_started', dev_mode=DEV_MODE, sinks=INGEST_SINKS, workers=INGEST_WORKERS,
+                  batch_size=BATCH_SIZE, delta_mode=DELTA_MODE, resume=args.resume, rebuild=args.rebuild)
+
+        # Load the change-detection index before anything is written
+        default_index = 'fingerprints' if DELTA_STRATEGY == 'hash' else 'manifest.npz'
+        delta_index_path = MANIFEST_PATH or os.path.join(cwd, 'data', default_index)
+        if DELTA_MODE and args.rebuild:
+            print("\nA rebuild replaces every table, so DELTA_MODE is ignored")
+        elif DELTA_MODE:
+            delta_index = load_delta_index(delta_index_path, DELTA_STRATEGY)
 
         # Download ABN data files
         print("\n" + "=" * 60)
         print("Downloading ABN Data Files")
         print("=" * 60)
 
-        for url in ABN_DOWNLOAD_URLS:
-            if not download_file(url, raw_dir):
-                print(f"Failed to download {url}")
+        if not download_all(ABN_DOWNLOAD_URLS, raw_dir):
+            sys.exit(1)
+        log_event('download_finished', seconds=round(time.monotonic() - run_start, 1),
+                  bytes=METRICS.total('download_bytes_total'))
+
+        # Every committed batch moves the checkpoint forward
+        checkpoint_path = os.path.join(cwd, 'data', 'checkpoint.json')
+        archives = RunCheckpoint.archive_sizes(raw_dir)
+        resume = args.resume
+        if resume and 'parquet' in INGEST_SINKS:
+            print("\nThe Parquet export is rewritten in full on every run, so --resume is ignored")
+            resume = False
+        if resume and args.rebuild:
+            print("\nA rebuild always starts from empty shadow tables, so --resume is ignored")
+            resume = False
+        checkpoint = RunCheckpoint.load(checkpoint_path, archives) if resume else None
+        if checkpoint is not None:
+            print(f"\nResuming after {checkpoint.batches:,} committed batches ({checkpoint.uploaded:,} records)")
+        else:
+            if resume:
+                print("\nNo checkpoint to resume from, starting a fresh run")
+            checkpoint = RunCheckpoint(checkpoint_path, archives)
+            checkpoint.discard()
+
+        # The delta index has to see every record, so committed ones are only dropped after it
+        skips = checkpoint.offsets if delta_index is None else {}
+        resuming_delta = bool(checkpoint.offsets) and delta_index is not None
+
+        total_processed = checkpoint.uploaded
+        total_uploaded = checkpoint.uploaded
+        sink = create_sink(rebuild=args.rebuild)
+        # Shadow tables do not survive a failed run, so there is nothing to checkpoint
+        batch_checkpoint = None if args.rebuild else checkpoint
+
+        # Batch sizes adapt across the whole run, and a resumed run keeps its dead letters
+        sizer = BatchSizer()
+        if checkpoint.batches == 0 and os.path.exists(DEAD_LETTER_PATH):
+            # Moved aside rather than removed, as its records may not have been replayed yet
+            root, ext = os.path.splitext(DEAD_LETTER_PATH)
+            previous_path = f"{root}.{time.strftime('%Y%m%dT%H%M%S')}{ext}"
+            os.replace(DEAD_LETTER_PATH, previous_path)
+            print(f"Moved the previous run's dead letters to {previous_path}, "
+                  f"replay them with --replay-dead-letters {previous_path}")
+        dead_letters = DeadLetterFile()
+
+        # XML is streamed straight out of the archives, never extracted to disk
+        xml_sources = find_xml_members(raw_dir)
+        # Sources read without error, so a partial read is never taken for the whole extract
+        completed_sources = set()
+        print(f"\nFound {len(xml_sources)} XML files in: {raw_dir}")
+
+        if INGEST_WORKERS > 1 and xml_sources:
+            # All workers feed one shared upload stage
+            records = parse_files_parallel(
+                xml_sources,
+                workers=INGEST_WORKERS,
+                current_count=total_processed,
+                dev_mode=DEV_MODE,
+                sample_size=SAMPLE_SIZE,
+                skips=skips,
+                completed=completed_sources
+            )
+            if delta_index is not None:
+                records = filter_changed_records(records, delta_index)
+            if resuming_delta:
+                records = skip_committed(records, checkpoint)
+
+            uploaded = upload_records(records, sink, checkpoint=batch_checkpoint, sizer=sizer,
+                                      dead_letters=dead_letters)
+            if uploaded is None:
+                print("Failed to upload records, run again with --resume to continue")
                 sys.exit(1)
 
-        # Extract compressed data files
-        print("\n" + "=" * 60)
-        print("Extracting Data Files")
-        print("=" * 60)
-
-        for filename in os.listdir(raw_dir):
-            if filename.endswith('.zip'):
-                zip_path = os.path.join(raw_dir, filename)
-                if not extract_zip(zip_path, extract_dir):
-                    print(f"Failed to extract {zip_path}")
-                    sys.exit(1)
-
-        total_processed = 0
-        total_uploaded = 0
-
-        for root, dirs, files in os.walk(extract_dir):
-            xml_files = [f for f in files if f.endswith('.xml')]
-            print(f"\nFound {len(xml_files)} XML files in: {root}")
-
-            for file in xml_files:
-                xml_path = os.path.join(root, file)
+            total_uploaded += uploaded
+            total_processed += uploaded
+        else:
+            for xml_source in xml_sources:
+                file = describe_source(xml_source)
 
                 if DEV_MODE and total_processed >= SAMPLE_SIZE:
                     print(f"\nReached dev mode limit of {SAMPLE_SIZE:,} records")
                     break
 
                 records = process_xml_file(
-                    xml_path,
+                    xml_source,
                     current_count=total_processed,
                     dev_mode=DEV_MODE,
-                    sample_size=SAMPLE_SIZE
+                    sample_size=SAMPLE_SIZE,
+                    skip=skips.get(file, 0),
+                    completed=completed_sources
                 )
+                if delta_index is not None:
+                    # Skip unchanged records before anything is written
+                    records = filter_changed_records(records, delta_index)
+                if resuming_delta:
+                    records = skip_committed(records, checkpoint)
+
+                # Parsed records stream straight into the uploader
+                uploaded = upload_records(records, sink, checkpoint=batch_checkpoint, sizer=sizer,
+                                          dead_letters=dead_letters)
+                if uploaded is None:
+                    print(f"Failed to upload records from {file}, run again with --resume to continue")
+                    sys.exit(1)
 
-                if records:
-                    print(f"\nProcessed {len(records):,} records from {file}")
-                    if upload_to_supabase(records):
-                        total_uploaded += len(records)
-                        total_processed += len(records)
-                        print(f"Progress: {total_processed:,} total records processed")
-                    else:
-                        print(f"Failed to upload records from {file}")
-                        sys.exit(1)
-
-                    records.clear()
-                    del records
+                if uploaded:
+                    total_uploaded += uploaded
+                    total_processed += uploaded
+                    print(f"\nProcessed {uploaded:,} records from {file}")
+                    print(f"Progress: {total_processed:,} total records processed")
+                elif delta_index is not None:
+                    print(f"No changed records in {file}")
                 else:
                     print(f"No valid records found in {file}")
 
         print("\n" + "=" * 60)
         print(f"Successfully processed {total_processed:,} records")
         print(f"Successfully uploaded {total_uploaded:,} records")
+        if delta_index is not None:
+            print(f"Inserted {delta_index.inserted:,} new records")
+            print(f"Updated {delta_index.changed - delta_index.inserted:,} changed records")
+            print(f"Skipped {delta_index.skipped:,} unchanged records")
+        if len(dead_letters):
+            print(f"Set aside {len(dead_letters):,} records that could not be written in {dead_letters.path}")
         print("=" * 60)
 
+        # A sample run stops early on purpose; otherwise every source has to have been read to its end
+        unread = len(xml_sources) - len(completed_sources)
+
+        # The live tables are only replaced once the whole extract has loaded
+        if args.rebuild:
+            if unread and not DEV_MODE:
+                print(f"\n{unread} XML files were not read to the end, so the live tables are kept")
+                sys.exit(1)
+            # Set-aside ABNs are missing from the shadow tables, and would vanish from the live ones
+            if len(dead_letters) and not args.swap_with_dead_letters:
+                print(f"\n{len(dead_letters):,} records were set aside in {dead_letters.path}, so the live tables are "
+                      f"kept. Rebuild again once they can be written, or add --swap-with-dead-letters and replay "
+                      f"them with --replay-dead-letters afterwards")
+                sys.exit(1)
+            sink.finish()
+
+        # ABNs missing from a complete extract no longer exist in the register
+        if isinstance(delta_index, FingerprintIndex) and not DEV_MODE:
+            if unread:
+                print(f"\n{unread} XML files were not read to the end, so no vanished ABNs can be deleted")
+                sys.exit(1)
+            vanished = delta_index.vanished()
+            if len(vanished) > VANISHED_MAX_FRACTION * len(delta_index):
+                print(f"\n{len(vanished):,} of {len(delta_index):,} ABNs would be deleted as vanished, more than "
+                      f"VANISHED_MAX_FRACTION ({VANISHED_MAX_FRACTION:.1%}) allows. Nothing was deleted; check the "
+                      f"extract, or raise VANISHED_MAX_FRACTION if the deletions are expected")
+                sys.exit(1)
+            if len(vanished):
+                sink.delete_abns([f"{abn:011d}" for abn in vanished])
+                delta_index.drop(vanished)
+                print(f"Deleted {len(vanished):,} vanished ABNs")
+
+        # Readers caching lookups and searches drop them once they see the new version
+        version = sink.bump_dataset_version()
+        if version is not None:
+            print(f"Published dataset version {version}")
+            log_event('dataset_version', version=version)
+
+        # Only record the new state once every write has succeeded
+        if delta_index is not None:
+            # Set-aside records count as changed again next run, so they are retried
+            if len(dead_letters):
+                delta_index.forget(np.array([int(abn) for abn in dead_letters.abns], dtype=np.int64))
+            delta_index.save(delta_index_path)
+            print(f"Saved delta index of {len(delta_index):,} ABNs to {delta_index_path}")
+
+        checkpoint.discard()
+        completed = True
+
     finally:
-        if extract_dir:
-            cleanup_directory(extract_dir)
-        if raw_dir:
+        if sink:
+            sink.close()
+        if reporter:
+            reporter.stop()
+            log_event('run_finished', completed=completed, seconds=round(time.monotonic() - run_start, 1),
+                      parsed=METRICS.total('records_parsed_total'), uploaded=METRICS.total('records_uploaded_total'))
+        # Keep partial and verified downloads around so a failed run can pick up where it stopped
+        if raw_dir and completed:
             cleanup_directory(raw_dir)
+        elif raw_dir:
+            print(f"\nKeeping downloads in {raw_dir} for the next run")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,370 @@
+"""
+Local ABN Lookup Index
+
+Builds a compact, memory-mapped index of the ABN Bulk Extract for services
+that need to check ABNs faster than a database round trip allows, and serves
+batched lookups straight from the mapped files.
+
+Index layout (one directory):
+    abns.npy             sorted int64 ABNs
+    starts.npy           uint64 offset of each ABN's record in records.bin
+    lengths.npy          uint32 length of each record
+    records.bin          compact JSON rows for every record
+    tokens.bin           sorted, concatenated name tokens (UTF-8)
+    token_offsets.npy    uint64 offset of each token in tokens.bin (n + 1)
+    postings.npy         uint32 record positions for each token, grouped by token
+    posting_offsets.npy  uint64 start of each token's postings (n + 1)
+    meta.json            counts and build time
+
+Usage:
+    python abn_index.py build [--raw-dir data/raw] [--out data/index]
+    python abn_index.py lookup data/index 51824753556 53004085616
+    python abn_index.py search data/index "acme pty"
+"""
+
+import os
+import re
+import sys
+import json
+import mmap
+import time
+import shutil
+import argparse
+from array import array
+from bisect import bisect_left
+from typing import List, Dict, Optional, Iterable, Union
+
+import numpy as np
+
+import abn_data
+from abn_data import AbnRecord, TABLE_COLUMNS
+
+
+TOKEN_PATTERN = re.compile(r'[A-Z0-9]+')
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    """Upper-cased alphanumeric tokens of a name"""
+    return TOKEN_PATTERN.findall(text.upper()) if text else []
+
+
+def record_names(record: AbnRecord) -> List[str]:
+    """Every searchable name of a record: main, other and legal entity names"""
+    names = []
+    if record.main_entity:
+        names.append(record.main_entity[2])
+    if record.other_entity_names:
+        names.extend(row[2] for row in record.other_entity_names)
+    if record.legal_entity:
+        names.extend(record.legal_entity[3:6])
+    return [name for name in names if name]
+
+
+def encode_record(record: AbnRecord) -> bytes:
+    """Compact JSON of a record's rows, without the ABN repeated in every row"""
+
+    def strip(row: Optional[tuple]) -> Optional[tuple]:
+        return row[1:] if row else None
+
+    def strip_all(rows: Optional[tuple]) -> Optional[List[tuple]]:
+        return [row[1:] for row in rows] if rows else None
+
+    return json.dumps([
+        record.abn_record[1:],
+        strip(record.main_entity),
+        strip(record.legal_entity),
+        strip(record.asic_number),
+        strip(record.gst_registration),
+        strip_all(record.dgr_entries),
+        strip_all(record.other_entity_names),
+        strip(record.business_address)
+    ], separators=(',', ':')).encode()
+
+
+def decode_record(abn: str, payload: bytes) -> Dict:
+    """Rebuild the nested dict form of a record from its encoded rows"""
+    (abn_record, main_entity, legal_entity, asic_number, gst_registration,
+     dgr_entries, other_entity_names, business_address) = json.loads(payload)
+
+    def data(table: str, values: Optional[list]) -> Optional[Dict]:
+        return dict(zip(TABLE_COLUMNS[table][1:], values)) if values is not None else None
+
+    return {
+        'abn_record': dict(zip(TABLE_COLUMNS['abn_records'], [abn] + abn_record)),
+        'main_entity': data('main_entity', main_entity),
+        'legal_entity': data('legal_entity', legal_entity),
+        'asic_number': asic_number[0] if asic_number else None,
+        'gst_registration': data('gst_registrations', gst_registration),
+        'dgr_entries': [data('dgr_entries', row) for row in dgr_entries] if dgr_entries else None,
+        'other_entity_names': ([data('other_entity_names', row) for row in other_entity_names]
+                               if other_entity_names else None),
+        'business_address': data('business_addresses', business_address)
+    }
+
+
+def build_index(records: Iterable[AbnRecord], out_dir: str) -> int:
+    """
+    Build a lookup index from a stream of records. Records are appended to
+    records.bin as they arrive and only compact arrays are held in memory;
+    everything is sorted by ABN at the end. When an ABN appears more than
+    once, the last record wins. Returns the number of ABNs indexed.
+    """
+    # Built alongside and swapped in at the end, so open readers keep their old files
+    final_dir = out_dir
+    out_dir = f"{final_dir}.tmp"
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.makedirs(out_dir)
+    abns = array('q')
+    starts = array('Q')
+    lengths = array('I')
+    token_ids: Dict[str, int] = {}
+    pair_tokens = array('I')
+    pair_records = array('I')
+    offset = 0
+
+    print(f"\nBuilding lookup index in {final_dir}")
+    with open(os.path.join(out_dir, 'records.bin'), 'wb') as f:
+        for arrival, record in enumerate(records):
+            payload = encode_record(record)
+            f.write(payload)
+            abns.append(int(record.abn))
+            starts.append(offset)
+            lengths.append(len(payload))
+            offset += len(payload)
+
+            for token in {token for name in record_names(record) for token in tokenize(name)}:
+                pair_tokens.append(token_ids.setdefault(token, len(token_ids)))
+                pair_records.append(arrival)
+
+            if (arrival + 1) % 100000 == 0:
+                print(f"Indexed {arrival + 1:,} records...")
+
+    arrival_abns = np.frombuffer(abns, dtype=np.int64)
+    # A stable sort keeps arrival order within an ABN, so the last of each run is the newest
+    order = np.argsort(arrival_abns, kind='stable')
+    sorted_abns = arrival_abns[order]
+    latest = np.ones(len(order), dtype=bool)
+    latest[:-1] = sorted_abns[1:] != sorted_abns[:-1]
+    order = order[latest]
+
+    np.save(os.path.join(out_dir, 'abns.npy'), arrival_abns[order])
+    np.save(os.path.join(out_dir, 'starts.npy'), np.frombuffer(starts, dtype=np.uint64)[order])
+    np.save(os.path.join(out_dir, 'lengths.npy'), np.frombuffer(lengths, dtype=np.uint32)[order])
+
+    # Postings point at positions in the ABN-sorted arrays
+    position = np.full(len(arrival_abns), -1, dtype=np.int64)
+    position[order] = np.arange(len(order))
+
+    tokens = sorted(token_ids, key=lambda token: token.encode())
+    token_rank = np.empty(len(tokens), dtype=np.int64)
+    token_rank[[token_ids[token] for token in tokens]] = np.arange(len(tokens))
+
+    pair_rank = token_rank[np.frombuffer(pair_tokens, dtype=np.uint32)]
+    pair_position = position[np.frombuffer(pair_records, dtype=np.uint32)]
+    kept = pair_position >= 0
+    pair_rank, pair_position = pair_rank[kept], pair_position[kept]
+
+    # Group postings by token, each group sorted by ABN position
+    pair_order = np.lexsort((pair_position, pair_rank))
+    pair_rank, pair_position = pair_rank[pair_order], pair_position[pair_order]
+    np.save(os.path.join(out_dir, 'postings.npy'), pair_position.astype(np.uint32))
+    posting_offsets = np.zeros(len(tokens) + 1, dtype=np.uint64)
+    posting_offsets[1:] = np.cumsum(np.bincount(pair_rank, minlength=len(tokens)))
+    np.save(os.path.join(out_dir, 'posting_offsets.npy'), posting_offsets)
+
+    encoded_tokens = [token.encode() for token in tokens]
+    token_offsets = np.zeros(len(tokens) + 1, dtype=np.uint64)
+    token_offsets[1:] = np.cumsum([len(token) for token in encoded_tokens], dtype=np.uint64)
+    np.save(os.path.join(out_dir, 'token_offsets.npy'), token_offsets)
+    with open(os.path.join(out_dir, 'tokens.bin'), 'wb') as f:
+        f.write(b''.join(encoded_tokens))
+
+    with open(os.path.join(out_dir, 'meta.json'), 'w') as f:
+        json.dump({'abns': len(order), 'tokens': len(tokens), 'postings': len(pair_position),
+                   'built_at': time.strftime('%Y-%m-%dT%H:%M:%S')}, f)
+
+    shutil.rmtree(final_dir, ignore_errors=True)
+    os.replace(out_dir, final_dir)
+
+    print(f"Indexed {len(order):,} ABNs and {len(tokens):,} name tokens")
+    return len(order)
+
+
+def _abn_key(abn: Union[str, int]) -> int:
+    """An ABN as an int64 key, or -1 unless it is 11 ASCII digits"""
+    digits = ''.join(str(abn).split())
+    # isdigit() alone accepts other scripts' digits and superscripts, which int() rejects or misreads
+    return int(digits) if len(digits) == 11 and digits.isascii() and digits.isdigit() else -1
+
+
+def _map_file(path: str) -> Union[mmap.mmap, bytes]:
+    """Read-only mapping of a file (empty files cannot be mapped)"""
+    if os.path.getsize(path) == 0:
+        return b''
+    with open(path, 'rb') as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class _TokenList:
+    """Sequence view of the sorted tokens in tokens.bin, for bisecting"""
+
+    def __init__(self, data, offsets: np.ndarray):
+        self.data = data
+        self.offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> bytes:
+        return self.data[int(self.offsets[i]):int(self.offsets[i + 1])]
+
+
+class AbnIndex:
+    """
+    Read-only view of a lookup index. Every file is memory-mapped, so opening
+    an index is near instant and processes serving the same index share one
+    copy in the page cache.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.abns = np.load(os.path.join(path, 'abns.npy'), mmap_mode='r')
+        self.starts = np.load(os.path.join(path, 'starts.npy'), mmap_mode='r')
+        self.lengths = np.load(os.path.join(path, 'lengths.npy'), mmap_mode='r')
+        self.postings = np.load(os.path.join(path, 'postings.npy'), mmap_mode='r')
+        self.posting_offsets = np.load(os.path.join(path, 'posting_offsets.npy'), mmap_mode='r')
+        self.records = _map_file(os.path.join(path, 'records.bin'))
+        self.tokens = _TokenList(_map_file(os.path.join(path, 'tokens.bin')),
+                                 np.load(os.path.join(path, 'token_offsets.npy'), mmap_mode='r'))
+
+    def __len__(self) -> int:
+        return len(self.abns)
+
+    def _record(self, position: int) -> Dict:
+        start = int(self.starts[position])
+        payload = self.records[start:start + int(self.lengths[position])]
+        return decode_record(f"{int(self.abns[position]):011d}", payload)
+
+    def positions(self, abns: Union[Iterable[Union[str, int]], np.ndarray]) -> np.ndarray:
+        """
+        Position of each ABN in the index, or -1 where it is not present. An
+        int64 array of ABNs is searched as it is.
+        """
+        if isinstance(abns, np.ndarray) and abns.dtype == np.int64:
+            keys = abns
+        else:
+            keys = np.array([_abn_key(abn) for abn in abns], dtype=np.int64)
+        if not len(self.abns) or not len(keys):
+            return np.full(len(keys), -1, dtype=np.int64)
+        idx = np.minimum(np.searchsorted(self.abns, keys), len(self.abns) - 1)
+        return np.where(self.abns[idx] == keys, idx, -1)
+
+    def contains(self, abns: Iterable[Union[str, int]]) -> np.ndarray:
+        """Whether each ABN is in the index, without decoding any records"""
+        return self.positions(abns) >= 0
+
+    def lookup(self, abns: Iterable[Union[str, int]]) -> List[Optional[Dict]]:
+        """Records for a batch of ABNs, None where an ABN is not present"""
+        return [self._record(position) if position >= 0 else None for position in self.positions(abns)]
+
+    def _token_postings(self, token: str, prefix: bool = False) -> np.ndarray:
+        """ABN positions for an exact token, or for every token starting with it"""
+        key = token.encode()
+        lo = bisect_left(self.tokens, key)
+        if prefix:
+            # 0xff never occurs in UTF-8, so this sorts after every token with the prefix
+            hi = bisect_left(self.tokens, key + b'\xff', lo)
+        else:
+            hi = lo + 1 if lo < len(self.tokens) and self.tokens[lo] == key else lo
+        if lo == hi:
+            return np.empty(0, dtype=np.uint32)
+
+        postings = self.postings[int(self.posting_offsets[lo]):int(self.posting_offsets[hi])]
+        return np.unique(postings) if hi - lo > 1 else np.asarray(postings)
+
+    def search(self, query: str, limit: int = 20) -> List[Dict]:
+        """
+        Records whose names contain every token of the query, the last token
+        matched as a prefix so partial input works. Results are in ABN order.
+        """
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+
+        postings = [self._token_postings(token, prefix=i == len(tokens) - 1) for i, token in enumerate(tokens)]
+
+        # Start from the rarest token and probe the longer lists with binary searches
+        postings.sort(key=len)
+        matches = postings[0]
+        for other in postings[1:]:
+            if not len(matches):
+                return []
+            idx = np.minimum(np.searchsorted(other, matches), len(other) - 1)
+            matches = matches[other[idx] == matches]
+
+        return [self._record(int(position)) for position in matches[:limit]]
+
+    def search_many(self, queries: Iterable[str], limit: int = 20) -> List[List[Dict]]:
+        """Run a batch of name searches"""
+        return [self.search(query, limit) for query in queries]
+
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Build and query the local ABN lookup index")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    build = commands.add_parser('build', help="parse the downloaded extract into an index")
+    build.add_argument('--raw-dir', default=os.path.join(os.getcwd(), 'data', 'raw'))
+    build.add_argument('--out', default=os.path.join(os.getcwd(), 'data', 'index'))
+
+    lookup = commands.add_parser('lookup', help="look up ABNs")
+    lookup.add_argument('index')
+    lookup.add_argument('abns', nargs='+')
+
+    search = commands.add_parser('search', help="search names")
+    search.add_argument('index')
+    search.add_argument('query')
+    search.add_argument('--limit', type=int, default=20)
+
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        # Reuses complete downloads, and fetches anything missing
+        os.makedirs(args.raw_dir, exist_ok=True)
+        if not abn_data.download_all(abn_data.ABN_DOWNLOAD_URLS, args.raw_dir):
+            sys.exit(1)
+
+        sources = abn_data.find_xml_members(args.raw_dir)
+        if abn_data.INGEST_WORKERS > 1:
+            records = abn_data.parse_files_parallel(sources, workers=abn_data.INGEST_WORKERS,
+                                                    dev_mode=abn_data.DEV_MODE, sample_size=abn_data.SAMPLE_SIZE)
+        else:
+            def serial_records():
+                count = 0
+                for source in sources:
+                    for record in abn_data.process_xml_file(source, current_count=count, dev_mode=abn_data.DEV_MODE,
+                                                            sample_size=abn_data.SAMPLE_SIZE):
+                        yield record
+                        count += 1
+                    if abn_data.DEV_MODE and count >= abn_data.SAMPLE_SIZE:
+                        break
+            records = serial_records()
+
+        start = time.monotonic()
+        build_index(records, args.out)
+        print(f"Built index in {time.monotonic() - start:.0f}s")
+
+    elif args.command == 'lookup':
+        index = AbnIndex(args.index)
+        for abn, record in zip(args.abns, index.lookup(args.abns)):
+            print(json.dumps(record) if record else f"{abn}: not found")
+
+    elif args.command == 'search':
+        index = AbnIndex(args.index)
+        for record in index.search(args.query, args.limit):
+            print(json.dumps(record))
+
+
+if __name__ == "__main__":
+    main()
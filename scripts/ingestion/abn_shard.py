@@ -0,0 +1,460 @@
+"""
+Sharded ABN Ingestion
+
+Spreads one ingestion run across several worker processes or machines. A
+coordinator downloads the extract, queues one work unit per split XML file
+and waits; workers claim units, parse and load them into the sink, and
+report back. The queue is a SQLite file (processes on one machine) or a pair
+of tables in an `ingest` schema in Postgres (several machines):
+
+    runs        one row per run: its archives, mode and state
+    work_units  one row per split file: state, worker, lease and records loaded
+
+Claimed units carry a lease of SHARD_LEASE_SECONDS, renewed while the unit is
+loading. A worker that dies stops renewing, and once its lease expires the
+unit is handed to another worker. A unit that fails SHARD_MAX_ATTEMPTS times
+fails the run, which can then be resumed.
+
+With --rebuild, the coordinator creates the shadow tables, workers COPY into
+them, and the coordinator finishes and swaps them in once every unit is done.
+
+Usage:
+    python abn_shard.py coordinator [--rebuild [--sample-rebuild]] [--resume]
+    python abn_shard.py worker [--worker-id ID]
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import sqlite3
+import argparse
+import itertools
+import threading
+from typing import List, Dict, Optional, Iterable, Iterator
+
+import abn_data
+from abn_data import (AbnRecord, BatchSizer, DeadLetterFile, PostgresRebuildSink, RunCheckpoint,
+                      create_sink, describe_source, download_all, find_xml_members, process_xml_file,
+                      upload_records)
+from ingest_metrics import MetricsReporter, log_event
+
+
+# A SQLite file, or a Postgres connection string; Postgres is needed to shard across machines
+SHARD_QUEUE = os.getenv("SHARD_QUEUE") or abn_data.DATABASE_URL or os.path.join(os.getcwd(), 'data', 'work_queue.db')
+SHARD_LEASE_SECONDS = float(os.getenv("SHARD_LEASE_SECONDS", "120"))
+SHARD_MAX_ATTEMPTS = int(os.getenv("SHARD_MAX_ATTEMPTS", "3"))
+SHARD_POLL_SECONDS = float(os.getenv("SHARD_POLL_SECONDS", "5"))
+# How long a worker waits for a coordinator to start a run
+SHARD_WAIT_SECONDS = float(os.getenv("SHARD_WAIT_SECONDS", "600"))
+
+
+class WorkQueue:
+    """
+    Runs and their work units, shared by the coordinator and every worker.
+    The same statements run on SQLite and Postgres; times come from the
+    database's clock so that nodes' clocks do not have to agree.
+    """
+
+    def __init__(self, target: str = SHARD_QUEUE):
+        self.target = target
+        self.lock = threading.Lock()
+        self.postgres = target.startswith(('postgres://', 'postgresql://'))
+        if self.postgres:
+            import psycopg2
+
+            self.conn = psycopg2.connect(target)
+            self.conn.autocommit = True
+            self.sql_names = {'q': 'ingest.', 'now': "EXTRACT(EPOCH FROM CLOCK_TIMESTAMP())",
+                              'skip_locked': 'FOR UPDATE SKIP LOCKED'}
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(target)), exist_ok=True)
+            self.conn = sqlite3.connect(target, timeout=60, isolation_level=None, check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode = WAL")
+            self.sql_names = {'q': '', 'now': "((JULIANDAY('now') - 2440587.5) * 86400.0)", 'skip_locked': ''}
+        self._create_tables()
+
+    def _execute(self, sql: str, params: tuple = ()) -> List[tuple]:
+        """Run one statement on its own; rows it returns, if any"""
+        sql = sql.format(**self.sql_names)
+        with self.lock:
+            if self.postgres:
+                with self.conn.cursor() as cursor:
+                    cursor.execute(sql.replace('?', '%s'), params)
+                    return cursor.fetchall() if cursor.description else []
+            return self.conn.execute(sql, params).fetchall()
+
+    def _create_tables(self) -> None:
+        if self.postgres:
+            self._execute("CREATE SCHEMA IF NOT EXISTS ingest")
+        self._execute("""
+            CREATE TABLE IF NOT EXISTS {q}runs (
+                run_id     TEXT PRIMARY KEY,
+                archives   TEXT NOT NULL,
+                rebuild    INTEGER NOT NULL,
+                state      TEXT NOT NULL,
+                created_at DOUBLE PRECISION NOT NULL
+            )""")
+        self._execute("""
+            CREATE TABLE IF NOT EXISTS {q}work_units (
+                run_id        TEXT NOT NULL,
+                unit_id       INTEGER NOT NULL,
+                source        TEXT NOT NULL,
+                state         TEXT NOT NULL DEFAULT 'pending',
+                worker        TEXT,
+                attempts      INTEGER NOT NULL DEFAULT 0,
+                claims        INTEGER NOT NULL DEFAULT 0,
+                lease_expires DOUBLE PRECISION,
+                records       BIGINT,
+                error         TEXT,
+                PRIMARY KEY (run_id, unit_id)
+            )""")
+
+    def create_run(self, run_id: str, archives: Dict[str, int], rebuild: bool, sources: List[tuple]) -> None:
+        """Queue a unit per source, then open the run, replacing any run still open"""
+        for unit_id, (zip_path, member) in enumerate(sources):
+            self._execute("INSERT INTO {q}work_units (run_id, unit_id, source) VALUES (?, ?, ?)",
+                          (run_id, unit_id, json.dumps([os.path.basename(zip_path), member])))
+        self._execute("UPDATE {q}runs SET state = 'superseded' WHERE state = 'running'")
+        self._execute("INSERT INTO {q}runs (run_id, archives, rebuild, state, created_at) VALUES (?, ?, ?, 'running', {now})",
+                      (run_id, json.dumps(archives, sort_keys=True), int(rebuild)))
+
+    def latest_run(self, states: Iterable[str] = ('running',)) -> Optional[Dict]:
+        """The most recent run in one of the given states"""
+        states = list(states)
+        rows = self._execute(
+            "SELECT run_id, archives, rebuild, state FROM {q}runs "
+            f"WHERE state IN ({', '.join('?' * len(states))}) ORDER BY created_at DESC LIMIT 1", tuple(states))
+        if not rows:
+            return None
+        run_id, archives, rebuild, state = rows[0]
+        return {'run_id': run_id, 'archives': json.loads(archives), 'rebuild': bool(rebuild), 'state': state}
+
+    def run_state(self, run_id: str) -> Optional[str]:
+        rows = self._execute("SELECT state FROM {q}runs WHERE run_id = ?", (run_id,))
+        return rows[0][0] if rows else None
+
+    def set_run_state(self, run_id: str, state: str) -> None:
+        self._execute("UPDATE {q}runs SET state = ? WHERE run_id = ?", (state, run_id))
+
+    def retry_failed(self, run_id: str) -> int:
+        """Queue a resumed run's failed units again, with fresh attempts"""
+        return len(self._execute(
+            "UPDATE {q}work_units SET state = 'pending', attempts = 0, worker = NULL, lease_expires = NULL "
+            "WHERE run_id = ? AND state = 'failed' RETURNING unit_id", (run_id,)))
+
+    def claim(self, run_id: str, worker: str, lease_seconds: float = SHARD_LEASE_SECONDS,
+              max_attempts: int = SHARD_MAX_ATTEMPTS) -> Optional[tuple]:
+        """
+        Take the first pending unit, or one whose lease has expired. Returns
+        (unit_id, source, claim, attempt), or None when there is nothing to
+        take. `claim` numbers every claim of the unit, across resumed runs too.
+        """
+        rows = self._execute(
+            "UPDATE {q}work_units SET state = 'claimed', worker = ?, attempts = attempts + 1, "
+            "claims = claims + 1, lease_expires = {now} + ? "
+            "WHERE run_id = ? AND unit_id = ("
+            "  SELECT unit_id FROM {q}work_units "
+            "  WHERE run_id = ? AND attempts < ? AND (state = 'pending' OR (state = 'claimed' AND lease_expires < {now})) "
+            "  ORDER BY unit_id LIMIT 1 {skip_locked}) "
+            "RETURNING unit_id, source, claims, attempts",
+            (worker, lease_seconds, run_id, run_id, max_attempts))
+        if not rows:
+            return None
+        unit_id, source, claim, attempt = rows[0]
+        return unit_id, tuple(json.loads(source)), claim, attempt
+
+    def renew(self, run_id: str, unit_id: int, worker: str, claim: int,
+              lease_seconds: float = SHARD_LEASE_SECONDS) -> bool:
+        """Extend a lease; False if the unit is no longer this worker's"""
+        return bool(self._execute(
+            "UPDATE {q}work_units SET lease_expires = {now} + ? "
+            "WHERE run_id = ? AND unit_id = ? AND worker = ? AND claims = ? AND state = 'claimed' "
+            "RETURNING unit_id", (lease_seconds, run_id, unit_id, worker, claim)))
+
+    def complete(self, run_id: str, unit_id: int, worker: str, claim: int, records: int) -> bool:
+        """Mark a unit done; False if it had already been handed to someone else"""
+        return bool(self._execute(
+            "UPDATE {q}work_units SET state = 'done', records = ?, lease_expires = NULL, error = NULL "
+            "WHERE run_id = ? AND unit_id = ? AND worker = ? AND claims = ? AND state = 'claimed' "
+            "RETURNING unit_id", (records, run_id, unit_id, worker, claim)))
+
+    def fail(self, run_id: str, unit_id: int, worker: str, claim: int, error: str,
+             max_attempts: int = SHARD_MAX_ATTEMPTS) -> None:
+        """Hand a unit back to be retried, or fail it once it is out of attempts"""
+        self._execute(
+            "UPDATE {q}work_units SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+            "worker = NULL, lease_expires = NULL, error = ? "
+            "WHERE run_id = ? AND unit_id = ? AND worker = ? AND claims = ? AND state = 'claimed'",
+            (max_attempts, error, run_id, unit_id, worker, claim))
+
+    def expire(self, run_id: str, max_attempts: int = SHARD_MAX_ATTEMPTS) -> None:
+        """Fail units whose last attempt's lease ran out, since no one may claim them again"""
+        self._execute(
+            "UPDATE {q}work_units SET state = 'failed', worker = NULL, "
+            "error = COALESCE(error, 'Lease expired on every attempt') "
+            "WHERE run_id = ? AND state = 'claimed' AND attempts >= ? AND lease_expires < {now}",
+            (run_id, max_attempts))
+
+    def progress(self, run_id: str) -> Dict[str, tuple]:
+        """Units and records loaded by state"""
+        rows = self._execute("SELECT state, COUNT(*), COALESCE(SUM(records), 0) FROM {q}work_units "
+                             "WHERE run_id = ? GROUP BY state", (run_id,))
+        return {state: (units, int(records)) for state, units, records in rows}
+
+    def failures(self, run_id: str) -> List[tuple]:
+        return self._execute("SELECT source, error FROM {q}work_units WHERE run_id = ? AND state = 'failed' "
+                             "ORDER BY unit_id", (run_id,))
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+class Lease:
+    """Renews a claimed unit's lease in the background until stopped"""
+
+    def __init__(self, queue: WorkQueue, run_id: str, unit_id: int, worker: str, claim: int,
+                 seconds: float = SHARD_LEASE_SECONDS):
+        self.queue = queue
+        self.key = (run_id, unit_id, worker, claim)
+        self.seconds = seconds
+        self.lost = threading.Event()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._renew, name='lease', daemon=True)
+        self.thread.start()
+
+    def _renew(self) -> None:
+        while not self.stop_event.wait(self.seconds / 3):
+            try:
+                if not self.queue.renew(*self.key, lease_seconds=self.seconds):
+                    self.lost.set()
+                    return
+            except Exception as e:
+                # A lease outlives a few missed renewals
+                print(f"Could not renew lease: {e}")
+
+    def guard(self, records: Iterable[AbnRecord]) -> Iterator[AbnRecord]:
+        """Pass records through, stopping the load if the unit has been handed to another worker"""
+        for record in records:
+            if self.lost.is_set():
+                raise RuntimeError("Lease lost, the unit has been handed to another worker")
+            yield record
+
+    def stop(self) -> None:
+        self.stop_event.set()
+        self.thread.join()
+
+
+def check_sinks(rebuild: bool) -> bool:
+    """Sharded runs write to a database from every worker"""
+    if 'parquet' in abn_data.INGEST_SINKS:
+        print("Every worker would rewrite the same Parquet export, so sharded runs need INGEST_SINK=postgres or supabase")
+        return False
+    if rebuild and abn_data.INGEST_SINKS != ['postgres']:
+        print("A rebuild writes through DATABASE_URL, so it needs INGEST_SINK=postgres")
+        return False
+    return True
+
+
+def report(queue: WorkQueue, run_id: str, total: int) -> Dict[str, tuple]:
+    progress = queue.progress(run_id)
+    units = {state: count for state, (count, _) in progress.items()}
+    records = sum(loaded for _, loaded in progress.values())
+    print(f"Units: {units.get('done', 0)}/{total} done, {units.get('claimed', 0)} loading, "
+          f"{units.get('pending', 0)} pending, {units.get('failed', 0)} failed | {records:,} records loaded")
+    return progress
+
+
+def run_coordinator(queue: WorkQueue, rebuild: bool = False, resume: bool = False) -> bool:
+    """Queue a run, wait for the workers to load every unit, then finish it"""
+    cwd = os.getcwd()
+    raw_dir = abn_data.setup_directories(cwd)
+    if not download_all(abn_data.ABN_DOWNLOAD_URLS, raw_dir):
+        return False
+    archives = RunCheckpoint.archive_sizes(raw_dir)
+
+    run = queue.latest_run(('running', 'failed')) if resume else None
+    if run is not None and (run['archives'] != archives or run['rebuild'] != rebuild):
+        print(f"\nRun {run['run_id']} was taken against other downloads or another mode, starting a new run")
+        run = None
+
+    # A resumed rebuild keeps loading into the shadow tables it started
+    sink = PostgresRebuildSink(create=run is None) if rebuild else None
+    if run is not None:
+        run_id = run['run_id']
+        retried = queue.retry_failed(run_id)
+        queue.set_run_state(run_id, 'running')
+        print(f"\nResuming run {run_id}, retrying {retried} failed units")
+    else:
+        run_id = time.strftime('%Y%m%dT%H%M%S')
+        sources = find_xml_members(raw_dir)
+        if not sources:
+            print(f"No XML files found in {raw_dir}")
+            return False
+        # Only queued once the shadow tables exist for workers to load into
+        queue.create_run(run_id, archives, rebuild, sources)
+        print(f"\nQueued run {run_id}: {len(sources)} units in {queue.target}")
+    log_event('shard_run_started', run_id=run_id, rebuild=rebuild, resumed=run is not None)
+
+    start = time.monotonic()
+    total = sum(units for units, _ in queue.progress(run_id).values())
+    last = None
+    while True:
+        queue.expire(run_id)
+        progress = queue.progress(run_id)
+        if progress != last:
+            report(queue, run_id, total)
+            last = progress
+        if 'failed' in progress:
+            queue.set_run_state(run_id, 'failed')
+            for source, error in queue.failures(run_id):
+                print(f"Failed {':'.join(json.loads(source))}: {error}")
+            print(f"\nRun {run_id} failed, run the coordinator again with --resume to retry its failed units")
+            return False
+        if progress.get('done', (0, 0))[0] == total:
+            break
+        time.sleep(SHARD_POLL_SECONDS)
+
+    loaded = progress['done'][1]
+    print(f"\nLoaded {loaded:,} records from {total} units in {time.monotonic() - start:.0f}s")
+
+    # The live tables are only replaced once every unit has loaded
+    sink = sink or create_sink(concurrency=1)
+    try:
+        if rebuild:
+            sink.finish()
+        version = sink.bump_dataset_version()
+        if version is not None:
+            print(f"Published dataset version {version}")
+    finally:
+        sink.close()
+
+    queue.set_run_state(run_id, 'complete')
+    log_event('shard_run_finished', run_id=run_id, records=loaded, seconds=round(time.monotonic() - start, 1))
+    return True
+
+
+def run_worker(queue: WorkQueue, worker_id: str) -> bool:
+    """Claim and load units of the open run until none are left"""
+    waited = time.monotonic()
+    run = queue.latest_run()
+    while run is None:
+        if time.monotonic() - waited > SHARD_WAIT_SECONDS:
+            print(f"No run was started within {SHARD_WAIT_SECONDS:.0f}s")
+            return False
+        time.sleep(SHARD_POLL_SECONDS)
+        run = queue.latest_run()
+    run_id = run['run_id']
+    print(f"\nWorker {worker_id} joining run {run_id}")
+    if run['rebuild'] and not check_sinks(rebuild=True):
+        return False
+
+    # Every node loads from its own copy of the same archives
+    raw_dir = abn_data.setup_directories(os.getcwd())
+    if not download_all(abn_data.ABN_DOWNLOAD_URLS, raw_dir):
+        return False
+    if RunCheckpoint.archive_sizes(raw_dir) != run['archives']:
+        print(f"The archives in {raw_dir} differ from the ones run {run_id} was queued with")
+        return False
+
+    sink = PostgresRebuildSink(create=False) if run['rebuild'] else create_sink()
+    sizer = BatchSizer()
+    root, ext = os.path.splitext(abn_data.DEAD_LETTER_PATH)
+    dead_letters = DeadLetterFile(f"{root}.{worker_id}{ext}")
+    loaded_units = 0
+    try:
+        while queue.run_state(run_id) == 'running':
+            claimed = queue.claim(run_id, worker_id)
+            if claimed is None:
+                progress = queue.progress(run_id)
+                if not progress.get('pending') and not progress.get('claimed'):
+                    break
+                # Units still loading elsewhere may yet be handed back
+                time.sleep(SHARD_POLL_SECONDS)
+                continue
+
+            unit_id, (archive, member), claim, attempt = claimed
+            source = (os.path.join(raw_dir, archive), member)
+            print(f"\nClaimed unit {unit_id} ({archive}:{member}), attempt {attempt}")
+            if run['rebuild']:
+                # Later files, and later claims of the same file, win as in a single process run
+                sink.sequence = itertools.count(((unit_id << 8) | min(claim, 255)) << 32)
+
+            lease = Lease(queue, run_id, unit_id, worker_id, claim)
+            error = f"Upload failed on {worker_id}"
+            completed = set()
+            try:
+                records = process_xml_file(source, dev_mode=abn_data.DEV_MODE, sample_size=abn_data.SAMPLE_SIZE,
+                                           completed=completed)
+                uploaded = upload_records(lease.guard(records), sink, sizer=sizer, dead_letters=dead_letters)
+                # A unit is only done once its file was read to the end, or to the sample size
+                if uploaded is not None and describe_source(source) not in completed:
+                    error = f"{worker_id}: {archive}:{member} was not read to the end"
+                    uploaded = None
+            except Exception as e:
+                # A bad member or a lost lease fails this unit, not the worker
+                print(f"Error loading unit {unit_id}: {e}")
+                error = f"{worker_id}: {e}"
+                uploaded = None
+            finally:
+                lease.stop()
+
+            if uploaded is None:
+                queue.fail(run_id, unit_id, worker_id, claim, error)
+                print(f"Handed back unit {unit_id}")
+            elif queue.complete(run_id, unit_id, worker_id, claim, uploaded):
+                loaded_units += 1
+                print(f"Loaded unit {unit_id}: {uploaded:,} records")
+            else:
+                print(f"Unit {unit_id} was handed to another worker before it finished")
+    finally:
+        sink.close()
+
+    print(f"\nWorker {worker_id} loaded {loaded_units} units")
+    if len(dead_letters):
+        print(f"Set aside {len(dead_letters):,} records that could not be written in {dead_letters.path}")
+    return True
+
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Spread an ingestion run across several workers")
+    parser.add_argument('--queue', default=SHARD_QUEUE, help="SQLite file or Postgres URL of the work queue")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    coordinator = commands.add_parser('coordinator', help="queue a run and wait for the workers to load it")
+    coordinator.add_argument('--rebuild', action='store_true',
+                             help="load into shadow tables and swap them in at the end (postgres sink)")
+    coordinator.add_argument('--sample-rebuild', action='store_true',
+                             help="allow --rebuild with DEV_MODE on, replacing the live tables with the sample")
+    coordinator.add_argument('--resume', action='store_true', help="retry the failed units of the last run")
+
+    worker = commands.add_parser('worker', help="load units of the open run")
+    worker.add_argument('--worker-id', default=f"{socket.gethostname()}-{os.getpid()}")
+
+    args = parser.parse_args()
+
+    if not abn_data.validate_environment() or not check_sinks(getattr(args, 'rebuild', False)):
+        sys.exit(1)
+    if getattr(args, 'rebuild', False) and abn_data.DEV_MODE and not args.sample_rebuild:
+        print(f"DEV_MODE is on, so a rebuild would replace the live tables with a {abn_data.SAMPLE_SIZE:,} record "
+              f"sample of each unit. Set DEV_MODE=false, or add --sample-rebuild if that is what you want")
+        sys.exit(1)
+
+    queue = WorkQueue(args.queue)
+    reporter = MetricsReporter().start()
+    try:
+        if args.command == 'coordinator':
+            succeeded = run_coordinator(queue, rebuild=args.rebuild, resume=args.resume)
+        else:
+            succeeded = run_worker(queue, args.worker_id)
+    finally:
+        reporter.stop()
+        queue.close()
+    if not succeeded:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
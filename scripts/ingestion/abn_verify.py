@@ -0,0 +1,305 @@
+"""
+Bulk ABN Verification
+
+Checks large lists of ABNs (a CSV file, or one per line on stdin) against the
+ABN Bulk Extract and streams back one result row per input row, in input
+order:
+
+    input, abn, result, abn_status, abn_status_from_date, entity_type,
+    name, gst_status, gst_status_from_date, asic_number
+
+where result is 'found', 'not_found' or 'invalid'. Input is read in chunks of
+VERIFY_CHUNK_SIZE rows. Each chunk is checked against the ABN modulus 89
+checksum in one vectorised pass, so malformed numbers never reach the
+lookup, then deduplicated and resolved either from a local lookup index
+(abn_index.py) or from Postgres with a few large `= ANY(array)` queries,
+through the read cache of abn_cache.py so ABNs repeated across chunks are
+only queried once.
+
+Usage:
+    python abn_verify.py customers.csv --index data/index > results.csv
+    python abn_verify.py customers.csv --column abn --format jsonl --output results.jsonl
+    cut -d, -f3 customers.csv | python abn_verify.py - --index data/index
+"""
+
+import os
+import csv
+import sys
+import json
+import time
+import argparse
+import datetime
+from typing import List, Dict, Optional, Iterable, Iterator, TextIO, Union
+
+import numpy as np
+
+import abn_data
+
+
+# Input rows verified together: checksummed, deduplicated and looked up at once
+VERIFY_CHUNK_SIZE = int(os.getenv("VERIFY_CHUNK_SIZE", "50000"))
+# ABNs per Postgres query
+VERIFY_QUERY_SIZE = int(os.getenv("VERIFY_QUERY_SIZE", "10000"))
+
+ABN_WEIGHTS = np.array([10, 1, 3, 5, 7, 9, 11, 13, 15, 17, 19], dtype=np.int64)
+PLACE_VALUES = 10 ** np.arange(10, -1, -1, dtype=np.int64)
+
+RESULT_COLUMNS = ('input', 'abn', 'result', 'abn_status', 'abn_status_from_date', 'entity_type',
+                  'name', 'gst_status', 'gst_status_from_date', 'asic_number')
+
+
+def normalize_abn(value: str) -> str:
+    """An ABN as written, without the spaces it is usually grouped with"""
+    return ''.join(value.split())
+
+
+def abn_keys(values: List[str]) -> np.ndarray:
+    """
+    int64 key of each value that is a valid ABN, or -1. An ABN is valid when
+    it has 11 digits, does not start with 0, and the sum of its digits times
+    ABN_WEIGHTS, after subtracting 1 from the first digit, is divisible by 89.
+    """
+    normalized = [normalize_abn(value) for value in values]
+    keys = np.full(len(normalized), -1, dtype=np.int64)
+    candidate = np.fromiter((len(value) == 11 for value in normalized), dtype=bool, count=len(normalized))
+    if not candidate.any():
+        return keys
+
+    # Non-ASCII characters become one '?' byte each, so every row stays 11 bytes
+    text = ''.join(value for value, ok in zip(normalized, candidate) if ok).encode('ascii', 'replace')
+    digits = np.frombuffer(text, dtype=np.uint8).reshape(-1, 11).astype(np.int64) - ord('0')
+
+    valid = ((digits >= 0) & (digits <= 9)).all(axis=1) & (digits[:, 0] > 0)
+    checksum = digits @ ABN_WEIGHTS - ABN_WEIGHTS[0]
+    valid &= checksum % 89 == 0
+    keys[np.flatnonzero(candidate)[valid]] = digits[valid] @ PLACE_VALUES
+    return keys
+
+
+def _iso_date(value) -> Optional[str]:
+    """A date from either source (date or yyyymmdd) as YYYY-MM-DD"""
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    if isinstance(value, str) and len(value) == 8 and value.isdigit():
+        return f"{value[:4]}-{value[4:6]}-{value[6:]}"
+    return value
+
+
+def _person_name(*parts: Optional[str]) -> Optional[str]:
+    return ' '.join(part for part in parts if part) or None
+
+
+class IndexLookup:
+    """Resolves ABNs from a local lookup index, with no database round trip"""
+
+    name = 'index'
+
+    def __init__(self, path: str):
+        from abn_index import AbnIndex
+        self.index = AbnIndex(path)
+
+    def lookup(self, keys: np.ndarray) -> List[Optional[Dict]]:
+        results = []
+        for record in self.index.lookup(keys):
+            if record is None:
+                results.append(None)
+                continue
+            abn_record = record['abn_record']
+            main_entity = record['main_entity']
+            legal_entity = record['legal_entity']
+            gst = record['gst_registration'] or {}
+            results.append({
+                'abn_status': abn_record['abn_status'],
+                'abn_status_from_date': _iso_date(abn_record['abn_status_from_date']),
+                'entity_type': abn_record['entity_type_text'],
+                'name': (main_entity['text'] if main_entity else None) or (
+                    _person_name(legal_entity['given_name_1'], legal_entity['given_name_2'],
+                                 legal_entity['family_name']) if legal_entity else None),
+                'gst_status': gst.get('status'),
+                'gst_status_from_date': _iso_date(gst.get('status_from_date')),
+                'asic_number': record['asic_number']
+            })
+        return results
+
+    def close(self) -> None:
+        pass
+
+
+class PostgresLookup:
+    """Resolves ABNs from the normalized tables, VERIFY_QUERY_SIZE per query"""
+
+    name = 'postgres'
+
+    QUERY = """
+        SELECT r.abn, r.abn_status, r.abn_status_from_date, r.entity_type_text,
+               COALESCE(m.text, NULLIF(CONCAT_WS(' ', l.given_name_1, l.given_name_2, l.family_name), '')),
+               g.status, g.status_from_date, a.asic_number
+        FROM public.abn_records r
+                 LEFT JOIN public.main_entity m ON m.abn = r.abn
+                 LEFT JOIN public.legal_entity l ON l.abn = r.abn
+                 LEFT JOIN public.gst_registrations g ON g.abn = r.abn
+                 LEFT JOIN public.asic_numbers a ON a.abn = r.abn
+        WHERE r.abn = ANY (%s::CHAR(11)[])
+    """
+
+    def __init__(self, dsn: str = None, query_size: int = VERIFY_QUERY_SIZE):
+        import psycopg2
+
+        self.conn = psycopg2.connect(dsn or abn_data.DATABASE_URL)
+        # Lookups only read, so no transaction is held open between chunks
+        self.conn.autocommit = True
+        self.query_size = query_size
+
+    def lookup(self, keys: np.ndarray) -> List[Optional[Dict]]:
+        abns = [f"{key:011d}" for key in keys.tolist()]
+        found: Dict[str, Dict] = {}
+        with self.conn.cursor() as cursor:
+            for start in range(0, len(abns), self.query_size):
+                cursor.execute(self.QUERY, (abns[start:start + self.query_size],))
+                for abn, status, status_from, entity_type, name, gst_status, gst_from, asic in cursor:
+                    found[abn] = {
+                        'abn_status': status,
+                        'abn_status_from_date': _iso_date(status_from),
+                        'entity_type': entity_type,
+                        'name': name,
+                        'gst_status': gst_status,
+                        'gst_status_from_date': _iso_date(gst_from),
+                        'asic_number': asic
+                    }
+        return [found.get(abn) for abn in abns]
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+def verify_chunk(values: List[str], lookup) -> Iterator[Dict]:
+    """Result rows for a chunk of input values, in input order"""
+    keys = abn_keys(values)
+    valid = keys >= 0
+    # Each distinct ABN is looked up once, however often it appears
+    unique, inverse = np.unique(keys[valid], return_inverse=True)
+    found = lookup.lookup(unique) if len(unique) else []
+    unique_at = np.full(len(keys), -1, dtype=np.int64)
+    unique_at[valid] = inverse
+
+    for value, key, position in zip(values, keys.tolist(), unique_at.tolist()):
+        if key < 0:
+            yield {'input': value, 'abn': None, 'result': 'invalid'}
+            continue
+        record = found[position]
+        row = {'input': value, 'abn': f"{key:011d}", 'result': 'found' if record else 'not_found'}
+        if record:
+            row.update(record)
+        yield row
+
+
+def verify_abns(values: Iterable[str], lookup, chunk_size: int = VERIFY_CHUNK_SIZE) -> Iterator[Dict]:
+    """Stream result rows for any number of input values, one chunk at a time"""
+    chunk = []
+    for value in values:
+        chunk.append(value)
+        if len(chunk) >= chunk_size:
+            yield from verify_chunk(chunk, lookup)
+            chunk = []
+    if chunk:
+        yield from verify_chunk(chunk, lookup)
+
+
+def read_abn_column(stream: TextIO, column: Optional[Union[str, int]] = None) -> Iterator[str]:
+    """
+    ABN values from a CSV stream. `column` is a header name or a 0-based
+    index. Without one, a column headed 'abn' is used if the first row has
+    one, otherwise the first column, with no header row.
+    """
+    rows = csv.reader(stream)
+    first = next(rows, None)
+    if first is None:
+        return
+
+    header = [cell.strip().lower() for cell in first]
+    if isinstance(column, str) and not column.isdigit():
+        if column.lower() not in header:
+            raise ValueError(f"No column named {column!r} in: {', '.join(first)}")
+        index = header.index(column.lower())
+    elif column is not None:
+        index = int(column)
+        yield first[index] if index < len(first) else ''
+    elif 'abn' in header:
+        index = header.index('abn')
+    else:
+        index = 0
+        yield first[0] if first else ''
+
+    for row in rows:
+        yield row[index] if index < len(row) else ''
+
+
+def write_results(results: Iterable[Dict], out: TextIO, output_format: str = 'csv') -> Dict[str, int]:
+    """Write result rows as CSV or JSON lines; returns the count of each result"""
+    counts = {'found': 0, 'not_found': 0, 'invalid': 0}
+    writer = None
+    if output_format == 'csv':
+        writer = csv.writer(out)
+        writer.writerow(RESULT_COLUMNS)
+    for row in results:
+        counts[row['result']] += 1
+        if writer:
+            writer.writerow([row.get(column) for column in RESULT_COLUMNS])
+        else:
+            out.write(json.dumps(row) + '\n')
+    return counts
+
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Verify a list of ABNs against the ABN Bulk Extract")
+    parser.add_argument('input', help="CSV file of ABNs, or - for stdin")
+    parser.add_argument('--column', help="header name or 0-based index of the ABN column")
+    parser.add_argument('--index', help="local lookup index to resolve ABNs from (default: DATABASE_URL)")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="query DATABASE_URL for every chunk, without the read cache of abn_cache.py")
+    parser.add_argument('--format', choices=('csv', 'jsonl'), default='csv')
+    parser.add_argument('--output', help="file to write results to (default: stdout)")
+    args = parser.parse_args()
+
+    if args.index:
+        lookup = IndexLookup(args.index)
+    elif abn_data.DATABASE_URL and args.no_cache:
+        lookup = PostgresLookup()
+    elif abn_data.DATABASE_URL:
+        # Imported here, as abn_cache builds on this module
+        from abn_cache import AbnReader
+        lookup = AbnReader()
+    else:
+        print("Either --index or DATABASE_URL is required", file=sys.stderr)
+        sys.exit(1)
+
+    source = sys.stdin if args.input == '-' else open(args.input, newline='', encoding='utf-8-sig')
+    out = open(args.output, 'w', newline='') if args.output else sys.stdout
+    start = time.monotonic()
+    try:
+        counts = write_results(verify_abns(read_abn_column(source, args.column), lookup), out, args.format)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    finally:
+        lookup.close()
+        if source is not sys.stdin:
+            source.close()
+        if out is not sys.stdout:
+            out.close()
+
+    # Results may be on stdout, so the summary goes to stderr
+    total = sum(counts.values())
+    elapsed = max(time.monotonic() - start, 1e-9)
+    print(f"Verified {total:,} ABNs from {lookup.name} in {elapsed:.1f}s ({total / elapsed:,.0f}/s): "
+          f"{counts['found']:,} found, {counts['not_found']:,} not found, {counts['invalid']:,} invalid",
+          file=sys.stderr)
+    if hasattr(lookup, 'stats'):
+        stats = lookup.stats()['lookup']
+        print(f"Read cache: {stats['hits']:,} hits, {stats['misses']:,} misses, {stats['evictions']:,} evictions",
+              file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
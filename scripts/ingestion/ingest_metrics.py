@@ -0,0 +1,309 @@
+"""
+Ingestion Metrics
+
+Counters, gauges and histograms for an ingestion run, kept in one
+thread-safe registry (METRICS). A reporter thread samples memory use and,
+every METRICS_INTERVAL seconds:
+
+    prints one progress line with rates since the last one
+    appends a JSON snapshot to METRICS_LOG, next to the run's events
+    rewrites METRICS_TEXTFILE in the Prometheus text format
+
+and METRICS_PORT serves the same text at /metrics.
+"""
+
+import os
+import sys
+import json
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, Optional, Iterator, Tuple
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+METRICS_LOG = os.getenv("METRICS_LOG")
+METRICS_TEXTFILE = os.getenv("METRICS_TEXTFILE")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_INTERVAL = float(os.getenv("METRICS_INTERVAL", "10"))
+
+PREFIX = 'abn_ingest_'
+
+# Latency buckets in seconds, from a single small upsert up to a stalled batch
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# name: (type, help)
+METRIC_TYPES: Dict[str, Tuple[str, str]] = {
+    'download_bytes_total': ('counter', "Bytes downloaded"),
+    'retries_total': ('counter', "Operations retried after a failure, by stage"),
+    'records_parsed_total': ('counter', "Valid records parsed from the XML"),
+    'records_invalid_total': ('counter', "ABR elements skipped because they could not be parsed"),
+    'records_uploaded_total': ('counter', "Records written to the sink"),
+    'records_dead_lettered_total': ('counter', "Records set aside in the dead-letter file"),
+    'batches_failed_total': ('counter', "Batches that failed to write"),
+    'batch_build_seconds': ('histogram', "Time to build the table rows of a batch"),
+    'batch_write_seconds': ('histogram', "Time to write a batch to the sink"),
+    'table_write_seconds': ('histogram', "Time to write one table's rows of a batch"),
+    'batches_in_flight': ('gauge', "Batches being written"),
+    'batch_budget_bytes': ('gauge', "Current payload size budget of a batch"),
+    'rss_bytes': ('gauge', "Resident memory of the ingestion process"),
+    'cache_requests_total': ('counter', "Read cache lookups, by cache and hit or miss"),
+    'cache_entries': ('gauge', "Entries held by each read cache"),
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    """Cumulative bucket counts plus the sum and count of observed values"""
+
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, fraction: float) -> float:
+        """Upper bound of the bucket holding the given quantile"""
+        target = fraction * self.count
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS + (float('inf'),), self.counts):
+            seen += count
+            if seen >= target and count:
+                return bound
+        return 0.0
+
+
+class Metrics:
+    """Thread-safe registry of labelled counters, gauges and histograms"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values: Dict[str, Dict[Labels, float]] = {}
+        self.histograms: Dict[str, Dict[Labels, Histogram]] = {}
+
+    @staticmethod
+    def _labels(labels: Dict[str, str]) -> Labels:
+        return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        key = self._labels(labels)
+        with self.lock:
+            series = self.values.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels) -> None:
+        with self.lock:
+            self.values.setdefault(name, {})[self._labels(labels)] = value
+
+    def observe(self, name: str, seconds: float, **labels) -> None:
+        key = self._labels(labels)
+        with self.lock:
+            series = self.histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def timer(self, name: str, **labels) -> Iterator[None]:
+        """Observe how long the block takes, whether or not it raises"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def total(self, name: str) -> float:
+        """A counter or gauge summed over all of its labels"""
+        with self.lock:
+            return sum(self.values.get(name, {}).values())
+
+    def snapshot(self) -> Dict:
+        """JSON-ready values, with each histogram summarised"""
+        def series_name(name: str, labels: Labels) -> str:
+            return name + ''.join(f"[{value}]" for _, value in labels)
+
+        with self.lock:
+            snapshot = {series_name(name, labels): value
+                        for name, series in self.values.items() for labels, value in series.items()}
+            for name, series in self.histograms.items():
+                for labels, histogram in series.items():
+                    snapshot[series_name(name, labels)] = {
+                        'count': histogram.count,
+                        'sum': round(histogram.sum, 4),
+                        'p50': histogram.quantile(0.5),
+                        'p95': histogram.quantile(0.95),
+                        'p99': histogram.quantile(0.99),
+                    }
+        return snapshot
+
+    def prometheus_text(self) -> str:
+        """Every metric in the Prometheus text exposition format"""
+        def label_text(labels: Labels, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+            pairs = labels + extra
+            if not pairs:
+                return ''
+            return '{' + ','.join(f'{key}="{value}"' for key, value in pairs) + '}'
+
+        lines = []
+        with self.lock:
+            for name, (kind, help_text) in METRIC_TYPES.items():
+                series = self.histograms.get(name) if kind == 'histogram' else self.values.get(name)
+                if not series:
+                    continue
+                full_name = PREFIX + name
+                lines.append(f"# HELP {full_name} {help_text}")
+                lines.append(f"# TYPE {full_name} {kind}")
+                for labels, value in series.items():
+                    if kind != 'histogram':
+                        lines.append(f"{full_name}{label_text(labels)} {value}")
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(LATENCY_BUCKETS + (float('inf'),), value.counts):
+                        cumulative += count
+                        le = '+Inf' if bound == float('inf') else repr(bound)
+                        lines.append(f"{full_name}_bucket{label_text(labels, (('le', le),))} {cumulative}")
+                    lines.append(f"{full_name}_sum{label_text(labels)} {value.sum}")
+                    lines.append(f"{full_name}_count{label_text(labels)} {value.count}")
+        return '\n'.join(lines) + '\n'
+
+
+METRICS = Metrics()
+
+_log_lock = threading.Lock()
+
+
+def log_event(event: str, **fields) -> None:
+    """Append a structured event to METRICS_LOG, if one is configured"""
+    if not METRICS_LOG:
+        return
+    line = json.dumps({'ts': round(time.time(), 3), 'event': event, **fields}, default=str)
+    with _log_lock, open(METRICS_LOG, 'a') as f:
+        f.write(line + '\n')
+
+
+def current_rss_bytes() -> Optional[int]:
+    """Resident memory of this process, or its peak where only that is reported"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = METRICS.prometheus_text().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+
+class MetricsReporter:
+    """
+    Background thread that samples memory and reports progress, the JSON
+    snapshot and the Prometheus textfile every `interval` seconds, and once
+    more when stopped.
+    """
+
+    def __init__(self, interval: float = METRICS_INTERVAL, port: int = METRICS_PORT):
+        self.interval = interval
+        self.port = port
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='metrics', daemon=True)
+        self.server = None
+        self.last: Dict[str, float] = {}
+        self.last_time = time.monotonic()
+
+    def start(self) -> 'MetricsReporter':
+        if self.port:
+            self.server = ThreadingHTTPServer(('0.0.0.0', self.port), _MetricsHandler)
+            threading.Thread(target=self.server.serve_forever, name='metrics-http', daemon=True).start()
+            print(f"Serving metrics at http://localhost:{self.port}/metrics")
+        self.thread.start()
+        return self
+
+    def _progress_line(self, now: float) -> Optional[str]:
+        elapsed = max(now - self.last_time, 1e-9)
+        parts = []
+        for name, label in (('records_parsed_total', 'Parsed'), ('records_uploaded_total', 'Uploaded')):
+            total = METRICS.total(name)
+            if total:
+                rate = (total - self.last.get(name, 0)) / elapsed
+                parts.append(f"{label} {total:,.0f} ({rate:,.0f}/s)")
+            self.last[name] = total
+        downloaded = METRICS.total('download_bytes_total')
+        if downloaded and downloaded != self.last.get('download_bytes_total'):
+            rate = (downloaded - self.last.get('download_bytes_total', 0)) / elapsed
+            parts.append(f"Downloaded {downloaded / 1e6:,.0f} MB ({rate / 1e6:,.1f} MB/s)")
+        self.last['download_bytes_total'] = downloaded
+        if not parts:
+            return None
+        rss = METRICS.total('rss_bytes')
+        if rss:
+            parts.append(f"RSS {rss / 1e6:,.0f} MB")
+        return ' | '.join(parts)
+
+    def report(self, progress: bool = True) -> None:
+        rss = current_rss_bytes()
+        if rss is not None:
+            METRICS.set('rss_bytes', rss)
+
+        now = time.monotonic()
+        line = self._progress_line(now)
+        self.last_time = now
+        if progress and line:
+            print(line)
+
+        log_event('metrics', **METRICS.snapshot())
+
+        if METRICS_TEXTFILE:
+            # Written aside and renamed, so a collector never reads half a file
+            tmp_path = f"{METRICS_TEXTFILE}.tmp"
+            with open(tmp_path, 'w') as f:
+                f.write(METRICS.prometheus_text())
+            os.replace(tmp_path, METRICS_TEXTFILE)
+
+    def _run(self) -> None:
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.report()
+            except Exception as e:
+                print(f"Metrics report failed: {e}")
+
+    def stop(self) -> None:
+        """Stop reporting, after one final report"""
+        self.stop_event.set()
+        self.thread.join()
+        try:
+            self.report(progress=False)
+        except Exception as e:
+            print(f"Metrics report failed: {e}")
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
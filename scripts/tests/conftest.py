@@ -0,0 +1,59 @@
+"""
+Shared fixtures for the ingestion tests. The ingestion scripts import each
+other by module name, so their directory goes on the path first.
+"""
+
+import os
+import sys
+from typing import List, Optional
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'ingestion'))
+
+import abn_data  # noqa: E402
+from abn_data import AbnRecord  # noqa: E402
+
+
+def make_record(number: int, source: str = '20250101_Public01.xml', position: Optional[int] = None) -> AbnRecord:
+    """A minimal record with an ABN built from `number`, tagged with its element position"""
+    abn = f"{number:011d}"
+    return AbnRecord(
+        (abn, '2020-01-01', 'ACT', '2000-01-01', 'PRV', 'Australian Private Company'),
+        main_entity=(abn, 'MN', f"COMPANY {number} PTY LTD"),
+        position=(source, number if position is None else position)
+    )
+
+
+def make_records(count: int, source: str = '20250101_Public01.xml') -> List[AbnRecord]:
+    return [make_record(number, source) for number in range(count)]
+
+
+class RecordingSink:
+    """
+    Sink that keeps every record it accepts. A batch holding one of the
+    `poison` ABNs fails, as does every batch once `down` is set.
+    """
+
+    name = 'recording'
+
+    def __init__(self, poison=(), down: bool = False):
+        self.poison = set(poison)
+        self.down = down
+        self.written: List[str] = []
+        self.calls = 0
+
+    def write_batch(self, batch: List[AbnRecord]) -> None:
+        self.calls += 1
+        if self.down:
+            raise ConnectionError("sink unreachable")
+        bad = [record.abn for record in batch if record.abn in self.poison]
+        if bad:
+            raise ValueError(f"invalid record {bad[0]}")
+        self.written.extend(record.abn for record in batch)
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    """Retries happen straight away, so failing writes do not slow the tests down"""
+    monkeypatch.setattr(abn_data.random, 'uniform', lambda low, high: 0)
@@ -0,0 +1,47 @@
+"""ABN keys: abn_verify.abn_keys validates the checksum, abn_index._abn_key only the shape"""
+
+import pytest
+
+from abn_index import _abn_key
+from abn_verify import abn_keys
+
+
+@pytest.mark.parametrize('value, key', [
+    ('51824753556', 51824753556),
+    ('51 824 753 556', 51824753556),
+    (' 53 004 085 616 ', 53004085616),
+    ('51824753557', -1),            # checksum fails
+    ('01000000191', -1),            # checksum passes, but ABNs never start with 0
+    ('5182475355', -1),             # 10 digits
+    ('518247535560', -1),           # 12 digits
+    ('5182475355a', -1),
+    ('٥١٨٢٤٧٥٣٥٥٦', -1),            # Arabic-Indic digits
+    ('5182475355²', -1),
+    ('', -1),
+])
+def test_abn_keys(value, key):
+    assert abn_keys([value]).tolist() == [key]
+
+
+def test_abn_keys_keep_input_order():
+    values = ['junk', '51824753556', '', '53004085616', '51824753557']
+    assert abn_keys(values).tolist() == [-1, 51824753556, -1, 53004085616, -1]
+
+
+def test_abn_keys_of_nothing_valid():
+    assert abn_keys(['1', 'x']).tolist() == [-1, -1]
+    assert abn_keys([]).tolist() == []
+
+
+@pytest.mark.parametrize('value, key', [
+    ('51824753556', 51824753556),
+    ('51 824 753 556', 51824753556),
+    (51824753556, 51824753556),
+    ('123', -1),
+    ('9' * 25, -1),                 # would overflow an int64 key
+    ('١٢', -1),
+    ('²' * 11, -1),
+    ('5182475355٦', -1),
+])
+def test_index_abn_key(value, key):
+    assert _abn_key(value) == key
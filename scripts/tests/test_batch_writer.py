@@ -0,0 +1,86 @@
+"""BatchWriter retries, bisection and dead letters, and how they move the BatchSizer budget"""
+
+import json
+
+import pytest
+
+from abn_data import BatchSizer, BatchWriter, DeadLetterFile
+from conftest import RecordingSink, make_records
+
+
+def test_poison_record_is_isolated(tmp_path):
+    records = make_records(100)
+    poison = records[37].abn
+    sink = RecordingSink(poison=[poison])
+    dead_letters = DeadLetterFile(str(tmp_path / 'dead_letter.jsonl'))
+
+    written = BatchWriter(sink, dead_letters=dead_letters, retries=1).write(records)
+
+    assert written == 99
+    assert sorted(sink.written) == sorted(record.abn for record in records if record.abn != poison)
+    assert dead_letters.abns == [poison]
+    with open(dead_letters.path) as f:
+        entry = json.loads(f.readline())
+    assert entry['abn'] == poison
+    assert entry['sink'] == 'recording'
+    assert 'invalid record' in entry['error']
+    assert entry['record']['abn_record']['abn'] == poison
+
+
+def test_every_record_written_once_around_several_poison_records(tmp_path):
+    records = make_records(64)
+    # Neighbours, and one in each half of the batch
+    poison = {records[3].abn, records[40].abn, records[41].abn}
+    sink = RecordingSink(poison=poison)
+    dead_letters = DeadLetterFile(str(tmp_path / 'dead_letter.jsonl'))
+
+    written = BatchWriter(sink, dead_letters=dead_letters, retries=0).write(records)
+
+    assert written == 61
+    assert len(sink.written) == len(set(sink.written)) == 61
+    assert set(dead_letters.abns) == poison
+
+
+def test_failure_without_dead_letters_is_raised():
+    records = make_records(10)
+    sink = RecordingSink(poison=[records[3].abn])
+
+    with pytest.raises(ValueError):
+        BatchWriter(sink, retries=0).write(records)
+
+
+def test_unreachable_sink_fails_the_batch(tmp_path):
+    sink = RecordingSink(down=True)
+    dead_letters = DeadLetterFile(str(tmp_path / 'dead_letter.jsonl'))
+
+    with pytest.raises(ConnectionError):
+        BatchWriter(sink, dead_letters=dead_letters, retries=0, max_consecutive_failures=4).write(make_records(64))
+    # Consecutive failures stop the bisection long before single records are set aside
+    assert len(dead_letters) == 0
+
+
+def test_poison_record_shrinks_the_budget_once(tmp_path):
+    records = make_records(256)
+    sink = RecordingSink(poison=[records[100].abn])
+    sizer = BatchSizer(max_bytes=1 << 20, min_bytes=1 << 10)
+    failures = []
+    original = sizer.failed
+    sizer.failed = lambda: (failures.append(1), original())
+
+    BatchWriter(sink, sizer, DeadLetterFile(str(tmp_path / 'dead_letter.jsonl')), retries=2).write(records)
+
+    # Only the batch as a whole failed for want of a cause; every split found a written half
+    assert len(failures) == 1
+
+
+def test_budget_recovers_gradually_after_a_failure():
+    sizer = BatchSizer(max_bytes=1000, min_bytes=10)
+    sizer.failed()
+    assert sizer.budget == sizer.ceiling == 500
+
+    # A fast sink would allow the whole budget at once, but the ceiling only grows by a tenth per write
+    sizer.succeeded(make_records(10), 0.001)
+    assert sizer.budget == 550
+    for _ in range(20):
+        sizer.succeeded(make_records(10), 0.001)
+    assert sizer.budget == 1000
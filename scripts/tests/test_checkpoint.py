@@ -0,0 +1,93 @@
+"""RunCheckpoint persistence, and upload_records committing only a contiguous run of finished batches"""
+
+import threading
+
+from abn_data import RunCheckpoint, batch_positions, upload_records
+from conftest import RecordingSink, make_records
+
+SOURCE = '20250101_Public01.xml'
+
+
+class RecordingCheckpoint(RunCheckpoint):
+    """Checkpoint that keeps the positions of each commit, in order"""
+
+    def __init__(self, path: str):
+        super().__init__(path, {'public_split_1_10.zip': 1})
+        self.commits = []
+
+    def commit(self, positions, uploaded) -> None:
+        self.commits.append(dict(positions))
+        super().commit(positions, uploaded)
+
+
+class SlowFirstSink(RecordingSink):
+    """Holds the first batch until every later batch has been written"""
+
+    def __init__(self, later_batches: int, **kwargs):
+        super().__init__(**kwargs)
+        self.later_written = threading.Semaphore(0)
+        self.later_batches = later_batches
+        self.finished = []
+
+    def write_batch(self, batch) -> None:
+        first = batch[0].position[1] == 0
+        if first:
+            for _ in range(self.later_batches):
+                assert self.later_written.acquire(timeout=10)
+        try:
+            super().write_batch(batch)
+        finally:
+            self.finished.append(batch[0].position[1])
+            if not first:
+                self.later_written.release()
+
+
+def test_commits_wait_for_earlier_batches(tmp_path):
+    sink = SlowFirstSink(later_batches=3)
+    checkpoint = RecordingCheckpoint(str(tmp_path / 'checkpoint.json'))
+
+    uploaded = upload_records(make_records(40), sink, batch_size=10, concurrency=4, checkpoint=checkpoint)
+
+    assert uploaded == 40
+    # Batches finished out of order, but were committed in order
+    assert sink.finished[-1] == 0
+    assert [commit[SOURCE] for commit in checkpoint.commits] == [9, 19, 29, 39]
+    assert checkpoint.offset(SOURCE) == 40
+    assert checkpoint.uploaded == 40
+
+
+def test_failed_batch_stops_the_checkpoint_before_it(tmp_path):
+    records = make_records(40)
+    sink = RecordingSink(poison=[records[15].abn])
+    checkpoint = RecordingCheckpoint(str(tmp_path / 'checkpoint.json'))
+
+    uploaded = upload_records(records, sink, batch_size=10, concurrency=4, checkpoint=checkpoint)
+
+    assert uploaded is None
+    # Later batches may have been written, but a resumed run has to start at the failed one
+    assert checkpoint.offset(SOURCE) == 10
+    assert RunCheckpoint.load(checkpoint.path, checkpoint.archives).offsets == {SOURCE: 10}
+
+
+def test_checkpoint_round_trip(tmp_path):
+    path = str(tmp_path / 'checkpoint.json')
+    archives = {'public_split_1_10.zip': 123, 'public_split_11_20.zip': 456}
+    checkpoint = RunCheckpoint(path, archives)
+    checkpoint.commit({'a.xml': 9, 'b.xml': 4}, 15)
+    checkpoint.commit({'a.xml': 3}, 1)
+
+    loaded = RunCheckpoint.load(path, archives)
+    assert loaded.offsets == {'a.xml': 10, 'b.xml': 5}
+    assert (loaded.uploaded, loaded.batches) == (16, 2)
+
+    # Taken against other downloads, it does not apply
+    assert RunCheckpoint.load(path, {**archives, 'public_split_11_20.zip': 457}) is None
+
+    loaded.discard()
+    assert RunCheckpoint.load(path, archives) is None
+
+
+def test_batch_positions_keep_the_furthest_element_per_source():
+    batch = make_records(3, 'a.xml') + make_records(5, 'b.xml')
+    batch[0].position = None
+    assert batch_positions(batch) == {'a.xml': 2, 'b.xml': 4}
@@ -0,0 +1,244 @@
+-- Name search over the normalized ABN tables
+-- Migration: 20251121093000_add_abn_search
+
+SET search_path TO public;
+
+CREATE SCHEMA IF NOT EXISTS extensions;
+CREATE EXTENSION IF NOT EXISTS pg_trgm WITH SCHEMA extensions;
+
+-- 0..n child rows are looked up and replaced by ABN on every load
+CREATE INDEX IF NOT EXISTS dgr_entries_abn_idx ON public.dgr_entries (abn);
+CREATE INDEX IF NOT EXISTS other_entity_names_abn_idx ON public.other_entity_names (abn);
+
+-- Search Table (0..1 per ABN)
+-- One denormalized row per ABN with everything a search result shows,
+-- kept in step with the normalized tables by refresh_abn_search()
+CREATE TABLE IF NOT EXISTS public.abn_search
+(
+    abn                  CHAR(11) PRIMARY KEY REFERENCES public.abn_records (abn) ON DELETE CASCADE,
+
+    name                 VARCHAR(300), -- main entity name, or the individual's full name
+    other_names          TEXT,         -- every other entity name, space separated
+
+    entity_type_text     VARCHAR(100),
+    abn_status           CHAR(3) NOT NULL,
+    abn_status_from_date DATE    NOT NULL,
+    gst_status           CHAR(3),
+    gst_status_from_date DATE,
+    state_code           VARCHAR(3),
+    postcode             VARCHAR(50),
+
+    search_vector        TSVECTOR GENERATED ALWAYS AS (
+        setweight(to_tsvector('simple'::regconfig, COALESCE(name, '')), 'A') ||
+        setweight(to_tsvector('simple'::regconfig, COALESCE(other_names, '')), 'B')
+        ) STORED,
+
+    refreshed_at         TIMESTAMPTZ DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS abn_search_vector_idx ON public.abn_search USING GIN (search_vector);
+CREATE INDEX IF NOT EXISTS abn_search_name_trgm_idx ON public.abn_search USING GIN (name extensions.gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS abn_search_name_lower_idx ON public.abn_search (LOWER(name));
+CREATE INDEX IF NOT EXISTS abn_search_postcode_idx ON public.abn_search (postcode);
+
+ALTER TABLE public.abn_search
+    ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Allow public read access" ON public.abn_search FOR SELECT USING (true);
+
+GRANT SELECT ON public.abn_search TO anon, authenticated;
+
+-- Rebuild the search rows for a set of ABNs from the normalized tables, or
+-- for every ABN when called without one. Rows for deleted ABNs go with
+-- them via ON DELETE CASCADE. Returns the number of rows written.
+CREATE OR REPLACE FUNCTION public.refresh_abn_search(abns TEXT[] DEFAULT NULL) RETURNS INTEGER
+    LANGUAGE plpgsql
+    SET search_path = public AS
+$$
+DECLARE
+    refreshed INTEGER;
+BEGIN
+    -- Planned per call, so a batch of ABNs is always fetched through the primary keys
+    EXECUTE FORMAT($sql$
+    INSERT INTO public.abn_search AS s (abn, name, other_names, entity_type_text, abn_status,
+                                        abn_status_from_date, gst_status, gst_status_from_date,
+                                        state_code, postcode)
+    SELECT r.abn,
+           COALESCE(m.text, NULLIF(CONCAT_WS(' ', l.given_name_1, l.given_name_2, l.family_name), '')),
+           o.names,
+           r.entity_type_text,
+           r.abn_status,
+           r.abn_status_from_date,
+           g.status,
+           g.status_from_date,
+           b.state_code,
+           b.postcode
+    FROM public.abn_records r
+             LEFT JOIN public.main_entity m ON m.abn = r.abn
+             LEFT JOIN public.legal_entity l ON l.abn = r.abn
+             LEFT JOIN public.gst_registrations g ON g.abn = r.abn
+             LEFT JOIN public.business_addresses b ON b.abn = r.abn
+             LEFT JOIN LATERAL (SELECT STRING_AGG(e.text, ' ' ORDER BY e.id) AS names
+                                FROM public.other_entity_names e
+                                WHERE e.abn = r.abn) o ON TRUE
+    %s
+    ON CONFLICT (abn) DO UPDATE SET name                 = EXCLUDED.name,
+                                    other_names          = EXCLUDED.other_names,
+                                    entity_type_text     = EXCLUDED.entity_type_text,
+                                    abn_status           = EXCLUDED.abn_status,
+                                    abn_status_from_date = EXCLUDED.abn_status_from_date,
+                                    gst_status           = EXCLUDED.gst_status,
+                                    gst_status_from_date = EXCLUDED.gst_status_from_date,
+                                    state_code           = EXCLUDED.state_code,
+                                    postcode             = EXCLUDED.postcode,
+                                    refreshed_at         = NOW()
+    $sql$, CASE WHEN abns IS NOT NULL THEN 'WHERE r.abn = ANY ($1::CHAR(11)[])' ELSE '' END) USING abns;
+
+    GET DIAGNOSTICS refreshed = ROW_COUNT;
+    RETURN refreshed;
+END;
+$$;
+
+-- Only the ingestion (service role) keeps the search table up to date
+REVOKE EXECUTE ON FUNCTION public.refresh_abn_search(TEXT[]) FROM PUBLIC, anon, authenticated;
+
+-- Ranked, paginated search. An 11 digit query (spaces allowed) matches an
+-- ABN exactly. Otherwise every word must match a name, the last one (of 3+
+-- characters) as a prefix; when no name matches, names similar to the query
+-- are returned instead. Only the 1000 best exact, word and similar matches
+-- are kept for paging, so total_count stops there, and total_capped says
+-- when there were more.
+CREATE OR REPLACE FUNCTION public.search_abn(search_query TEXT,
+                                             state_filter TEXT DEFAULT NULL,
+                                             postcode_filter TEXT DEFAULT NULL,
+                                             page_size INTEGER DEFAULT 20,
+                                             page_offset INTEGER DEFAULT 0)
+    RETURNS TABLE
+            (
+                abn                  CHAR(11),
+                name                 VARCHAR(300),
+                entity_type_text     VARCHAR(100),
+                abn_status           CHAR(3),
+                abn_status_from_date DATE,
+                gst_status           CHAR(3),
+                gst_status_from_date DATE,
+                state_code           VARCHAR(3),
+                postcode             VARCHAR(50),
+                rank                 REAL,
+                total_count          BIGINT,
+                total_capped         BOOLEAN
+            )
+    LANGUAGE plpgsql
+    STABLE
+    SET search_path = public, extensions AS
+$$
+DECLARE
+    query_text TEXT     := TRIM(search_query);
+    digits     TEXT     := REGEXP_REPLACE(search_query, '\s', '', 'g');
+    tokens     TEXT[]   := ARRAY(SELECT token
+                                 FROM REGEXP_SPLIT_TO_TABLE(LOWER(search_query), '[^a-z0-9]+') token
+                                 WHERE token <> '');
+    query_abn  CHAR(11) := CASE WHEN digits ~ '^\d{11}$' THEN digits END;
+    words      TSQUERY;
+BEGIN
+    IF CARDINALITY(tokens) = 0 THEN
+        RETURN;
+    END IF;
+
+    -- Prefix matches always get a flat row estimate, so the last word is also
+    -- matched whole, which gives the planner a real estimate for common
+    -- words. Words too short to narrow anything down are only matched whole.
+    IF LENGTH(tokens[CARDINALITY(tokens)]) >= 3 THEN
+        tokens[CARDINALITY(tokens)] := FORMAT('(%1$s | %1$s:*)', tokens[CARDINALITY(tokens)]);
+    END IF;
+    words := TO_TSQUERY('simple', ARRAY_TO_STRING(tokens, ' & '));
+
+    -- Executed as a one-off query, so it is planned against the actual words.
+    -- Every kind of match is ranked before it is cut off at 1001 rows, so the
+    -- 1000 kept are the best ones, and a 1001st shows there were more.
+    RETURN QUERY EXECUTE $sql$
+        WITH abn_matches AS (SELECT s.abn, s.abn_status,
+                                    (CASE WHEN s.abn = $2 OR LOWER(s.name) = LOWER($1) THEN 1 ELSE 0 END
+                                        + TS_RANK_CD(s.search_vector, $3)
+                                        + SIMILARITY(COALESCE(s.name, ''), $1))::REAL AS rank
+                             FROM public.abn_search s
+                             WHERE s.abn = $2),
+             exact_matches AS (SELECT s.abn, s.abn_status,
+                                      (CASE WHEN s.abn = $2 OR LOWER(s.name) = LOWER($1) THEN 1 ELSE 0 END
+                                          + TS_RANK_CD(s.search_vector, $3)
+                                          + SIMILARITY(COALESCE(s.name, ''), $1))::REAL AS rank
+                               FROM public.abn_search s
+                               WHERE LOWER(s.name) = LOWER($1)
+                                 AND ($4::TEXT IS NULL OR s.state_code = $4)
+                                 AND ($5::TEXT IS NULL OR s.postcode = $5)
+                               ORDER BY rank DESC, (s.abn_status = 'ACT') DESC, s.abn
+                               LIMIT 1001),
+             word_matches AS (SELECT s.abn, s.abn_status,
+                                     (CASE WHEN s.abn = $2 OR LOWER(s.name) = LOWER($1) THEN 1 ELSE 0 END
+                                         + TS_RANK_CD(s.search_vector, $3)
+                                         + SIMILARITY(COALESCE(s.name, ''), $1))::REAL AS rank
+                              FROM public.abn_search s
+                              WHERE $2 IS NULL
+                                AND s.search_vector @@ $3
+                                AND ($4::TEXT IS NULL OR s.state_code = $4)
+                                AND ($5::TEXT IS NULL OR s.postcode = $5)
+                              ORDER BY rank DESC, (s.abn_status = 'ACT') DESC, s.abn
+                              LIMIT 1001),
+             similar_matches AS (SELECT s.abn, s.abn_status,
+                                        (CASE WHEN s.abn = $2 OR LOWER(s.name) = LOWER($1) THEN 1 ELSE 0 END
+                                            + TS_RANK_CD(s.search_vector, $3)
+                                            + SIMILARITY(COALESCE(s.name, ''), $1))::REAL AS rank
+                                 FROM public.abn_search s
+                                 WHERE $2 IS NULL
+                                   AND LENGTH($1) >= 3
+                                   AND NOT EXISTS (SELECT 1 FROM word_matches)
+                                   AND s.name % $1
+                                   AND ($4::TEXT IS NULL OR s.state_code = $4)
+                                   AND ($5::TEXT IS NULL OR s.postcode = $5)
+                                 ORDER BY rank DESC, (s.abn_status = 'ACT') DESC, s.abn
+                                 LIMIT 1001),
+             candidates AS (SELECT c.* FROM abn_matches c
+                            UNION
+                            SELECT c.* FROM exact_matches c
+                            UNION
+                            SELECT c.* FROM word_matches c
+                            UNION
+                            SELECT c.* FROM similar_matches c),
+             kept AS (SELECT c.abn, c.rank
+                      FROM candidates c
+                      ORDER BY c.rank DESC, (c.abn_status = 'ACT') DESC, c.abn
+                      LIMIT 1000),
+             ranked AS (SELECT s.*, k.rank
+                        FROM kept k
+                                 JOIN public.abn_search s ON s.abn = k.abn)
+        SELECT r.abn,
+               r.name,
+               r.entity_type_text,
+               r.abn_status,
+               r.abn_status_from_date,
+               r.gst_status,
+               r.gst_status_from_date,
+               r.state_code,
+               r.postcode,
+               r.rank,
+               COUNT(*) OVER (),
+               (SELECT COUNT(*) > 1000 FROM candidates)
+        FROM ranked r
+        ORDER BY r.rank DESC, (r.abn_status = 'ACT') DESC, r.abn
+        LIMIT $6 OFFSET $7
+        $sql$
+        USING query_text, query_abn, words, state_filter, postcode_filter,
+            LEAST(GREATEST(page_size, 1), 100), GREATEST(page_offset, 0);
+END;
+$$;
+
+GRANT EXECUTE ON FUNCTION public.search_abn(TEXT, TEXT, TEXT, INTEGER, INTEGER) TO anon, authenticated;
+
+-- Not backfilled here: filling it for a loaded extract would hold this
+-- migration's transaction open for every row. Ingestion refreshes the rows of
+-- every batch it writes, and `abn_data.py --refresh-search` fills it for
+-- records loaded before this migration.
+
+COMMENT ON TABLE public.abn_search IS 'Denormalized search rows (one per ABN), refreshed by refresh_abn_search()';
+COMMENT ON FUNCTION public.refresh_abn_search(TEXT[]) IS 'Rebuild search rows for the given ABNs, or all ABNs when NULL';
+COMMENT ON FUNCTION public.search_abn(TEXT, TEXT, TEXT, INTEGER, INTEGER) IS 'Ranked, paginated name and ABN search';
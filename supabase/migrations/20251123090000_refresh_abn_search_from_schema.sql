@@ -0,0 +1,72 @@
+-- Let refresh_abn_search build the search rows of the tables in any schema,
+-- so a bulk rebuild can fill its shadow abn_search before it is swapped in
+-- Migration: 20251123090000_refresh_abn_search_from_schema
+
+SET search_path TO public;
+
+DROP FUNCTION IF EXISTS public.refresh_abn_search(TEXT[]);
+
+-- Rebuild the search rows for a set of ABNs from the normalized tables, or
+-- for every ABN when called without one. Rows for deleted ABNs go with
+-- them via ON DELETE CASCADE. Returns the number of rows written.
+CREATE OR REPLACE FUNCTION public.refresh_abn_search(abns TEXT[] DEFAULT NULL,
+                                                     source_schema TEXT DEFAULT 'public') RETURNS INTEGER
+    LANGUAGE plpgsql
+    SET search_path = public AS
+$$
+DECLARE
+    refreshed INTEGER;
+BEGIN
+    -- Planned per call, so a batch of ABNs is always fetched through the
+    -- primary keys, while a full refresh aggregates other names in one pass
+    EXECUTE FORMAT($sql$
+    INSERT INTO %1$I.abn_search AS s (abn, name, other_names, entity_type_text, abn_status,
+                                      abn_status_from_date, gst_status, gst_status_from_date,
+                                      state_code, postcode)
+    SELECT r.abn,
+           COALESCE(m.text, NULLIF(CONCAT_WS(' ', l.given_name_1, l.given_name_2, l.family_name), '')),
+           o.names,
+           r.entity_type_text,
+           r.abn_status,
+           r.abn_status_from_date,
+           g.status,
+           g.status_from_date,
+           b.state_code,
+           b.postcode
+    FROM %1$I.abn_records r
+             LEFT JOIN %1$I.main_entity m ON m.abn = r.abn
+             LEFT JOIN %1$I.legal_entity l ON l.abn = r.abn
+             LEFT JOIN %1$I.gst_registrations g ON g.abn = r.abn
+             LEFT JOIN %1$I.business_addresses b ON b.abn = r.abn
+             %2$s
+    ON CONFLICT (abn) DO UPDATE SET name                 = EXCLUDED.name,
+                                    other_names          = EXCLUDED.other_names,
+                                    entity_type_text     = EXCLUDED.entity_type_text,
+                                    abn_status           = EXCLUDED.abn_status,
+                                    abn_status_from_date = EXCLUDED.abn_status_from_date,
+                                    gst_status           = EXCLUDED.gst_status,
+                                    gst_status_from_date = EXCLUDED.gst_status_from_date,
+                                    state_code           = EXCLUDED.state_code,
+                                    postcode             = EXCLUDED.postcode,
+                                    refreshed_at         = NOW()
+    $sql$, source_schema, CASE
+                              WHEN abns IS NOT NULL THEN FORMAT(
+                                      'LEFT JOIN LATERAL (SELECT STRING_AGG(e.text, '' '' ORDER BY e.id) AS names
+                                                          FROM %1$I.other_entity_names e
+                                                          WHERE e.abn = r.abn) o ON TRUE
+                                       WHERE r.abn = ANY ($1::CHAR(11)[])', source_schema)
+                              ELSE FORMAT(
+                                      'LEFT JOIN (SELECT e.abn, STRING_AGG(e.text, '' '' ORDER BY e.id) AS names
+                                                  FROM %1$I.other_entity_names e
+                                                  GROUP BY e.abn) o ON o.abn = r.abn', source_schema)
+        END) USING abns;
+
+    GET DIAGNOSTICS refreshed = ROW_COUNT;
+    RETURN refreshed;
+END;
+$$;
+
+-- Only the ingestion (service role) keeps the search table up to date
+REVOKE EXECUTE ON FUNCTION public.refresh_abn_search(TEXT[], TEXT) FROM PUBLIC, anon, authenticated;
+
+COMMENT ON FUNCTION public.refresh_abn_search(TEXT[], TEXT) IS 'Rebuild search rows for the given ABNs, or all ABNs when NULL';
@@ -0,0 +1,87 @@
+-- Replace the 0..n child rows of a batch by diffing them against what is
+-- already stored, rather than deleting and re-inserting every row
+-- Migration: 20251124090000_add_merge_child_rows
+
+SET search_path TO public;
+
+-- Make the child rows of each given ABN match the given rows (JSON arrays of
+-- table rows, as inserted), in one call. Only rows that differ are deleted or
+-- inserted, so unchanged rows keep their ids and leave no dead tuples.
+-- Duplicate rows are matched copy for copy. Returns the number of rows
+-- deleted plus inserted.
+CREATE OR REPLACE FUNCTION public.merge_child_rows(abns TEXT[],
+                                                   dgr_entries JSONB DEFAULT '[]',
+                                                   other_entity_names JSONB DEFAULT '[]') RETURNS INTEGER
+    LANGUAGE plpgsql
+    SET search_path = public AS
+$$
+DECLARE
+    merged  INTEGER := 0;
+    changed INTEGER;
+BEGIN
+    -- Planned per call against the batch. Rows are compared by a JSONB key of
+    -- their values, which treats NULLs as equal and can be hash joined
+    EXECUTE $sql$
+    WITH incoming AS (SELECT r.abn, r.status_from_date, r.status, r.type, r.text, k.key,
+                             ROW_NUMBER() OVER (PARTITION BY r.abn, k.key) AS copy
+                      FROM JSONB_POPULATE_RECORDSET(NULL::public.dgr_entries, $2) r,
+                           JSONB_BUILD_ARRAY(r.status_from_date, r.status, r.type, r.text) k(key)),
+         stored AS (SELECT d.id, d.abn, k.key,
+                           ROW_NUMBER() OVER (PARTITION BY d.abn, k.key ORDER BY d.id) AS copy
+                    FROM public.dgr_entries d,
+                         JSONB_BUILD_ARRAY(d.status_from_date, d.status, d.type, d.text) k(key)
+                    WHERE d.abn = ANY ($1::CHAR(11)[])),
+         removed AS (DELETE FROM public.dgr_entries d
+             USING stored s
+             WHERE d.id = s.id
+               AND NOT EXISTS (SELECT 1
+                               FROM incoming i
+                               WHERE i.abn = s.abn AND i.key = s.key AND i.copy = s.copy)
+             RETURNING 1),
+         added AS (INSERT INTO public.dgr_entries (abn, status_from_date, status, type, text)
+             SELECT i.abn, i.status_from_date, i.status, i.type, i.text
+             FROM incoming i
+             WHERE NOT EXISTS (SELECT 1
+                               FROM stored s
+                               WHERE s.abn = i.abn AND s.key = i.key AND s.copy = i.copy)
+             RETURNING 1)
+    SELECT (SELECT COUNT(*) FROM removed) + (SELECT COUNT(*) FROM added)
+    $sql$ INTO changed USING abns, COALESCE(dgr_entries, '[]');
+    merged := merged + changed;
+
+    EXECUTE $sql$
+    WITH incoming AS (SELECT r.abn, r.type, r.text, k.key,
+                             ROW_NUMBER() OVER (PARTITION BY r.abn, k.key) AS copy
+                      FROM JSONB_POPULATE_RECORDSET(NULL::public.other_entity_names, $2) r,
+                           JSONB_BUILD_ARRAY(r.type, r.text) k(key)),
+         stored AS (SELECT o.id, o.abn, k.key,
+                           ROW_NUMBER() OVER (PARTITION BY o.abn, k.key ORDER BY o.id) AS copy
+                    FROM public.other_entity_names o,
+                         JSONB_BUILD_ARRAY(o.type, o.text) k(key)
+                    WHERE o.abn = ANY ($1::CHAR(11)[])),
+         removed AS (DELETE FROM public.other_entity_names o
+             USING stored s
+             WHERE o.id = s.id
+               AND NOT EXISTS (SELECT 1
+                               FROM incoming i
+                               WHERE i.abn = s.abn AND i.key = s.key AND i.copy = s.copy)
+             RETURNING 1),
+         added AS (INSERT INTO public.other_entity_names (abn, type, text)
+             SELECT i.abn, i.type, i.text
+             FROM incoming i
+             WHERE NOT EXISTS (SELECT 1
+                               FROM stored s
+                               WHERE s.abn = i.abn AND s.key = i.key AND s.copy = i.copy)
+             RETURNING 1)
+    SELECT (SELECT COUNT(*) FROM removed) + (SELECT COUNT(*) FROM added)
+    $sql$ INTO changed USING abns, COALESCE(other_entity_names, '[]');
+    merged := merged + changed;
+
+    RETURN merged;
+END;
+$$;
+
+-- Only the ingestion (service role) writes the child tables
+REVOKE EXECUTE ON FUNCTION public.merge_child_rows(TEXT[], JSONB, JSONB) FROM PUBLIC, anon, authenticated;
+
+COMMENT ON FUNCTION public.merge_child_rows(TEXT[], JSONB, JSONB) IS 'Replace the 0..n child rows of the given ABNs, writing only rows that differ';
@@ -0,0 +1,41 @@
+-- A version number for the loaded dataset, bumped by every completed
+-- ingestion run, so read-side caches know when their entries are stale
+-- Migration: 20251125090000_add_dataset_version
+
+SET search_path TO public;
+
+-- Dataset Version (exactly one row)
+CREATE TABLE IF NOT EXISTS public.dataset_version
+(
+    id        BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    version   BIGINT      NOT NULL DEFAULT 1,
+    loaded_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+INSERT INTO public.dataset_version (id)
+VALUES (TRUE)
+ON CONFLICT (id) DO NOTHING;
+
+ALTER TABLE public.dataset_version
+    ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Allow public read access" ON public.dataset_version FOR SELECT USING (true);
+
+GRANT SELECT ON public.dataset_version TO anon, authenticated;
+
+-- Mark a load as complete. Returns the new version.
+CREATE OR REPLACE FUNCTION public.bump_dataset_version() RETURNS BIGINT
+    LANGUAGE sql
+    SET search_path = public AS
+$$
+UPDATE public.dataset_version
+SET version   = version + 1,
+    loaded_at = NOW()
+RETURNING version;
+$$;
+
+-- Only the ingestion (service role) completes loads
+REVOKE EXECUTE ON FUNCTION public.bump_dataset_version() FROM PUBLIC, anon, authenticated;
+
+COMMENT ON TABLE public.dataset_version IS 'Version of the loaded dataset, bumped by each completed ingestion run';
+COMMENT ON FUNCTION public.bump_dataset_version() IS 'Bump the dataset version once a load has completed';